@@ -0,0 +1,216 @@
+import itertools
+import os
+import threading
+import time
+
+from database import DatabaseManager
+
+# The copies are kept as a bitmap (one byte per ID) unless the IDs are this much sparser than the copies
+DENSE_LOOKUP_FACTOR = 4
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_active_rental_index(db_manager):
+    """
+    Returns the ActiveRentalIndex shared by everything in this process that uses the same database file,
+    creating it if needed (like the connection pool, see get_pool).
+
+    Parameters:
+    - db_manager (DatabaseManager): The database.
+
+    Returns:
+    - ActiveRentalIndex: The shared index.
+    """
+    with _indexes_lock:
+        index = _indexes.get(db_manager.gamerental_db_file)
+        if index is None:
+            index = ActiveRentalIndex(db_manager)
+            _indexes[db_manager.gamerental_db_file] = index
+        return index
+
+
+class ActiveRentalIndex:
+
+    def __init__(self, db_manager=None, max_staleness=0.05):
+        """
+        Initializes an in-memory index of which copies exist, who is renting each rented copy and how many
+        games each customer has out, so availability and rental limit checks need no queries against Rental.
+        It is loaded from the database on first use and kept up to date by GameRent and GameReturn.
+
+        Other processes (or anything else writing Rental or Games) bump the single row of ActiveRentalVersion
+        through triggers, and the index is reloaded whenever that row is not the version it was last brought up
+        to. Renting and returning read the row inside their write transaction, so they are always exact. The
+        read-only checks read it again after any commit in this process, and otherwise only once it is
+        max_staleness seconds old, so they usually run no query at all and may miss another process's write
+        for that long.
+
+        Parameters:
+        - db_manager (DatabaseManager): The database to use, by default GameRental.db.
+        - max_staleness (float): How long the read-only checks trust the index without reading the version row.
+        """
+        self.db_manager = db_manager or DatabaseManager("GameRental.db")
+        self.max_staleness = max_staleness
+        self.checked = 0.0  # When the version row was last read (time.monotonic())
+        self.write_commits = None  # The pool's write_commits then, so writes in this process are never missed
+        self.lock = threading.RLock()  # Held while the index is checked or changed
+        self.version = None  # The (VERSION, WRITER) row of ActiveRentalVersion the index matches
+        self.games = bytearray()  # 1 at the ID (less first_game) of every copy
+        self.first_game = 0  # The lowest ID, so a shard's IDs (see ShardRouter) need no bigger bitmap than 1..n
+        self.sparse_games = None  # The IDs as a set instead, if they are too sparse for the bitmap
+        self.renters = {}  # The customer renting each rented copy, by game ID
+        self.active_counts = {}  # The number of games each customer has out
+        self.resyncs = 0
+        self.writer_prefix = os.urandom(6).hex()  # Tells this process's writes apart from other processes'
+        self.writes = itertools.count()
+
+    def validate(self, cursor=None):
+        """
+        Reloads the index if the database changed in a way it did not see. Must be called with the lock held.
+
+        Parameters:
+        - cursor (sqlite3.Cursor): The cursor of an open transaction, which always reads the version row. Without
+          one the row is read on its own, and only after a commit in this process or once it is max_staleness
+          seconds old.
+        """
+        now = time.monotonic()
+        write_commits = self.db_manager.pool.write_commits
+
+        if self.version is None:
+            self.db_manager.create_tables()
+        elif cursor is None and write_commits == self.write_commits and now - self.checked < self.max_staleness:
+            return
+
+        if cursor is not None:
+            if cursor.execute("SELECT VERSION, WRITER FROM ActiveRentalVersion").fetchone() != self.version:
+                self.resync(cursor)
+        else:
+            version = self.db_manager.connect().execute("SELECT VERSION, WRITER FROM ActiveRentalVersion").fetchone()
+            if version != self.version:
+                # Read the version and the rentals from the same snapshot
+                with self.db_manager.transaction() as cursor:
+                    self.resync(cursor)
+
+        self.checked = now
+        self.write_commits = write_commits
+
+    def resync(self, cursor):
+        """
+        Loads the copies and open rentals from the database.
+
+        Parameters:
+        - cursor (sqlite3.Cursor): The cursor of an open transaction.
+        """
+        self.version = cursor.execute("SELECT VERSION, WRITER FROM ActiveRentalVersion").fetchone()
+
+        ids = [row[0] for row in cursor.execute("SELECT ID FROM Games")]
+        smallest, largest = min(ids, default=0), max(ids, default=-1)
+        if largest - smallest < DENSE_LOOKUP_FACTOR * len(ids) + 1024:
+            self.first_game = smallest
+            self.games = bytearray(largest - smallest + 1)
+            for game_id in ids:
+                self.games[game_id - smallest] = 1
+            self.sparse_games = None
+        else:
+            self.games = bytearray()
+            self.sparse_games = set(ids)
+
+        open_rentals = cursor.execute("SELECT ID, CUSTOMERID FROM Rental WHERE RETURNDATE IS NULL").fetchall()
+        self.renters = dict(open_rentals)
+        self.active_counts = {}
+        for _, customer_id in open_rentals:
+            self.active_counts[customer_id] = self.active_counts.get(customer_id, 0) + 1
+
+        self.resyncs += 1
+
+    def game_exists(self, game_id):
+        """
+        Checks if a copy exists, from memory. Must be called with the lock held and the index validated.
+        """
+        if self.sparse_games is not None:
+            return game_id in self.sparse_games
+        if not isinstance(game_id, int):
+            return False
+        position = game_id - self.first_game
+        return 0 <= position < len(self.games) and self.games[position] == 1
+
+    def record(self, cursor, rented=(), returned=()):
+        """
+        Applies rentals and returns just written in the caller's transaction, and marks the version row so this
+        index (and only this index) still counts as current afterwards. If the transaction is rolled back the
+        mark is too, and the next check reloads the index. Must be called with the lock held.
+
+        Parameters:
+        - cursor (sqlite3.Cursor): The cursor of the transaction that wrote them.
+        - rented (list): (customer_id, game_id) tuples of new rentals.
+        - returned (list): (customer_id, game_id) tuples of returned rentals.
+        """
+        if not rented and not returned:
+            return
+
+        # Marked before the index is touched, so a failed statement cannot leave a changed index looking current
+        writer = f"{self.writer_prefix}-{next(self.writes)}"
+        cursor.execute("UPDATE ActiveRentalVersion SET WRITER = ?", (writer,))
+        version = cursor.execute("SELECT VERSION, WRITER FROM ActiveRentalVersion").fetchone()
+
+        for customer_id, game_id in rented:
+            self.renters[game_id] = customer_id
+            self.active_counts[customer_id] = self.active_counts.get(customer_id, 0) + 1
+
+        for customer_id, game_id in returned:
+            self.renters.pop(game_id, None)
+            count = self.active_counts.pop(customer_id, 0) - 1
+            if count > 0:
+                self.active_counts[customer_id] = count
+
+        self.version = version
+
+    def invalidate(self):
+        """
+        Makes the next check reload the index, e.g. after a write that did not change what the index expected.
+        """
+        self.version = None
+        self.checked = 0.0
+
+    def is_game_available(self, game_id):
+        """
+        Checks if a copy exists and is not currently rented.
+
+        Parameters:
+        - game_id (int): The ID of the game.
+
+        Returns:
+        - bool: True if the game can be rented.
+        """
+        with self.lock:
+            self.validate()
+            return self.game_exists(game_id) and game_id not in self.renters
+
+    def active_rental_count(self, customer_id):
+        """
+        Returns how many games a customer currently has out.
+
+        Parameters:
+        - customer_id (int): The ID of the customer.
+
+        Returns:
+        - int: The number of open rentals.
+        """
+        with self.lock:
+            self.validate()
+            return self.active_counts.get(customer_id, 0)
+
+    def renter(self, game_id):
+        """
+        Returns the customer currently renting a copy.
+
+        Parameters:
+        - game_id (int): The ID of the game.
+
+        Returns:
+        - int or None: The customer ID, or None if the copy is not rented.
+        """
+        with self.lock:
+            self.validate()
+            return self.renters.get(game_id)
@@ -0,0 +1,413 @@
+import heapq
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from analyticsSnapshot import NO_ID, SCAN_CHUNK, game_positions, get_analytics_snapshot
+from database import DatabaseManager
+
+# One recommendation: how many customers who rented the title asked about also rented this one
+AlsoRented = namedtuple("AlsoRented", ["title", "genre", "customers"])
+
+# Each customer only counts towards the pairs among the titles they rented most recently, this many at most.
+# Without a cap one regular who has rented most of the catalog adds a pair for every two titles in it.
+RECENT_TITLES = 50
+
+# Changes since the last build are kept in dictionaries, and merged into the arrays once there are this many
+MERGE_AT = 200000
+
+# Catching up on more new rentals than this one by one would take longer than building again
+FOLD_LIMIT = 50000
+
+# Pairs expanded at once while building, which bounds the memory a build needs
+PAIR_CHUNK = 4000000
+
+# The longest top list kept per title once it has been looked up
+TOP_CACHE = 20
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_also_rented_index(db_manager):
+    """
+    Returns the AlsoRentedIndex shared by everything in this process that uses the same database file,
+    creating it if needed.
+
+    Parameters:
+    - db_manager (DatabaseManager): The database.
+
+    Returns:
+    - AlsoRentedIndex: The shared index.
+    """
+    with _indexes_lock:
+        index = _indexes.get(db_manager.gamerental_db_file)
+        if index is None:
+            index = AlsoRentedIndex(db_manager)
+            _indexes[db_manager.gamerental_db_file] = index
+        return index
+
+
+class AlsoRentedIndex:
+
+    def __init__(self, db_manager=None, recent_titles=RECENT_TITLES, max_staleness=1.0):
+        """
+        Initializes a "customers who rented X also rented Y" index: a sparse title-by-title matrix counting
+        the customers who rented both titles of each pair. It is built with NumPy from the rental columns of the
+        analytics snapshot on first use, and afterwards only the rentals added since are folded in.
+
+        Parameters:
+        - db_manager (DatabaseManager): The database to use, by default GameRental.db.
+        - recent_titles (int): How many of each customer's most recently rented titles count towards the pairs.
+        - max_staleness (float): How long lookups are answered before the snapshot is checked for new rentals, in seconds.
+        """
+        self.db_manager = db_manager or DatabaseManager("GameRental.db")
+        self.snapshot = get_analytics_snapshot(self.db_manager)
+        self.recent_titles = recent_titles
+        self.max_staleness = max_staleness
+        self.lock = threading.RLock()
+        self.generation = None  # The snapshot generation the index was built from
+        self.rentals = 0  # The number of snapshot rentals folded in so far
+        self.checked = 0.0  # When the snapshot was last checked (time.monotonic())
+        self.titles = []  # (title, genre) of each title code, as in the snapshot
+        self.title_codes = {}  # The codes of each title name (one per genre it is sold in)
+
+        # The matrix in CSR form: the titles rented together with title a are indices[indptr[a]:indptr[a + 1]]
+        # (ascending) and counts holds how many customers rented both
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.empty(0, dtype=np.int32)
+        self.counts = np.empty(0, dtype=np.int32)
+
+        self.pending = {}  # Changes not merged into the arrays yet, {title code: {other title code: change}}
+        self.pending_size = 0
+        self.recent = {}  # The title codes each customer rented most recently, oldest first
+        self.top = {}  # The top list of each title looked up since its row last changed
+
+    def refresh(self, force=False):
+        """
+        Folds in the rentals added since the last refresh, at most every max_staleness seconds unless forced.
+        Builds the index again if the snapshot had to be exported again (e.g. the tables were reloaded).
+        Must be called with the lock held.
+
+        Parameters:
+        - force (bool): Check the snapshot even if it was checked less than max_staleness seconds ago.
+        """
+        now = time.monotonic()
+        if not force and self.generation is not None and now - self.checked < self.max_staleness:
+            return
+
+        self.snapshot.refresh()
+        self.snapshot.open()
+        manifest, columns = self.snapshot.manifest, self.snapshot.columns
+
+        if len(self.snapshot.titles) != len(self.titles):
+            self.titles = list(self.snapshot.titles)
+            self.title_codes = {}
+            for code, (title, _) in enumerate(self.titles):
+                self.title_codes.setdefault(title, []).append(code)
+
+        new_rentals = manifest["rentals"] - self.rentals
+        if manifest["generation"] != self.generation or new_rentals < 0 or new_rentals > FOLD_LIMIT:
+            self.build(columns)
+        elif new_rentals:
+            self.fold_in(columns, self.rentals, manifest["rentals"])
+
+        self.generation = manifest["generation"]
+        self.rentals = manifest["rentals"]
+        self.checked = now
+
+    def rental_titles(self, columns, start, end):
+        """
+        Looks up the customer and title code of the rentals in [start, end), leaving out rentals of games that
+        are not in the catalog or without a customer.
+
+        Returns:
+        - tuple: (customer IDs, title codes, positions of the rentals in the snapshot).
+        """
+        customers, titles, rows = [], [], []
+        for chunk in range(start, end, SCAN_CHUNK):
+            stop = min(chunk + SCAN_CHUNK, end)
+            positions = game_positions(columns["id"], columns["game_id"][chunk:stop])
+            customer_ids = np.asarray(columns["customer_id"][chunk:stop])
+            keep = (positions >= 0) & (customer_ids != NO_ID)
+            customers.append(customer_ids[keep])
+            titles.append(columns["title"][positions[keep]].astype(np.int64))
+            rows.append(np.flatnonzero(keep) + chunk)
+
+        if not customers:
+            return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.int64)
+        return np.concatenate(customers), np.concatenate(titles), np.concatenate(rows)
+
+    def build(self, columns):
+        """
+        Builds the matrix from every rental in the snapshot. Each customer's rentals are reduced to their
+        most recent distinct titles, and every ordered pair of those adds one to the matrix, counted with
+        np.unique over pair keys (row * titles + column) a chunk of customers at a time.
+        """
+        size = len(self.titles)
+        customers, titles, rows = self.rental_titles(columns, 0, len(columns["game_id"]))
+
+        # Recency is the rental day, ties (and undated rentals) in the order they were added
+        days = np.asarray(columns["rental_day"])[rows]
+        recency = np.empty(len(rows), dtype=np.int64)
+        recency[np.argsort(days, kind="stable")] = np.arange(len(rows))
+        del days, rows
+
+        # Each (customer, title) once, at its latest rental
+        customer_ids, customer_codes = np.unique(customers, return_inverse=True)
+        del customers
+        pairs, recency = sort_pairs(customer_codes.astype(np.int64) * max(size, 1) + titles, recency, len(recency))
+        del customer_codes, titles
+        latest = np.append(pairs[1:] != pairs[:-1], True)
+        pairs, recency = pairs[latest], recency[latest]
+        del latest
+        title_at = np.zeros(max(len(recency), int(recency.max(initial=-1)) + 1), dtype=np.int32)
+        title_at[recency] = pairs % max(size, 1)
+        customer_codes = pairs // max(size, 1)
+        del pairs
+
+        # Newest first within each customer (recency is unique now, so it gives back the title)
+        customer_codes, recency = sort_pairs(customer_codes, len(title_at) - 1 - recency, len(title_at))
+        titles = title_at[len(title_at) - 1 - recency].astype(np.int64)
+        del recency, title_at
+
+        # Keeping each customer's first recent_titles
+        starts = np.flatnonzero(np.append(True, customer_codes[1:] != customer_codes[:-1]))
+        sizes = np.diff(np.append(starts, len(titles)))
+        keep = np.arange(len(titles)) - np.repeat(starts, sizes) < self.recent_titles
+        customer_codes, titles = customer_codes[starts], titles[keep]
+        sizes = np.minimum(sizes, self.recent_titles)
+        starts = np.cumsum(sizes) - sizes
+        del keep
+
+        title_list = titles.tolist()
+        self.recent = {customer_id: title_list[start:start + count][::-1]
+                       for customer_id, start, count in zip(customer_ids[customer_codes].tolist(),
+                                                            starts.tolist(), sizes.tolist())}
+
+        keys, counts = [], []
+        # Customers split so each chunk expands at most PAIR_CHUNK pairs
+        expanded = np.cumsum(sizes.astype(np.int64) ** 2)
+        first = 0
+        while first < len(sizes):
+            last = max(int(np.searchsorted(expanded, expanded[first] - sizes[first] ** 2 + PAIR_CHUNK, side="right")),
+                       first + 1)
+            chunk_keys = pair_keys(titles, starts[first:last], sizes[first:last], size)
+            chunk_keys, chunk_counts = np.unique(chunk_keys, return_counts=True)
+            keys.append(chunk_keys)
+            counts.append(chunk_counts)
+            first = last
+
+        if keys:
+            keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+            counts = np.bincount(inverse, weights=np.concatenate(counts)).astype(np.int64)
+        else:
+            keys, counts = np.empty(0, np.int64), np.empty(0, np.int64)
+
+        self.set_matrix(keys, counts, size)
+        self.pending = {}
+        self.pending_size = 0
+        self.top = {}
+
+    def set_matrix(self, keys, counts, size):
+        """
+        Stores sorted pair keys (row * size + column) and their counts as the CSR arrays.
+        """
+        rows = keys // max(size, 1)
+        self.indptr = np.searchsorted(rows, np.arange(size + 1)).astype(np.int64)
+        self.indices = (keys % max(size, 1)).astype(np.int32)
+        self.counts = counts.astype(np.int32)
+
+    def fold_in(self, columns, start, end):
+        """
+        Adds the rentals in [start, end) of the snapshot one by one, in the order they were made.
+        """
+        customers, titles, _ = self.rental_titles(columns, start, end)
+        for customer_id, title in zip(customers.tolist(), titles.tolist()):
+            self.add(customer_id, title)
+
+        if self.pending_size >= MERGE_AT:
+            self.merge()
+
+    def add(self, customer_id, title):
+        """
+        Records that a customer rented a title: it becomes their most recent title, paired with each of
+        their other recent titles, and the oldest one drops out (with its pairs) once there are too many.
+        """
+        recent = self.recent.setdefault(customer_id, [])
+        if title in recent:
+            recent.remove(title)
+            recent.append(title)
+            return
+
+        for other in recent:
+            self.change(title, other, 1)
+        recent.append(title)
+
+        if len(recent) > self.recent_titles:
+            oldest = recent.pop(0)
+            for other in recent:
+                self.change(oldest, other, -1)
+
+    def change(self, title, other, change):
+        """
+        Changes the count of a pair of titles, in both directions.
+        """
+        for row, column in ((title, other), (other, title)):
+            pending = self.pending.setdefault(row, {})
+            if column not in pending:
+                self.pending_size += 1
+            pending[column] = pending.get(column, 0) + change
+            self.top.pop(row, None)
+
+    def merge(self):
+        """
+        Merges the pending changes into the CSR arrays.
+        """
+        size = len(self.titles)
+        rows = np.repeat(np.arange(len(self.indptr) - 1, dtype=np.int64), np.diff(self.indptr))
+        changes = [(row * size + column, change) for row, columns in self.pending.items()
+                   for column, change in columns.items()]
+        keys = np.concatenate([rows * size + self.indices, np.array([key for key, _ in changes], dtype=np.int64)])
+        counts = np.concatenate([self.counts, np.array([change for _, change in changes], dtype=np.int64)])
+
+        keys, inverse = np.unique(keys, return_inverse=True)
+        counts = np.bincount(inverse, weights=counts).astype(np.int64)
+        nonzero = counts > 0
+
+        self.set_matrix(keys[nonzero], counts[nonzero], size)
+        self.pending = {}
+        self.pending_size = 0
+
+    def row(self, title):
+        """
+        Returns the counts of every title rented together with a title.
+
+        Returns:
+        - tuple: (other title codes, counts) as arrays, or a dict of them if there are pending changes.
+        """
+        if title < len(self.indptr) - 1:
+            start, end = self.indptr[title], self.indptr[title + 1]
+            others, counts = self.indices[start:end], self.counts[start:end]
+        else:
+            others, counts = np.empty(0, np.int32), np.empty(0, np.int32)
+
+        pending = self.pending.get(title)
+        if not pending:
+            return others, counts
+
+        merged = dict(zip(others.tolist(), counts.tolist()))
+        for other, change in pending.items():
+            merged[other] = merged.get(other, 0) + change
+        return merged
+
+    def top_titles(self, title, top_n):
+        """
+        Returns the titles most often rented together with a title, cached until its row changes.
+
+        Returns:
+        - list: (title code, customers) tuples, most customers first, ties in title code order.
+        """
+        cached = self.top.get(title)
+        if cached is not None and (top_n <= len(cached) or len(cached) < TOP_CACHE):
+            return cached[:top_n]
+
+        count = max(top_n, TOP_CACHE)
+        row = self.row(title)
+        if isinstance(row, dict):
+            best = heapq.nsmallest(count, ((-customers, other) for other, customers in row.items() if customers > 0))
+            best = [(other, -customers) for customers, other in best]
+        else:
+            others, counts = row
+            order = np.lexsort((others, -counts.astype(np.int64)))[:count]
+            best = list(zip(others[order].tolist(), counts[order].tolist()))
+
+        if count == TOP_CACHE:
+            self.top[title] = best
+        return best[:top_n]
+
+    def also_rented(self, title, genre=None, top_n=5):
+        """
+        Finds the titles most often rented by customers who rented a title ("customers who rented X also
+        rented Y"). Looked-up titles are answered from memory, the index is only brought up to date with
+        the snapshot every max_staleness seconds.
+
+        Parameters:
+        - title (str): The title, as stored (lowercase with underscores).
+        - genre (str): Its genre, if the title is sold in more than one.
+        - top_n (int): The number of titles to return.
+
+        Returns:
+        - list: AlsoRented (title, genre, customers) tuples, most customers first. Empty for an unknown title.
+        """
+        with self.lock:
+            self.refresh()
+
+            codes = [code for code in self.title_codes.get(title, ()) if genre is None or self.titles[code][1] == genre]
+            if not codes:
+                return []
+
+            if len(codes) == 1:
+                best = self.top_titles(codes[0], top_n)
+            else:
+                # A title sold in several genres: add up the rows of each
+                combined = {}
+                for code in codes:
+                    row = self.row(code)
+                    items = row.items() if isinstance(row, dict) else zip(row[0].tolist(), row[1].tolist())
+                    for other, customers in items:
+                        if other not in codes:
+                            combined[other] = combined.get(other, 0) + customers
+                best = heapq.nsmallest(top_n, ((-customers, other) for other, customers in combined.items()
+                                               if customers > 0))
+                best = [(other, -customers) for customers, other in best]
+
+            return [AlsoRented(self.titles[other][0], self.titles[other][1], customers) for other, customers in best]
+
+
+def sort_pairs(major, minor, minor_size):
+    """
+    Sorts two arrays of non-negative integers together, by major and then minor. Packed into one int64 key
+    when they fit, which sorts much faster than np.lexsort.
+
+    Parameters:
+    - major (ndarray): The first sort key.
+    - minor (ndarray): The second sort key, below minor_size.
+    - minor_size (int): One more than the largest possible minor value.
+
+    Returns:
+    - tuple: (major, minor) sorted.
+    """
+    if not len(major):
+        return major, minor
+    if (int(major.max()) + 1) * max(minor_size, 1) < 2 ** 62:
+        keys = np.sort(major.astype(np.int64) * minor_size + minor)
+        return keys // minor_size, keys % minor_size
+    order = np.lexsort((minor, major))
+    return major[order], minor[order]
+
+
+def pair_keys(titles, starts, sizes, size):
+    """
+    Lists every ordered pair of different titles within each group of titles, as row * size + column keys.
+
+    Parameters:
+    - titles (ndarray): The title codes, grouped.
+    - starts (ndarray): Where each group starts in titles.
+    - sizes (ndarray): The length of each group.
+    - size (int): The number of title codes.
+
+    Returns:
+    - ndarray: The pair keys, sizes[i] * (sizes[i] - 1) of them for group i.
+    """
+    # Element e of a group of m is paired with all m elements of its group, then pairs with itself are dropped
+    element_sizes = np.repeat(sizes, sizes)
+    element_starts = np.repeat(starts, sizes)
+    elements = np.arange(int(starts[0]), int(starts[-1] + sizes[-1]), dtype=np.int64)
+    left = np.repeat(elements, element_sizes)
+    offsets = np.arange(len(left), dtype=np.int64) - np.repeat(np.cumsum(element_sizes) - element_sizes, element_sizes)
+    right = np.repeat(element_starts, element_sizes) + offsets
+    different = left != right
+    return titles[left[different]] * size + titles[right[different]]
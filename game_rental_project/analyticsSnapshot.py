@@ -0,0 +1,656 @@
+import argparse
+import json
+import os
+import threading
+import time
+from datetime import date
+
+import numpy as np
+
+from database import DatabaseManager
+
+# Each column is a raw little-endian array in its own file, opened with np.memmap.
+# Files only ever grow, so appending new rows never disturbs a reader of the rows before them.
+GAME_COLUMNS = {"id": "<i8", "title": "<i4", "genre": "<i4", "price": "<f8"}
+RENTAL_COLUMNS = {"game_id": "<i8", "rental_day": "<i4", "customer_id": "<i8"}
+
+# The table columns the snapshot is exported from. None of them change once a row is inserted (returning a game
+# only sets RETURNDATE), so they also fingerprint the last exported row of each table.
+SOURCE_COLUMNS = {"Games": "ID, TITLE, GENRE, PURCHASEPRICE", "Rental": "ID, RENTALDATE, CUSTOMERID"}
+
+# Marks a rental whose game or customer ID is not a whole number
+NO_ID = -1
+
+# Rental days are days since 1970-01-01, this marks a rental without a (parseable) date
+NO_DAY = -1
+
+FETCH_SIZE = 100000
+
+# Rentals are scanned this many at a time, so a scan of any history needs a few tens of MB at most
+SCAN_CHUNK = 1000000
+
+# Bumped when the file layout changes, older snapshots are then exported again
+SNAPSHOT_VERSION = 3
+
+# A dense ID -> position lookup table is used unless the IDs are this much sparser than the number of games
+DENSE_LOOKUP_FACTOR = 4
+
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def get_analytics_snapshot(db_manager):
+    """
+    Returns the AnalyticsSnapshot shared by everything in this process that uses the same database file,
+    creating it if needed, so two users of the snapshot never append to its column files at the same time.
+
+    Parameters:
+    - db_manager (DatabaseManager): The database.
+
+    Returns:
+    - AnalyticsSnapshot: The shared snapshot, kept in the default directory.
+    """
+    with _snapshots_lock:
+        snapshot = _snapshots.get(db_manager.gamerental_db_file)
+        if snapshot is None:
+            snapshot = AnalyticsSnapshot(db_manager=db_manager)
+            _snapshots[db_manager.gamerental_db_file] = snapshot
+        return snapshot
+
+
+class AnalyticsSnapshot:
+
+    def __init__(self, directory=None, db_manager=None):
+        """
+        Initializes a columnar snapshot of the Games and Rental tables for the analytics, so popularity and
+        purchase recommendations are computed with NumPy over memory-mapped columns instead of
+        SQLite rows and DataFrames built from them.
+
+        Parameters:
+        - directory (str): Where the column files are kept, by default next to the database file.
+        - db_manager (DatabaseManager): The database to snapshot, by default GameRental.db.
+        """
+        self.db_manager = db_manager or DatabaseManager("GameRental.db")
+        self.directory = directory or self.db_manager.gamerental_db_file + ".columns"
+        self.manifest = None
+        self.columns = {}
+        self.titles = []   # (title, genre) of each title code
+        self.genres = []   # genre of each genre code
+        self.names = {}    # The same as object arrays, for picking names out with NumPy indexing
+        self.scanned = None  # The last scan of the rentals, with what it was asked for
+        self.lock = threading.RLock()  # Held while refreshing
+
+    def path(self, name, generation=None):
+        """
+        Returns the path of a snapshot file. Column files carry the generation of the full export they belong to.
+        """
+        if generation is None:
+            return os.path.join(self.directory, name)
+        return os.path.join(self.directory, f"{name}.{generation}.bin")
+
+    def read_manifest(self):
+        """
+        Reads the manifest describing the current snapshot.
+
+        Returns:
+        - dict or None: The manifest, or None if there is no snapshot yet.
+        """
+        try:
+            with open(self.path("manifest.json")) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def write_manifest(self, manifest):
+        """
+        Replaces the manifest in one step, so a reader sees either the old or the new snapshot, never half of one.
+        """
+        temporary = self.path("manifest.json.tmp")
+        with open(temporary, "w") as file:
+            json.dump(manifest, file)
+        os.replace(temporary, self.path("manifest.json"))
+
+    def refresh(self, full=False):
+        """
+        Brings the snapshot up to date. New games and rentals are appended to the column files; the whole
+        snapshot is only exported again when the tables were reloaded from other files, or when full is True.
+        Returns don't change the snapshot, only rentals and purchases do. Rows deleted or edited by hand
+        outside the application are not noticed, refresh with full=True after doing that.
+
+        Parameters:
+        - full (bool): Export everything again even if appending would do.
+
+        Returns:
+        - dict: The mode used ("full", "append" or "unchanged") and the number of games and rentals added.
+        """
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            manifest = self.read_manifest()
+
+            # One read transaction, so games and rentals are snapshotted at the same point in time
+            with self.db_manager.transaction() as cursor:
+                if full or manifest is None or not self.can_append(cursor, manifest):
+                    manifest = self.export(cursor, manifest)
+                    mode = "full"
+                    added = {"games": manifest["games"], "rentals": manifest["rentals"]}
+                else:
+                    added = self.append(cursor, manifest)
+                    mode = "append" if added["games"] or added["rentals"] else "unchanged"
+
+            if mode != "unchanged":
+                self.manifest = None  # Reopened on the next query
+            return {"mode": mode, **added}
+
+    def can_append(self, cursor, manifest):
+        """
+        Checks that the rows already in the snapshot are still in the tables: the tables were not reloaded
+        since (the ingest manifest is the same) and the exported columns of the last row of each are unchanged.
+        Both are single-row lookups, so checking costs the same however long the history is.
+        """
+        if manifest.get("version") != SNAPSHOT_VERSION or manifest.get("ingest") != ingest_state(cursor):
+            return False
+
+        for table, key in (("Games", "games"), ("Rental", "rentals")):
+            tail = cursor.execute(f"SELECT {SOURCE_COLUMNS[table]} FROM {table} WHERE rowid = ?",
+                                  (manifest[key + "_rowid"],)).fetchone()
+            if manifest[key] and list(tail or []) != manifest[key + "_tail"]:
+                return False
+
+        return True
+
+    def export(self, cursor, previous):
+        """
+        Exports both tables into a new generation of column files, then switches the manifest over to it.
+
+        Returns:
+        - dict: The new manifest.
+        """
+        generation = previous["generation"] + 1 if previous else 1
+        manifest = {"version": SNAPSHOT_VERSION, "generation": generation, "ingest": ingest_state(cursor),
+                    "games": 0, "rentals": 0, "games_rowid": 0, "rentals_rowid": 0,
+                    "games_tail": None, "rentals_tail": None}
+        self.titles, self.genres = [], []
+
+        for name in list(GAME_COLUMNS) + list(RENTAL_COLUMNS):
+            open(self.path(name, generation), "wb").close()
+
+        self.append(cursor, manifest, write_manifest=False)
+        self.write_manifest(manifest)
+
+        # Readers that already opened the old generation keep their memory maps, removing the files is safe
+        if previous:
+            for name in list(GAME_COLUMNS) + list(RENTAL_COLUMNS):
+                if os.path.exists(self.path(name, previous["generation"])):
+                    os.remove(self.path(name, previous["generation"]))
+
+        return manifest
+
+    def append(self, cursor, manifest, write_manifest=True):
+        """
+        Appends the games and rentals added since the manifest was written.
+
+        Returns:
+        - dict: The number of games and rentals appended.
+        """
+        # The names are only needed to encode new games
+        new_games = cursor.execute("SELECT 1 FROM Games WHERE rowid > ? LIMIT 1", (manifest["games_rowid"],)).fetchone()
+        if write_manifest and new_games:
+            self.load_dictionaries(manifest)
+
+        title_codes = {key: code for code, key in enumerate(self.titles)}
+        genre_codes = {genre: code for code, genre in enumerate(self.genres)}
+        known = (len(self.titles), len(self.genres))
+
+        def encode(values, codes, names):
+            # Codes are handed out in order of first appearance, and new ones are added to the dictionary
+            encoded = np.empty(len(values), dtype=np.int32)
+            for index, value in enumerate(values):
+                code = codes.get(value)
+                if code is None:
+                    code = codes[value] = len(names)
+                    names.append(value)
+                encoded[index] = code
+            return encoded
+
+        def game_chunk(rows):
+            ids, titles, genres, prices = zip(*rows)
+            return {
+                "id": np.array(ids, dtype=np.int64),
+                "title": encode(list(zip(titles, genres)), title_codes, self.titles),
+                "genre": encode(genres, genre_codes, self.genres),
+                "price": np.array(prices, dtype=object).astype(np.float64),
+            }
+
+        def rental_chunk(rows):
+            game_ids, dates, customer_ids = zip(*rows)
+            return {
+                "game_id": whole_numbers(game_ids),
+                "rental_day": rental_days(dates),
+                "customer_id": whole_numbers(customer_ids),
+            }
+
+        games = self.append_rows(cursor, manifest, "games", "Games", GAME_COLUMNS, game_chunk)
+        rentals = self.append_rows(cursor, manifest, "rentals", "Rental", RENTAL_COLUMNS, rental_chunk)
+
+        # The names only need writing when a game brought a new title or genre
+        if not write_manifest or (len(self.titles), len(self.genres)) != known:
+            self.write_dictionaries(manifest)
+        if write_manifest and (games or rentals):
+            self.write_manifest(manifest)
+
+        return {"games": games, "rentals": rentals}
+
+    def append_rows(self, cursor, manifest, key, table, dtypes, to_columns):
+        """
+        Appends the rows of a table past the manifest's last rowid to its column files, a chunk at a time.
+
+        Returns:
+        - int: The number of rows appended.
+        """
+        generation = manifest["generation"]
+        files = {}
+        for name in dtypes:
+            files[name] = open(self.path(name, generation), "r+b")
+            # Drop anything written after the manifest, e.g. by an append that was interrupted
+            files[name].truncate(manifest[key] * np.dtype(dtypes[name]).itemsize)
+            files[name].seek(0, os.SEEK_END)
+
+        appended = 0
+        last_rowid = manifest[key + "_rowid"]
+        columns = SOURCE_COLUMNS[table]
+        try:
+            rows = cursor.execute(f"SELECT rowid, {columns} FROM {table} WHERE rowid > ? ORDER BY rowid", (last_rowid,))
+            while True:
+                chunk = rows.fetchmany(FETCH_SIZE)
+                if not chunk:
+                    break
+                for name, values in to_columns([row[1:] for row in chunk]).items():
+                    files[name].write(values.astype(dtypes[name]).tobytes())
+                appended += len(chunk)
+                last_rowid, *tail = chunk[-1]
+        finally:
+            for file in files.values():
+                file.close()
+
+        if appended:
+            manifest[key] += appended
+            manifest[key + "_rowid"] = last_rowid
+            manifest[key + "_tail"] = tail
+        return appended
+
+    def load_dictionaries(self, manifest):
+        """
+        Reads the title and genre names behind the codes in the title and genre columns.
+        """
+        with open(self.path(f"dictionaries.{manifest['generation']}.json")) as file:
+            dictionaries = json.load(file)
+        self.titles = [tuple(key) for key in dictionaries["titles"]]
+        self.genres = dictionaries["genres"]
+
+    def write_dictionaries(self, manifest):
+        """
+        Writes the title and genre names. Codes are only ever added, so the old file stays valid until replaced.
+        """
+        name = self.path(f"dictionaries.{manifest['generation']}.json")
+        with open(name + ".tmp", "w") as file:
+            file.write(json.dumps({"titles": self.titles, "genres": self.genres}))
+        os.replace(name + ".tmp", name)
+
+        previous = self.path(f"dictionaries.{manifest['generation'] - 1}.json")
+        if os.path.exists(previous):
+            os.remove(previous)
+
+    def open(self):
+        """
+        Memory-maps the columns of the current snapshot, refreshing it first if there is none yet.
+        """
+        manifest = self.read_manifest()
+        if manifest is None:
+            self.refresh()
+            manifest = self.read_manifest()
+
+        if manifest == self.manifest:
+            return
+
+        columns = {}
+        for key, dtypes in (("games", GAME_COLUMNS), ("rentals", RENTAL_COLUMNS)):
+            for name, dtype in dtypes.items():
+                if manifest[key]:
+                    columns[name] = np.memmap(self.path(name, manifest["generation"]), dtype=dtype, mode="r",
+                                              shape=(manifest[key],))
+                else:
+                    columns[name] = np.empty(0, dtype=dtype)
+
+        self.load_dictionaries(manifest)
+        self.names = {
+            "title": np.array([title for title, _ in self.titles], dtype=object),
+            "title_genre": np.array([genre for _, genre in self.titles], dtype=object),
+            "genre": np.array(self.genres, dtype=object),
+        }
+        self.columns = columns
+        self.manifest = manifest
+
+    def scan(self, as_of=None, edges=(), half_life_days=None, decay_window=None, totals=False):
+        """
+        Makes one pass over the rental columns, a chunk at a time, and counts every game's rentals by age
+        bucket, plus an exponentially decayed score and all-time totals if asked for. Rentals older than
+        anything asked for are dropped before they are looked up. The result of the last scan is cached until
+        the next refresh.
+
+        Parameters:
+        - as_of (date or str): The day ages are counted from, by default today. Later rentals are only counted in the totals.
+        - edges (tuple): Ascending ages in days, bucket i holds the rentals aged edges[i-1] up to edges[i].
+        - half_life_days (float): The half-life of the decayed score, None to skip it.
+        - decay_window (int): Only rentals younger than this many days count towards the decayed score.
+        - totals (bool): Also count every rental of every game, dated or not.
+
+        Returns:
+        - dict: "buckets" (games x len(edges) counts), "decayed" (per game, or None) and "total" (per game, or None).
+        """
+        self.open()
+        key = (self.manifest["generation"], self.manifest["rentals"], self.manifest["games"], day_number(as_of),
+               tuple(edges), half_life_days, decay_window, totals)
+        if self.scanned is not None and self.scanned[0] == key:
+            return self.scanned[1]
+
+        today = key[3]
+        game_ids = self.columns["id"]
+        games = len(game_ids)
+        buckets = len(edges)
+        edges = np.asarray(edges, dtype=np.int64)
+
+        # The oldest rental that can still count for something
+        if half_life_days:
+            horizon = decay_window
+        else:
+            horizon = int(edges[-1]) if buckets else 0
+
+        total = np.zeros(games, dtype=np.int64) if totals else None
+        bucketed = np.zeros(games * buckets, dtype=np.int64)
+        decayed = np.zeros(games, dtype=np.float64) if half_life_days else None
+
+        for start in range(0, len(self.columns["game_id"]), SCAN_CHUNK):
+            rented = self.columns["game_id"][start:start + SCAN_CHUNK]
+            days = self.columns["rental_day"][start:start + SCAN_CHUNK]
+
+            if total is not None:
+                positions = game_positions(game_ids, rented)
+                total += np.bincount(positions[positions >= 0], minlength=games)
+
+            ages = today - days.astype(np.int64)
+            keep = (days != NO_DAY) & (ages >= 0)
+            if horizon is not None:
+                keep &= ages < horizon
+            if not keep.any():
+                continue
+
+            positions = game_positions(game_ids, rented[keep])
+            known = positions >= 0
+            positions, ages = positions[known], ages[keep][known]
+
+            if buckets:
+                # Bucket i counts the ages below edges[i] that are not below edges[i-1]
+                bucket = np.searchsorted(edges, ages, side="right")
+                inside = bucket < buckets
+                bucketed += np.bincount(positions[inside] * buckets + bucket[inside], minlength=games * buckets)
+
+            if decayed is not None:
+                decayed += np.bincount(positions, weights=np.exp2(-ages / float(half_life_days)), minlength=games)
+
+        result = {"total": total, "buckets": bucketed.reshape(games, buckets), "decayed": decayed}
+        self.scanned = (key, result)
+        return result
+
+    def rentals_per_game(self):
+        """
+        Counts the rentals of every game in the snapshot, in the order of the games columns.
+        Rentals of games that are not in the catalog are left out, like the join in TitlePopularity.
+
+        Returns:
+        - ndarray: The number of rentals of each game.
+        """
+        return self.scan(totals=True)["total"]
+
+    def game_scores(self, window_days=None, half_life_days=None, as_of=None):
+        """
+        Scores every game: all its rentals, only those in the last window_days, or their decayed sum
+        where a rental half_life_days old counts half (only within the window if both are given).
+
+        Returns:
+        - ndarray: The score of each game, in the order of the games columns.
+        """
+        if half_life_days:
+            return self.scan(as_of, (), half_life_days, window_days)["decayed"]
+        if window_days:
+            return self.scan(as_of, (window_days,))["buckets"][:, 0]
+        return self.rentals_per_game()
+
+    def title_popularity(self, window_days=None, half_life_days=None, as_of=None):
+        """
+        Returns the popularity of every (title, genre) code and of every genre code, see game_scores.
+
+        Returns:
+        - tuple: (score per title code, score per genre code). Whole rentals unless decayed.
+        """
+        scores = self.game_scores(window_days, half_life_days, as_of)
+        titles = np.bincount(self.columns["title"], weights=scores, minlength=len(self.titles))
+        genres = np.bincount(self.columns["genre"], weights=scores, minlength=len(self.genres))
+        if not half_life_days:
+            titles, genres = titles.astype(np.int64), genres.astype(np.int64)
+        return titles, genres
+
+    def select_games_by_popularity(self, window_days=None, half_life_days=None, as_of=None):
+        """
+        Retrieves the games ordered by popularity, the same as GameSelect.select_games_by_popularity.
+        Popularity is all rentals by default, see game_scores for the window and decay.
+
+        Returns:
+        - DataFrame: Columns "Title", "Genre" and "Popularity", most popular first.
+        """
+        import pandas as pd
+
+        popularity, _ = self.title_popularity(window_days, half_life_days, as_of)
+        order = np.argsort(-popularity, kind="stable")
+
+        return pd.DataFrame({
+            "Title": self.names["title"][order],
+            "Genre": self.names["title_genre"][order],
+            "Popularity": popularity[order],
+        })
+
+    def select_popular_genres(self, window_days=None, half_life_days=None, as_of=None):
+        """
+        Retrieves the genres ordered by popularity, the same as GameSelect.select_popular_genres.
+        Popularity is all rentals by default, see game_scores for the window and decay.
+
+        Returns:
+        - DataFrame: Columns "Genre" and "Popularity", most popular first.
+        """
+        import pandas as pd
+
+        _, popularity = self.title_popularity(window_days, half_life_days, as_of)
+        order = np.argsort(-popularity, kind="stable")
+        return pd.DataFrame({"Genre": self.names["genre"][order], "Popularity": popularity[order]})
+
+    def select_games_for_purchase(self, budget, window_days=None, half_life_days=None, as_of=None):
+        """
+        Recommends how many copies of each game to buy, the same as GameSelect.select_games_for_purchase:
+        the budget is shared out in proportion to each title's popularity and divided by its average price.
+        Popularity is all rentals by default, see game_scores for the window and decay.
+
+        Parameters:
+        - budget (float): The amount available to spend.
+        - window_days (int): Only count rentals from the last this many days.
+        - half_life_days (float): Weigh rentals down by age, halving every this many days.
+        - as_of (date or str): The day the window and decay are counted back from, by default today.
+
+        Returns:
+        - DataFrame: Columns "Title", "Genre", "PurchasePrice" and "CopiesToBuy", most popular first.
+        """
+        import pandas as pd
+
+        columns = ["Title", "Genre", "PurchasePrice", "CopiesToBuy"]
+        popularity, _ = self.title_popularity(window_days, half_life_days, as_of)
+        total_rentals = popularity.sum()
+        if total_rentals <= 0:
+            return pd.DataFrame(columns=columns)
+
+        # Average price of each title, ignoring copies without a price like AVG() does
+        prices = self.columns["price"]
+        priced = ~np.isnan(prices)
+        price_sums = np.bincount(self.columns["title"], weights=np.where(priced, prices, 0), minlength=len(self.titles))
+        price_counts = np.bincount(self.columns["title"], weights=priced, minlength=len(self.titles))
+        average = np.divide(price_sums, price_counts, out=np.zeros(len(self.titles)), where=price_counts > 0)
+
+        copies = np.zeros(len(self.titles), dtype=np.int64)
+        has_price = average > 0
+        copies[has_price] = np.floor(popularity[has_price] / total_rentals * float(budget) / average[has_price])
+
+        order = np.argsort(-popularity, kind="stable")
+        return pd.DataFrame({
+            "Title": self.names["title"][order],
+            "Genre": self.names["title_genre"][order],
+            "PurchasePrice": average[order],
+            "CopiesToBuy": copies[order],
+        })
+
+    def popularity_trends(self, by="title", windows=(7, 30, 90), half_life_days=30, as_of=None):
+        """
+        Reports rolling, decayed and week-over-week popularity of every title or genre, all from one scan.
+
+        Parameters:
+        - by (str): "title" or "genre".
+        - windows (tuple): The rolling windows in days, each becomes a "LastN" column.
+        - half_life_days (float): The half-life of the "Decayed" column.
+        - as_of (date or str): The day everything is counted back from, by default today.
+
+        Returns:
+        - DataFrame: Title and Genre (or just Genre), "Total", a "LastN" column per window, "Decayed",
+                    "ThisWeek" (the last 7 days), "LastWeek" (the 7 before) and "WeekOverWeek" (their difference),
+                    highest decayed score first.
+        """
+        import pandas as pd
+
+        if by not in ("title", "genre"):
+            raise ValueError(f"Unknown trend level: {by}")
+
+        edges = sorted(set(windows) | {7, 14})
+        result = self.scan(as_of, tuple(edges), half_life_days, totals=True)
+        # Counts of rentals younger than each edge
+        younger = np.cumsum(result["buckets"], axis=1)
+
+        codes = self.columns[by]
+        size = len(self.titles) if by == "title" else len(self.genres)
+
+        def per_group(values):
+            return np.bincount(codes, weights=values, minlength=size)
+
+        if by == "title":
+            trends = {"Title": self.names["title"], "Genre": self.names["title_genre"]}
+        else:
+            trends = {"Genre": self.names["genre"]}
+
+        trends["Total"] = per_group(result["total"]).astype(np.int64)
+        for window in windows:
+            trends[f"Last{window}"] = per_group(younger[:, edges.index(window)]).astype(np.int64)
+        trends["Decayed"] = per_group(result["decayed"])
+        trends["ThisWeek"] = per_group(younger[:, edges.index(7)]).astype(np.int64)
+        trends["LastWeek"] = per_group(younger[:, edges.index(14)] - younger[:, edges.index(7)]).astype(np.int64)
+        trends["WeekOverWeek"] = trends["ThisWeek"] - trends["LastWeek"]
+
+        order = np.argsort(-trends["Decayed"], kind="stable")
+        return pd.DataFrame({name: values[order] for name, values in trends.items()})
+
+
+def ingest_state(cursor):
+    """
+    Returns what the tables were last loaded from, which changes whenever initialize_databases reloads them.
+    Only the Games and Rental entries count, importing the subscription file does not touch the snapshot.
+    """
+    return [list(row) for row in cursor.execute('''
+        SELECT SOURCE, SIZE, MTIME, HASH FROM IngestManifest WHERE SOURCE IN ('Games', 'Rental') ORDER BY SOURCE
+    ''')]
+
+
+def whole_numbers(values):
+    """
+    Converts IDs to an int64 array, NO_ID where an ID is not a whole number (or missing).
+    """
+    return np.array([value if isinstance(value, int) else NO_ID for value in values], dtype=np.int64)
+
+
+def rental_days(dates):
+    """
+    Converts ISO rental dates to days since 1970-01-01, NO_DAY where there is no date.
+    """
+    try:
+        days = np.array(dates, dtype="datetime64[D]")
+    except ValueError:
+        # Something other than an ISO date slipped in, convert one at a time
+        days = np.array([parse_day(value) for value in dates], dtype="datetime64[D]")
+
+    result = days.astype(np.int64)
+    result[np.isnat(days)] = NO_DAY
+    return result.astype(np.int32)
+
+
+def day_number(value=None):
+    """
+    Returns a date (or ISO date string) as days since 1970-01-01, today if value is None.
+    """
+    return int(np.datetime64(value if value is not None else date.today(), "D").astype(np.int64))
+
+
+def parse_day(value):
+    try:
+        return np.datetime64(value, "D")
+    except (TypeError, ValueError):
+        return np.datetime64("NaT")
+
+
+def game_positions(game_ids, rented):
+    """
+    Finds the position in the games columns of the game of each rental.
+
+    Parameters:
+    - game_ids (ndarray): The ID of each game.
+    - rented (ndarray): The game ID of each rental.
+
+    Returns:
+    - ndarray: The position of each rental's game, -1 if it is not in the catalog.
+    """
+    if len(game_ids) == 0:
+        return np.full(len(rented), -1, dtype=np.int64)
+
+    low, high = int(game_ids.min()), int(game_ids.max())
+    if high - low <= DENSE_LOOKUP_FACTOR * len(game_ids) + 1024:
+        # IDs are close to low..low + n (1..n, or a shard's range), so index a lookup table directly
+        lookup = np.full(high - low + 2, -1, dtype=np.int64)
+        lookup[game_ids - low] = np.arange(len(game_ids))
+        return lookup[np.clip(np.asarray(rented, dtype=np.int64) - low, -1, high - low + 1)]
+
+    order = np.argsort(game_ids, kind="stable")
+    sorted_ids = game_ids[order]
+    found = np.searchsorted(sorted_ids, rented)
+    found = np.minimum(found, len(sorted_ids) - 1)
+    return np.where(sorted_ids[found] == rented, order[found], -1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Snapshot the Games and Rental tables into memory-mapped columns "
+                                                 "for the analytics, appending what was added since last time.")
+    parser.add_argument("--db", default="GameRental.db", help="the database file")
+    parser.add_argument("--directory", help="where to keep the snapshot, by default next to the database")
+    parser.add_argument("--full", action="store_true", help="export everything again instead of appending")
+    args = parser.parse_args()
+
+    snapshot = AnalyticsSnapshot(args.directory, DatabaseManager(args.db))
+    start = time.perf_counter()
+    result = snapshot.refresh(full=args.full)
+    print(f"{result['mode']}: {result['games']} games and {result['rentals']} rentals added "
+          f"to {snapshot.directory} in {time.perf_counter() - start:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from database import DatabaseManager
+from gameSearch import GameSearch
+from syntheticCatalog import build_catalog
+
+
+def time_call(function, repeats):
+    """
+    Times repeated calls of a function.
+
+    Returns:
+    - float: The median time of one call in milliseconds.
+    """
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the LIKE title search with the full-text search indexes.")
+    parser.add_argument("--rows", type=int, default=1000000, help="number of game copies in the catalog")
+    parser.add_argument("--repeats", type=int, default=20, help="timed runs per query")
+    parser.add_argument("--limit", type=int, default=20, help="page size returned by each search")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_manager = DatabaseManager(os.path.join(directory, "benchmark.db"))
+
+        start = time.perf_counter()
+        titles = build_catalog(db_manager, args.rows)
+        print(f"Built {args.rows} rows in {time.perf_counter() - start:.1f}s")
+
+        game_search = GameSearch(db_manager, initialize=False)
+        target = titles[len(titles) // 2]
+        typed = target.split("_")[0] + " " + target.split("_")[1][:3]
+        misspelt = target.replace("_", " ")[1:]
+
+        like_query = "SELECT * FROM Games WHERE TITLE LIKE ? LIMIT ?"
+        cases = [
+            ("LIKE substring (old path)", lambda: db_manager.execute(like_query, ("%" + target + "%", args.limit))),
+            ("FTS exact title", lambda: game_search.find_games(target, limit=args.limit)),
+            ("FTS words/prefix", lambda: game_search.find_games(typed, limit=args.limit)),
+            ("FTS with platform filter", lambda: game_search.find_games(typed, platform="xbox", limit=args.limit)),
+            ("Trigram typo-tolerant", lambda: game_search.find_games(misspelt, limit=args.limit)),
+        ]
+
+        for name, function in cases:
+            print(f"{name:28s} {time_call(function, args.repeats):8.2f} ms")
+
+        db_manager.pool.close_all()
+
+
+if __name__ == "__main__":
+    main()
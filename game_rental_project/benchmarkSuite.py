@@ -0,0 +1,241 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from analyticsSnapshot import AnalyticsSnapshot
+from database import DatabaseManager
+from gameRent import GameRent
+from gameReturn import GameReturn
+from gameSearch import GameSearch
+from gameSelect import GameSelect
+from generateData import generate_dataset, is_active
+from importBudget import measure_imports
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+
+def measure(function, repeats):
+    """
+    Times repeated calls of a function. Anything the function prints is discarded.
+
+    Parameters:
+    - function (callable): Called with no arguments.
+    - repeats (int): The number of timed calls.
+
+    Returns:
+    - dict: The median, minimum and maximum time of one call in milliseconds, and the number of calls.
+    """
+    timings = []
+    for _ in range(repeats):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            function()
+            timings.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "median_ms": round(statistics.median(timings), 3),
+        "min_ms": round(min(timings), 3),
+        "max_ms": round(max(timings), 3),
+        "repeats": repeats,
+    }
+
+
+def measure_each(function, arguments):
+    """
+    Times one call of a function per argument tuple, for operations that change the data and so cannot be
+    repeated with the same arguments.
+    """
+    calls = iter(arguments)
+    return measure(lambda: function(*next(calls)), len(arguments))
+
+
+def rental_pairs(db_manager, count, customers):
+    """
+    Picks (customer, copy) pairs that are sure to rent successfully: copies that are not out, each going to
+    a different active customer who has nothing rented.
+    """
+    busy = {row[0] for row in db_manager.execute("SELECT DISTINCT CUSTOMERID FROM Rental WHERE RETURNDATE IS NULL")}
+    free_customers = [customer for customer in range(1, customers + 1)
+                      if is_active(customer) and customer not in busy and str(customer) not in busy]
+    free_games = [row[0] for row in db_manager.execute(
+        "SELECT ID FROM Games WHERE ID NOT IN (SELECT ID FROM Rental WHERE RETURNDATE IS NULL) LIMIT ?", (count,))]
+
+    return list(zip(free_customers, free_games))
+
+
+def run_suite(directory, games, rentals, customers, repeats, seed=1):
+    """
+    Generates a dataset, loads it and times every user-facing operation against it.
+
+    Returns:
+    - dict: The timings of each operation, keyed by name.
+    """
+    data = generate_dataset(directory, games=games, rentals=rentals, customers=customers, seed=seed)
+    db_file = os.path.join(directory, "benchmark.db")
+    results = {}
+
+    # Start-up cost of a rent/return/search terminal, in fresh interpreters
+    import_timings = [measure_imports(runs=1)[0] for _ in range(repeats)]
+    results["import rent/return/search modules"] = {
+        "median_ms": round(statistics.median(import_timings), 3),
+        "min_ms": round(min(import_timings), 3),
+        "max_ms": round(max(import_timings), 3),
+        "repeats": repeats,
+    }
+
+    # Loading is timed on a fresh database each time, then once more with nothing changed
+    def load_fresh():
+        DatabaseManager(db_file).pool.close_all()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db_file + suffix):
+                os.remove(db_file + suffix)
+        DatabaseManager(db_file).initialize_databases(data["games_file"], data["rentals_file"])
+
+    results["initialize_databases"] = measure(load_fresh, max(1, min(repeats, 3)))
+
+    db_manager = DatabaseManager(db_file)
+    results["initialize_databases (unchanged files)"] = measure(
+        lambda: db_manager.initialize_databases(data["games_file"], data["rentals_file"]), repeats)
+
+    game_search = GameSearch(db_manager, initialize=False)
+    game_rent = GameRent(db_manager, data["subscriptions_file"])
+    game_return = GameReturn(db_manager)
+    game_select = GameSelect(db_manager)
+    game_rent.subscriptions.refresh()
+
+    # Search for the most rented titles, the way a customer would type them
+    popular = [row[0] for row in db_manager.execute(
+        "SELECT TITLE FROM TitlePopularity ORDER BY POPULARITY DESC LIMIT ?", (repeats,))]
+    searches = [(title.replace("_", " "),) for title in popular]
+    results["search_games_by_title"] = measure_each(lambda title: game_search.search_games_by_title(title, limit=20),
+                                                    searches)
+
+    pairs = rental_pairs(db_manager, max(repeats, 20), customers)
+    results["rent_game"] = measure_each(game_rent.rent_game, pairs)
+    results["return_game"] = measure_each(game_return.return_game, pairs)
+
+    results["select_games_by_popularity"] = measure(
+        lambda: game_select.select_games_by_popularity(show_plot=False), repeats)
+    results["select_popular_genres"] = measure(lambda: game_select.select_popular_genres(show_plot=False), repeats)
+    results["select_games_for_purchase"] = measure(lambda: game_select.select_games_for_purchase(10000), repeats)
+
+    # The same analytics on the columnar snapshot
+    snapshot = AnalyticsSnapshot(os.path.join(directory, "snapshot"), db_manager)
+    results["analytics snapshot refresh (full)"] = measure(lambda: snapshot.refresh(full=True), max(1, min(repeats, 3)))
+    results["analytics snapshot refresh (unchanged)"] = measure(snapshot.refresh, repeats)
+    results["snapshot select_games_by_popularity"] = measure(snapshot.select_games_by_popularity, repeats)
+    results["snapshot select_popular_genres"] = measure(snapshot.select_popular_genres, repeats)
+    results["snapshot select_games_for_purchase"] = measure(lambda: snapshot.select_games_for_purchase(10000), repeats)
+    results["view_rental_history"] = measure(game_rent.view_rental_history, repeats)
+    results["rental_history_page (one customer)"] = measure(
+        lambda: game_rent.rental_history_page(customer_id=pairs[0][0], limit=100), repeats)
+
+    db_manager.pool.close_all()
+    return results
+
+
+def compare(results, baseline, tolerance, min_difference_ms=1.0):
+    """
+    Compares the median time of each operation with a baseline run.
+
+    Parameters:
+    - results (dict): The timings of this run.
+    - baseline (dict): The timings of the baseline run.
+    - tolerance (float): How many times slower than the baseline an operation may get before it is a regression.
+    - min_difference_ms (float): Differences smaller than this are treated as noise.
+
+    Returns:
+    - dict: The baseline median, the ratio and whether it regressed, for each operation in both runs.
+    """
+    comparison = {}
+
+    for name, timing in results.items():
+        if name not in baseline:
+            continue
+
+        before = baseline[name]["median_ms"]
+        after = timing["median_ms"]
+        ratio = after / before if before else None
+
+        comparison[name] = {
+            "baseline_median_ms": before,
+            "ratio": round(ratio, 3) if ratio is not None else None,
+            "regression": ratio is not None and ratio > tolerance and after - before > min_difference_ms,
+        }
+
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every operation against a generated dataset and "
+                                                 "compare the results with a baseline.")
+    parser.add_argument("--rentals", type=int, default=100000, help="rentals in the history, 10^3 to 10^7")
+    parser.add_argument("--games", type=int, default=10000, help="game copies in the catalog")
+    parser.add_argument("--customers", type=int, default=5000)
+    parser.add_argument("--repeats", type=int, default=5, help="timed calls per operation")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the JSON results to this file instead of printing them")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="results of an earlier run to compare with")
+    parser.add_argument("--update-baseline", action="store_true", help="save this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="slow-down ratio counted as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit with status 1 if anything regressed")
+    args = parser.parse_args()
+
+    scale = {"games": args.games, "rentals": args.rentals, "customers": args.customers, "seed": args.seed}
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = run_suite(directory, args.games, args.rentals, args.customers, args.repeats, args.seed)
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "scale": scale,
+        "environment": {
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+
+    # Only runs at the same scale are comparable
+    baseline = None
+    if args.baseline and os.path.exists(args.baseline) and not args.update_baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline.get("scale") == scale:
+            report["baseline"] = {"file": args.baseline, "created": baseline.get("created")}
+            report["comparison"] = compare(results, baseline["results"], args.tolerance)
+        else:
+            print(f"Baseline {args.baseline} was run at a different scale, not comparing.", file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as file:
+            file.write(text + "\n")
+        print(f"Saved baseline to {args.baseline}", file=sys.stderr)
+
+    regressions = [name for name, entry in report.get("comparison", {}).items() if entry["regression"]]
+    for name in regressions:
+        print(f"REGRESSION: {name} is {report['comparison'][name]['ratio']}x the baseline", file=sys.stderr)
+
+    if regressions and args.fail_on_regression:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
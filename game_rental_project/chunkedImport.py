@@ -0,0 +1,236 @@
+import csv
+import os
+import pickle
+from collections import deque
+from itertools import islice
+
+# The size of the byte ranges a source file is parsed in. Each is parsed in one go, so together with the number of
+# chunks in flight this bounds how much of the file is in memory at once.
+CHUNK_SIZE = 4 << 20
+
+# Chunks queued per worker process, enough to keep the workers busy while the writer inserts the previous chunk
+CHUNKS_PER_WORKER = 2
+
+
+def chunk_ranges(file_name, start, chunk_size=CHUNK_SIZE):
+    """
+    Splits a file into byte ranges of about chunk_size bytes that each end on a full line.
+
+    Parameters:
+    - file_name (str): The file.
+    - start (int): The offset of the first line to include, e.g. just past the header.
+    - chunk_size (int): The size of each range before it is extended to the end of its last line.
+
+    Returns:
+    - list: (begin, end) byte offsets.
+    """
+    size = os.path.getsize(file_name)
+    ranges = []
+
+    with open(file_name, "rb") as file:
+        begin = start
+        while begin < size:
+            end = begin + chunk_size
+            if end < size:
+                file.seek(end)
+                end += len(file.readline())
+            ranges.append((begin, min(end, size)))
+            begin = end
+
+    return ranges
+
+
+def parse_chunk(file_name, begin, end, parse_line):
+    """
+    Parses the lines in one byte range of a file. Runs in a worker process, so it only takes picklable arguments.
+
+    Parameters:
+    - file_name (str): The file.
+    - begin (int): The offset of the first line.
+    - end (int): The offset just past the last line.
+    - parse_line (callable): Turns a line into a row tuple, returning None or raising ValueError for a malformed line.
+
+    Returns:
+    - tuple: (rows, rejects, line count). Rejects are (line index within the chunk, line, reason) tuples.
+    """
+    with open(file_name, "rb") as file:
+        file.seek(begin)
+        data = file.read(end - begin)
+
+    undecodable = set()
+    try:
+        lines = data.decode("utf-8").split("\n")
+    except UnicodeDecodeError:
+        # Only decode line by line when the fast path fails, so one bad byte costs one line rather than the chunk
+        lines = []
+        for line in data.split(b"\n"):
+            try:
+                lines.append(line.decode("utf-8"))
+            except UnicodeDecodeError:
+                undecodable.add(len(lines))
+                lines.append(line.decode("utf-8", "replace"))
+
+    # A chunk ends on a newline, which leaves an empty last piece
+    if lines and lines[-1] == "":
+        lines.pop()
+
+    rows = []
+    rejects = []
+
+    for index, line in enumerate(lines):
+        if not line.strip():
+            continue  # Blank lines (e.g. at the end of the file) are not malformed rows
+        if index in undecodable:
+            rejects.append((index, line, "not valid UTF-8"))
+            continue
+
+        try:
+            row = parse_line(line)
+        except ValueError as e:
+            rejects.append((index, line, str(e)))
+            continue
+
+        if row is None:
+            rejects.append((index, line, "malformed line"))
+        else:
+            rows.append(row)
+
+    return rows, rejects, len(lines)
+
+
+def is_picklable(value):
+    """
+    Checks whether a value can be sent to a worker process, e.g. a parse function rather than a bound method
+    of an object holding database connections.
+    """
+    try:
+        pickle.dumps(value)
+        return True
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return False
+
+
+def parse_file(file_name, start, parse_line, workers=None, chunk_size=CHUNK_SIZE):
+    """
+    Parses a source file chunk by chunk, in a pool of worker processes when it is larger than one chunk.
+    Chunks are yielded in file order with at most a few per worker parsed ahead, so memory stays bounded
+    however large the file is.
+
+    Parameters:
+    - file_name (str): The file.
+    - start (int): The offset of the first line to parse.
+    - parse_line (callable): See parse_chunk. Must be picklable (a module-level function or a partial of one)
+      for the chunks to be parsed in other processes, otherwise they are parsed in this one.
+    - workers (int): The number of worker processes, by default one per CPU.
+    - chunk_size (int): See chunk_ranges.
+
+    Returns:
+    - generator: (line index of the chunk's first line counted from start, rows, rejects) tuples.
+    """
+    ranges = chunk_ranges(file_name, start, chunk_size)
+    workers = workers or os.cpu_count() or 1
+    first_line = 0
+
+    if workers <= 1 or len(ranges) <= 1 or not is_picklable(parse_line):
+        for begin, end in ranges:
+            rows, rejects, line_count = parse_chunk(file_name, begin, end, parse_line)
+            yield first_line, rows, rejects
+            first_line += line_count
+        return
+
+    # Imported here, only files larger than a chunk need them
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    # Spawned rather than forked workers, forking a process that runs database threads can deadlock the child
+    context = multiprocessing.get_context("spawn")
+    ranges = iter(ranges)
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        pending = deque(executor.submit(parse_chunk, file_name, begin, end, parse_line)
+                        for begin, end in islice(ranges, workers * CHUNKS_PER_WORKER))
+
+        while pending:
+            rows, rejects, line_count = pending.popleft().result()
+
+            following = next(ranges, None)
+            if following is not None:
+                pending.append(executor.submit(parse_chunk, file_name, *following, parse_line))
+
+            yield first_line, rows, rejects
+            first_line += line_count
+
+
+def count_lines(file_name, end):
+    """
+    Counts the lines in the first end bytes of a file.
+    """
+    count = 0
+    with open(file_name, "rb") as file:
+        while file.tell() < end:
+            block = file.read(min(1 << 20, end - file.tell()))
+            if not block:
+                break
+            count += block.count(b"\n")
+    return count
+
+
+class Quarantine:
+
+    def __init__(self, source_file, start, quarantine_file=None):
+        """
+        Collects the malformed lines of a source file in a CSV file next to it, with the line number and the reason
+        each was rejected. The file is only created once there is something to put in it.
+
+        Parameters:
+        - source_file (str): The file being loaded.
+        - start (int): The offset loading starts at. Lines already loaded from before it keep their quarantine
+          entries, a load from the start of the file replaces them.
+        - quarantine_file (str): The quarantine file, by default the source file name plus ".quarantine.csv".
+        """
+        self.source_file = source_file
+        self.start = start
+        self.quarantine_file = quarantine_file or source_file + ".quarantine.csv"
+        self.first_line = None
+        self.file = None
+        self.writer = None
+        self.count = 0
+
+        if start == 0 and os.path.exists(self.quarantine_file):
+            os.remove(self.quarantine_file)
+
+    def add(self, first_line, rejects):
+        """
+        Records the rejected lines of one chunk.
+
+        Parameters:
+        - first_line (int): The chunk's first line index, as yielded by parse_file.
+        - rejects (list): (line index within the chunk, line, reason) tuples.
+        """
+        if not rejects:
+            return
+
+        if self.file is None:
+            # Line numbers count from 1 and include the header, appended loads first count the lines they skip
+            self.first_line = count_lines(self.source_file, self.start) + 1 if self.start else 2
+            exists = os.path.exists(self.quarantine_file)
+            self.file = open(self.quarantine_file, "a", newline="", encoding="utf-8")
+            self.writer = csv.writer(self.file)
+            if not exists:
+                self.writer.writerow(["Line", "Reason", "Text"])
+
+        for index, line, reason in rejects:
+            self.writer.writerow([self.first_line + first_line + index, reason, line])
+        self.count += len(rejects)
+
+    def close(self):
+        """
+        Closes the quarantine file.
+
+        Returns:
+        - int: The number of lines quarantined by this load, for the caller to report.
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        return self.count
@@ -1,201 +1,1266 @@
+import functools
+import os
+import random
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
 
+from queryMetrics import InstrumentedConnection, QueryMetrics
+
+
+# Dates are stored as ISO-8601 strings (YYYY-MM-DD) so they sort and range-query correctly.
+ISO_DATE_FORMAT = "%Y-%m-%d"
+
+# The formats each source file writes its dates in, tried in order. Declaring them per file
+# avoids guessing whether an ambiguous date like 10/08/2022 is day-first or month-first.
+GAME_INFO_DATE_FORMATS = ("%m/%d/%Y", ISO_DATE_FORMAT)
+RENTAL_HISTORY_DATE_FORMATS = ("%d/%m/%Y", ISO_DATE_FORMAT)
+DEFAULT_DATE_FORMATS = ("%d/%m/%Y", ISO_DATE_FORMAT)
+
+
+@functools.lru_cache(maxsize=65536)
+def normalize_date(date_str, formats=DEFAULT_DATE_FORMATS):
+    """
+    Converts a date string to ISO-8601. Results are memoized, since the same dates repeat across many rows.
+
+    Parameters:
+    - date_str (str): The date string to convert.
+    - formats (tuple): The strptime formats the date may be written in, tried in order.
+
+    Returns:
+    - str or None: The ISO date, or None if the input is None or matches none of the formats.
+    """
+    if date_str is None:
+        return None
+
+    for date_format in formats:
+        try:
+            return datetime.strptime(date_str, date_format).strftime(ISO_DATE_FORMAT)
+        except ValueError:
+            continue
+
+    return None
+
+
+def normalize_date_column(values, formats=DEFAULT_DATE_FORMATS):
+    """
+    Converts a whole column of date strings to ISO-8601, parsing each distinct value only once.
+
+    Parameters:
+    - values (iterable): The date strings.
+    - formats (tuple): The strptime formats the dates may be written in.
+
+    Returns:
+    - list: The ISO dates, in the same order.
+    """
+    values = list(values)
+    converted = {value: normalize_date(value, formats) for value in set(values)}
+    return [converted[value] for value in values]
+
+
+def normalize_id(value):
+    """
+    Converts an ID as typed at a terminal (e.g. " 12") to the integer the database stores.
+
+    Parameters:
+    - value: The ID.
+
+    Returns:
+    - int or str: The integer ID, or the stripped text if it is not a whole number.
+    """
+    text = str(value).strip()
+    try:
+        return int(text)
+    except ValueError:
+        return text
+
+
+def split_fields(line, count):
+    """
+    Splits one line of a source file on commas, stripping each field and turning empty ones into None.
+
+    Parameters:
+    - line (str): The line.
+    - count (int): The number of fields the line must have.
+
+    Returns:
+    - list: The fields. Raises ValueError if there are not exactly count of them.
+    """
+    fields = [field.strip() or None for field in line.split(",")]
+
+    if len(fields) != count:
+        raise ValueError(f"expected {count} fields, found {len(fields)}")
+
+    return fields
+
+
+def parse_source_date(date_str, formats, name):
+    """
+    Converts an optional date field to ISO-8601.
+
+    Returns:
+    - str or None: The ISO date, or None if the field is empty. Raises ValueError if it is not a date.
+    """
+    if date_str is None:
+        return None
+
+    date = normalize_date(date_str, formats)
+    if date is None:
+        raise ValueError(f"{name} is not a date: {date_str}")
+    return date
+
+
+def parse_game_row(line, date_formats=GAME_INFO_DATE_FORMATS):
+    """
+    Splits and cleans one line of the games information file. A module-level function rather than a
+    DatabaseManager method so the chunked importer's worker processes can call it (see chunkedImport).
+
+    Parameters:
+    - line (str): A line from the games information file.
+    - date_formats (tuple): The formats the purchase date may be written in.
+
+    Returns:
+    - tuple: (ID, PLATFORM, GENRE, TITLE, PURCHASEPRICE, PURCHASEDATE). Raises ValueError saying what is wrong
+      with a malformed line.
+    """
+    game_id, platform, genre, title, purchase_price, purchase_date = split_fields(line, 6)
+
+    try:
+        game_id = int(game_id)
+    except (ValueError, TypeError):
+        raise ValueError(f"game ID is not a whole number: {game_id}")
+
+    for name, value in (("platform", platform), ("genre", genre), ("title", title)):
+        if value is None:
+            raise ValueError(f"missing {name}")
+
+    purchase_date = parse_source_date(purchase_date, date_formats, "purchase date")
+
+    # Handing missing purchase price value (setting to 0 if missing)
+    if purchase_price is None:
+        purchase_price = 0.0
+    else:
+        try:
+            purchase_price = float(purchase_price)
+        except ValueError:
+            raise ValueError(f"purchase price is not a number: {purchase_price}")
+
+    # Normalizing by putting everything in lowercase and removing "'"
+    platform = platform.lower().replace("'", "")
+    genre = genre.lower().replace("'", "")
+    title = title.lower().replace("'", "")
+
+    return (game_id, platform, genre, title, purchase_price, purchase_date)
+
+
+def parse_rental_row(line, date_formats=RENTAL_HISTORY_DATE_FORMATS):
+    """
+    Splits and cleans one line of the rental history file, see parse_game_row.
+
+    Parameters:
+    - line (str): A line from the rental history file.
+    - date_formats (tuple): The formats the rental and return dates may be written in.
+
+    Returns:
+    - tuple: (ID, RENTALDATE, RETURNDATE, CUSTOMERID). Raises ValueError saying what is wrong with a malformed line.
+    """
+    game_id, rental_date, return_date, customer_id = split_fields(line, 4)
+
+    try:
+        game_id = int(game_id)
+    except (ValueError, TypeError):
+        raise ValueError(f"game ID is not a whole number: {game_id}")
+
+    if rental_date is None:
+        raise ValueError("missing rental date")
+    if customer_id is None:
+        raise ValueError("missing customer ID")
+
+    # An empty return date is a rental that is still open
+    rental_date = parse_source_date(rental_date, date_formats, "rental date")
+    return_date = parse_source_date(return_date, date_formats, "return date")
+
+    return (game_id, rental_date, return_date, customer_id)
+
+
+# Recomputes the materialized popularity tables from scratch (used by the migration and for backfills)
+POPULARITY_REBUILD_SQL = [
+    '''
+    INSERT OR REPLACE INTO TitlePopularity (TITLE, GENRE, POPULARITY)
+    SELECT G.TITLE, G.GENRE, COUNT(R.ID) FROM Games G LEFT JOIN Rental R ON R.ID = G.ID GROUP BY G.TITLE, G.GENRE
+    ''',
+    '''
+    INSERT OR REPLACE INTO GenrePopularity (GENRE, POPULARITY)
+    SELECT G.GENRE, COUNT(R.ID) FROM Games G LEFT JOIN Rental R ON R.ID = G.ID GROUP BY G.GENRE
+    ''',
+]
+
+
+# Each migration is (version, description, statements). Databases record the version they
+# are at in PRAGMA user_version and DatabaseManager.migrate() applies anything newer.
+SCHEMA_MIGRATIONS = [
+    (1, "Base tables", [
+        '''
+        CREATE TABLE IF NOT EXISTS Games (
+            ID INTEGER,
+            PLATFORM TEXT,
+            GENRE TEXT,
+            TITLE TEXT,
+            PURCHASEPRICE REAL,
+            PURCHASEDATE DATE
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS Rental (
+            ID INTEGER,
+            RENTALDATE DATE,
+            RETURNDATE DATE,
+            CUSTOMERID INTEGER
+        )
+        ''',
+        # Records what was loaded from each source file so unchanged files can be skipped
+        '''
+        CREATE TABLE IF NOT EXISTS IngestManifest (
+            SOURCE TEXT PRIMARY KEY,
+            PATH TEXT,
+            SIZE INTEGER,
+            MTIME REAL,
+            HASH TEXT
+        )
+        ''',
+    ]),
+    (2, "Games primary key and lookup indexes", [
+        '''
+        CREATE TABLE Games_v2 (
+            ID INTEGER PRIMARY KEY,
+            PLATFORM TEXT,
+            GENRE TEXT,
+            TITLE TEXT,
+            PURCHASEPRICE REAL,
+            PURCHASEDATE DATE
+        )
+        ''',
+        # Later rows win if an old database holds duplicate IDs
+        '''
+        INSERT OR REPLACE INTO Games_v2 (ID, PLATFORM, GENRE, TITLE, PURCHASEPRICE, PURCHASEDATE)
+        SELECT ID, PLATFORM, GENRE, TITLE, PURCHASEPRICE, PURCHASEDATE FROM Games WHERE ID IS NOT NULL ORDER BY rowid
+        ''',
+        "DROP TABLE Games",
+        "ALTER TABLE Games_v2 RENAME TO Games",
+        "CREATE INDEX IF NOT EXISTS idx_games_title ON Games (TITLE)",
+        "CREATE INDEX IF NOT EXISTS idx_rental_game ON Rental (ID)",
+        "CREATE INDEX IF NOT EXISTS idx_rental_active ON Rental (ID) WHERE RETURNDATE IS NULL",
+        "CREATE INDEX IF NOT EXISTS idx_rental_customer ON Rental (CUSTOMERID, RETURNDATE)",
+    ]),
+    (3, "Full-text title search index", [
+        # Word index for token and prefix matching ("_" and "-" separate words, short prefixes are indexed too)
+        "CREATE VIRTUAL TABLE GamesSearch USING fts5(TITLE, content='Games', content_rowid='ID', prefix='2 3 4')",
+        # The distinct words in the index, used to correct misspelt search words
+        "CREATE VIRTUAL TABLE GamesSearchVocab USING fts5vocab(GamesSearch, 'row')",
+        '''
+        CREATE TRIGGER games_search_insert AFTER INSERT ON Games BEGIN
+            INSERT INTO GamesSearch (rowid, TITLE) VALUES (new.ID, new.TITLE);
+        END
+        ''',
+        '''
+        CREATE TRIGGER games_search_delete AFTER DELETE ON Games BEGIN
+            INSERT INTO GamesSearch (GamesSearch, rowid, TITLE) VALUES ('delete', old.ID, old.TITLE);
+        END
+        ''',
+        '''
+        CREATE TRIGGER games_search_update AFTER UPDATE OF ID, TITLE ON Games BEGIN
+            INSERT INTO GamesSearch (GamesSearch, rowid, TITLE) VALUES ('delete', old.ID, old.TITLE);
+            INSERT INTO GamesSearch (rowid, TITLE) VALUES (new.ID, new.TITLE);
+        END
+        ''',
+        "INSERT INTO GamesSearch (GamesSearch) VALUES ('rebuild')",
+    ]),
+    (4, "Subscriptions table", [
+        '''
+        CREATE TABLE IF NOT EXISTS Subscriptions (
+            CUSTOMERID TEXT PRIMARY KEY,
+            SUBSCRIPTIONTYPE TEXT,
+            STARTDATE TEXT,
+            ENDDATE TEXT
+        )
+        ''',
+    ]),
+    (5, "Store dates as ISO-8601", [
+        f'''
+        UPDATE {table} SET {column} = substr({column}, 7, 4) || '-' || substr({column}, 4, 2) || '-' || substr({column}, 1, 2)
+        WHERE {column} GLOB '[0-9][0-9]/[0-9][0-9]/[0-9][0-9][0-9][0-9]'
+        '''
+        for table, column in [("Games", "PURCHASEDATE"), ("Rental", "RENTALDATE"), ("Rental", "RETURNDATE")]
+    ]),
+    (6, "Covering title index for catalog analytics", [
+        # Still serves lookups by title, and lets per-title grouping read only the index
+        "DROP INDEX IF EXISTS idx_games_title",
+        "CREATE INDEX idx_games_title ON Games (TITLE, GENRE, PURCHASEPRICE)",
+    ]),
+    (7, "Materialized title and genre popularity", [
+        '''
+        CREATE TABLE TitlePopularity (
+            TITLE TEXT,
+            GENRE TEXT,
+            POPULARITY INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (TITLE, GENRE)
+        )
+        ''',
+        '''
+        CREATE TABLE GenrePopularity (
+            GENRE TEXT PRIMARY KEY,
+            POPULARITY INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        # Every rental of a copy counts once towards its title and genre (scalar lookups keep this cheap on the rent path)
+        '''
+        CREATE TRIGGER popularity_rental_insert AFTER INSERT ON Rental BEGIN
+            UPDATE TitlePopularity SET POPULARITY = POPULARITY + 1
+            WHERE EXISTS (SELECT 1 FROM Games WHERE ID = new.ID)
+              AND TITLE IS (SELECT TITLE FROM Games WHERE ID = new.ID) AND GENRE IS (SELECT GENRE FROM Games WHERE ID = new.ID);
+            UPDATE GenrePopularity SET POPULARITY = POPULARITY + 1
+            WHERE EXISTS (SELECT 1 FROM Games WHERE ID = new.ID)
+              AND GENRE IS (SELECT GENRE FROM Games WHERE ID = new.ID);
+        END
+        ''',
+        '''
+        CREATE TRIGGER popularity_rental_delete AFTER DELETE ON Rental BEGIN
+            UPDATE TitlePopularity SET POPULARITY = POPULARITY - 1
+            WHERE EXISTS (SELECT 1 FROM Games WHERE ID = old.ID)
+              AND TITLE IS (SELECT TITLE FROM Games WHERE ID = old.ID) AND GENRE IS (SELECT GENRE FROM Games WHERE ID = old.ID);
+            UPDATE GenrePopularity SET POPULARITY = POPULARITY - 1
+            WHERE EXISTS (SELECT 1 FROM Games WHERE ID = old.ID)
+              AND GENRE IS (SELECT GENRE FROM Games WHERE ID = old.ID);
+        END
+        ''',
+        '''
+        CREATE TRIGGER popularity_rental_update AFTER UPDATE OF ID ON Rental BEGIN
+            UPDATE TitlePopularity SET POPULARITY = POPULARITY - 1
+            WHERE EXISTS (SELECT 1 FROM Games WHERE ID = old.ID)
+              AND TITLE IS (SELECT TITLE FROM Games WHERE ID = old.ID) AND GENRE IS (SELECT GENRE FROM Games WHERE ID = old.ID);
+            UPDATE GenrePopularity SET POPULARITY = POPULARITY - 1
+            WHERE EXISTS (SELECT 1 FROM Games WHERE ID = old.ID)
+              AND GENRE IS (SELECT GENRE FROM Games WHERE ID = old.ID);
+            UPDATE TitlePopularity SET POPULARITY = POPULARITY + 1
+            WHERE EXISTS (SELECT 1 FROM Games WHERE ID = new.ID)
+              AND TITLE IS (SELECT TITLE FROM Games WHERE ID = new.ID) AND GENRE IS (SELECT GENRE FROM Games WHERE ID = new.ID);
+            UPDATE GenrePopularity SET POPULARITY = POPULARITY + 1
+            WHERE EXISTS (SELECT 1 FROM Games WHERE ID = new.ID)
+              AND GENRE IS (SELECT GENRE FROM Games WHERE ID = new.ID);
+        END
+        ''',
+        # A new copy adds its title and genre (with zero rentals) and picks up any rentals already recorded for its ID
+        '''
+        CREATE TRIGGER popularity_games_insert AFTER INSERT ON Games BEGIN
+            INSERT OR IGNORE INTO TitlePopularity (TITLE, GENRE, POPULARITY) VALUES (new.TITLE, new.GENRE, 0);
+            INSERT OR IGNORE INTO GenrePopularity (GENRE, POPULARITY) VALUES (new.GENRE, 0);
+            UPDATE TitlePopularity SET POPULARITY = POPULARITY + (SELECT COUNT(*) FROM Rental WHERE ID = new.ID)
+            WHERE TITLE IS new.TITLE AND GENRE IS new.GENRE;
+            UPDATE GenrePopularity SET POPULARITY = POPULARITY + (SELECT COUNT(*) FROM Rental WHERE ID = new.ID)
+            WHERE GENRE IS new.GENRE;
+        END
+        ''',
+        # A removed copy takes its rentals with it, and its title or genre goes once no copies are left
+        '''
+        CREATE TRIGGER popularity_games_delete AFTER DELETE ON Games BEGIN
+            UPDATE TitlePopularity SET POPULARITY = POPULARITY - (SELECT COUNT(*) FROM Rental WHERE ID = old.ID)
+            WHERE TITLE IS old.TITLE AND GENRE IS old.GENRE;
+            UPDATE GenrePopularity SET POPULARITY = POPULARITY - (SELECT COUNT(*) FROM Rental WHERE ID = old.ID)
+            WHERE GENRE IS old.GENRE;
+            DELETE FROM TitlePopularity WHERE TITLE IS old.TITLE AND GENRE IS old.GENRE
+                AND NOT EXISTS (SELECT 1 FROM Games WHERE TITLE IS old.TITLE AND GENRE IS old.GENRE);
+            DELETE FROM GenrePopularity WHERE GENRE IS old.GENRE
+                AND NOT EXISTS (SELECT 1 FROM Games WHERE GENRE IS old.GENRE);
+        END
+        ''',
+        '''
+        CREATE TRIGGER popularity_games_update AFTER UPDATE OF ID, TITLE, GENRE ON Games BEGIN
+            UPDATE TitlePopularity SET POPULARITY = POPULARITY - (SELECT COUNT(*) FROM Rental WHERE ID = old.ID)
+            WHERE TITLE IS old.TITLE AND GENRE IS old.GENRE;
+            UPDATE GenrePopularity SET POPULARITY = POPULARITY - (SELECT COUNT(*) FROM Rental WHERE ID = old.ID)
+            WHERE GENRE IS old.GENRE;
+            DELETE FROM TitlePopularity WHERE TITLE IS old.TITLE AND GENRE IS old.GENRE
+                AND NOT EXISTS (SELECT 1 FROM Games WHERE TITLE IS old.TITLE AND GENRE IS old.GENRE);
+            DELETE FROM GenrePopularity WHERE GENRE IS old.GENRE
+                AND NOT EXISTS (SELECT 1 FROM Games WHERE GENRE IS old.GENRE);
+            INSERT OR IGNORE INTO TitlePopularity (TITLE, GENRE, POPULARITY) VALUES (new.TITLE, new.GENRE, 0);
+            INSERT OR IGNORE INTO GenrePopularity (GENRE, POPULARITY) VALUES (new.GENRE, 0);
+            UPDATE TitlePopularity SET POPULARITY = POPULARITY + (SELECT COUNT(*) FROM Rental WHERE ID = new.ID)
+            WHERE TITLE IS new.TITLE AND GENRE IS new.GENRE;
+            UPDATE GenrePopularity SET POPULARITY = POPULARITY + (SELECT COUNT(*) FROM Rental WHERE ID = new.ID)
+            WHERE GENRE IS new.GENRE;
+        END
+        ''',
+        # Backfill from the existing history
+        POPULARITY_REBUILD_SQL[0],
+        POPULARITY_REBUILD_SQL[1],
+    ]),
+    (8, "Let bulk inserts of copies skip the per-row search and popularity triggers", [
+        # A row here (only ever inside the inserting transaction) tells the insert triggers that the caller
+        # indexes the new copies itself, see DatabaseManager.bulk_insert_games
+        "CREATE TABLE BulkLoad (FIRSTID INTEGER, LASTID INTEGER)",
+        "DROP TRIGGER games_search_insert",
+        '''
+        CREATE TRIGGER games_search_insert AFTER INSERT ON Games
+        WHEN NOT EXISTS (SELECT 1 FROM BulkLoad WHERE new.ID BETWEEN FIRSTID AND LASTID) BEGIN
+            INSERT INTO GamesSearch (rowid, TITLE) VALUES (new.ID, new.TITLE);
+        END
+        ''',
+        "DROP TRIGGER popularity_games_insert",
+        '''
+        CREATE TRIGGER popularity_games_insert AFTER INSERT ON Games
+        WHEN NOT EXISTS (SELECT 1 FROM BulkLoad WHERE new.ID BETWEEN FIRSTID AND LASTID) BEGIN
+            INSERT OR IGNORE INTO TitlePopularity (TITLE, GENRE, POPULARITY) VALUES (new.TITLE, new.GENRE, 0);
+            INSERT OR IGNORE INTO GenrePopularity (GENRE, POPULARITY) VALUES (new.GENRE, 0);
+            UPDATE TitlePopularity SET POPULARITY = POPULARITY + (SELECT COUNT(*) FROM Rental WHERE ID = new.ID)
+            WHERE TITLE IS new.TITLE AND GENRE IS new.GENRE;
+            UPDATE GenrePopularity SET POPULARITY = POPULARITY + (SELECT COUNT(*) FROM Rental WHERE ID = new.ID)
+            WHERE GENRE IS new.GENRE;
+        END
+        ''',
+    ]),
+    (9, "Indexes for paging through rental history by date", [
+        # Each index also ends in rowid, so (filter, RENTALDATE, rowid) keyset pages are read straight off it
+        "CREATE INDEX idx_rental_date ON Rental (RENTALDATE)",
+        "CREATE INDEX idx_rental_customer_date ON Rental (CUSTOMERID, RENTALDATE)",
+        # Replaces the plain ID index, which it still serves for lookups by game
+        "CREATE INDEX idx_rental_game_date ON Rental (ID, RENTALDATE)",
+        "DROP INDEX idx_rental_game",
+    ]),
+    (10, "Change counter for the in-memory active rental index", [
+        # One row that every change to the set of copies or of open rentals bumps, so each process can tell whether
+        # its ActiveRentalIndex is still current. WRITER names the last transaction that updated an index itself.
+        "CREATE TABLE ActiveRentalVersion (VERSION INTEGER NOT NULL, WRITER TEXT)",
+        "INSERT INTO ActiveRentalVersion (VERSION, WRITER) VALUES (0, NULL)",
+        # Only open rentals matter, so loading returned history does not fire these
+        '''
+        CREATE TRIGGER active_rentals_rental_insert AFTER INSERT ON Rental WHEN new.RETURNDATE IS NULL BEGIN
+            UPDATE ActiveRentalVersion SET VERSION = VERSION + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER active_rentals_rental_delete AFTER DELETE ON Rental WHEN old.RETURNDATE IS NULL BEGIN
+            UPDATE ActiveRentalVersion SET VERSION = VERSION + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER active_rentals_rental_update AFTER UPDATE OF ID, CUSTOMERID, RETURNDATE ON Rental
+        WHEN old.RETURNDATE IS NULL OR new.RETURNDATE IS NULL BEGIN
+            UPDATE ActiveRentalVersion SET VERSION = VERSION + 1;
+        END
+        ''',
+        # bulk_insert_games bumps the counter once for the whole range
+        '''
+        CREATE TRIGGER active_rentals_games_insert AFTER INSERT ON Games
+        WHEN NOT EXISTS (SELECT 1 FROM BulkLoad WHERE new.ID BETWEEN FIRSTID AND LASTID) BEGIN
+            UPDATE ActiveRentalVersion SET VERSION = VERSION + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER active_rentals_games_delete AFTER DELETE ON Games BEGIN
+            UPDATE ActiveRentalVersion SET VERSION = VERSION + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER active_rentals_games_update AFTER UPDATE OF ID ON Games WHEN old.ID IS NOT new.ID BEGIN
+            UPDATE ActiveRentalVersion SET VERSION = VERSION + 1;
+        END
+        ''',
+    ]),
+    (11, "Let file loads skip the per-row rental and game deletion triggers", [
+        # ingest_file covers every ID with a BulkLoad row while it loads a file into Games or Rental, and then
+        # brings the search index, popularity and active rental version up to date with a few set-based statements
+        "DROP TRIGGER popularity_rental_insert",
+        '''
+        CREATE TRIGGER popularity_rental_insert AFTER INSERT ON Rental
+        WHEN NOT EXISTS (SELECT 1 FROM BulkLoad WHERE new.ID BETWEEN FIRSTID AND LASTID) BEGIN
+            UPDATE TitlePopularity SET POPULARITY = POPULARITY + 1
+            WHERE EXISTS (SELECT 1 FROM Games WHERE ID = new.ID)
+              AND TITLE IS (SELECT TITLE FROM Games WHERE ID = new.ID) AND GENRE IS (SELECT GENRE FROM Games WHERE ID = new.ID);
+            UPDATE GenrePopularity SET POPULARITY = POPULARITY + 1
+            WHERE EXISTS (SELECT 1 FROM Games WHERE ID = new.ID)
+              AND GENRE IS (SELECT GENRE FROM Games WHERE ID = new.ID);
+        END
+        ''',
+        "DROP TRIGGER popularity_rental_delete",
+        '''
+        CREATE TRIGGER popularity_rental_delete AFTER DELETE ON Rental
+        WHEN NOT EXISTS (SELECT 1 FROM BulkLoad WHERE old.ID BETWEEN FIRSTID AND LASTID) BEGIN
+            UPDATE TitlePopularity SET POPULARITY = POPULARITY - 1
+            WHERE EXISTS (SELECT 1 FROM Games WHERE ID = old.ID)
+              AND TITLE IS (SELECT TITLE FROM Games WHERE ID = old.ID) AND GENRE IS (SELECT GENRE FROM Games WHERE ID = old.ID);
+            UPDATE GenrePopularity SET POPULARITY = POPULARITY - 1
+            WHERE EXISTS (SELECT 1 FROM Games WHERE ID = old.ID)
+              AND GENRE IS (SELECT GENRE FROM Games WHERE ID = old.ID);
+        END
+        ''',
+        "DROP TRIGGER active_rentals_rental_insert",
+        '''
+        CREATE TRIGGER active_rentals_rental_insert AFTER INSERT ON Rental
+        WHEN new.RETURNDATE IS NULL AND NOT EXISTS (SELECT 1 FROM BulkLoad WHERE new.ID BETWEEN FIRSTID AND LASTID) BEGIN
+            UPDATE ActiveRentalVersion SET VERSION = VERSION + 1;
+        END
+        ''',
+        "DROP TRIGGER active_rentals_rental_delete",
+        '''
+        CREATE TRIGGER active_rentals_rental_delete AFTER DELETE ON Rental
+        WHEN old.RETURNDATE IS NULL AND NOT EXISTS (SELECT 1 FROM BulkLoad WHERE old.ID BETWEEN FIRSTID AND LASTID) BEGIN
+            UPDATE ActiveRentalVersion SET VERSION = VERSION + 1;
+        END
+        ''',
+        "DROP TRIGGER games_search_delete",
+        '''
+        CREATE TRIGGER games_search_delete AFTER DELETE ON Games
+        WHEN NOT EXISTS (SELECT 1 FROM BulkLoad WHERE old.ID BETWEEN FIRSTID AND LASTID) BEGIN
+            INSERT INTO GamesSearch (GamesSearch, rowid, TITLE) VALUES ('delete', old.ID, old.TITLE);
+        END
+        ''',
+        "DROP TRIGGER popularity_games_delete",
+        '''
+        CREATE TRIGGER popularity_games_delete AFTER DELETE ON Games
+        WHEN NOT EXISTS (SELECT 1 FROM BulkLoad WHERE old.ID BETWEEN FIRSTID AND LASTID) BEGIN
+            UPDATE TitlePopularity SET POPULARITY = POPULARITY - (SELECT COUNT(*) FROM Rental WHERE ID = old.ID)
+            WHERE TITLE IS old.TITLE AND GENRE IS old.GENRE;
+            UPDATE GenrePopularity SET POPULARITY = POPULARITY - (SELECT COUNT(*) FROM Rental WHERE ID = old.ID)
+            WHERE GENRE IS old.GENRE;
+            DELETE FROM TitlePopularity WHERE TITLE IS old.TITLE AND GENRE IS old.GENRE
+                AND NOT EXISTS (SELECT 1 FROM Games WHERE TITLE IS old.TITLE AND GENRE IS old.GENRE);
+            DELETE FROM GenrePopularity WHERE GENRE IS old.GENRE
+                AND NOT EXISTS (SELECT 1 FROM Games WHERE GENRE IS old.GENRE);
+        END
+        ''',
+        "DROP TRIGGER active_rentals_games_delete",
+        '''
+        CREATE TRIGGER active_rentals_games_delete AFTER DELETE ON Games
+        WHEN NOT EXISTS (SELECT 1 FROM BulkLoad WHERE old.ID BETWEEN FIRSTID AND LASTID) BEGIN
+            UPDATE ActiveRentalVersion SET VERSION = VERSION + 1;
+        END
+        ''',
+    ]),
+    (12, "Change counter for the words in the title index", [
+        # Bumped whenever a title is added, removed or renamed, so GameSearch knows when its trigram vocabulary
+        # is stale without rereading GamesSearchVocab. Rents and returns leave it alone.
+        "CREATE TABLE CatalogVersion (VERSION INTEGER NOT NULL)",
+        "INSERT INTO CatalogVersion (VERSION) VALUES (0)",
+        # bulk_insert_games and finish_bulk_load bump it once for the whole range or file
+        '''
+        CREATE TRIGGER catalog_games_insert AFTER INSERT ON Games
+        WHEN NOT EXISTS (SELECT 1 FROM BulkLoad WHERE new.ID BETWEEN FIRSTID AND LASTID) BEGIN
+            UPDATE CatalogVersion SET VERSION = VERSION + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER catalog_games_delete AFTER DELETE ON Games
+        WHEN NOT EXISTS (SELECT 1 FROM BulkLoad WHERE old.ID BETWEEN FIRSTID AND LASTID) BEGIN
+            UPDATE CatalogVersion SET VERSION = VERSION + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER catalog_games_update AFTER UPDATE OF ID, TITLE ON Games BEGIN
+            UPDATE CatalogVersion SET VERSION = VERSION + 1;
+        END
+        ''',
+    ]),
+]
+
+# The BulkLoad row a file load covers every ID with
+ALL_IDS = (-(1 << 63), (1 << 63) - 1)
+
+# The tables ingest_file loads with their per-row triggers suspended. Games are always reindexed in full afterwards:
+# the INSERT OR REPLACE that loads them would turn the insert trigger's INSERT OR IGNORE into a REPLACE, resetting
+# popularity, and replacing a copy does not fire the delete triggers.
+BULK_LOAD_TABLES = ("Games", "Rental")
+
+SCHEMA_VERSION = SCHEMA_MIGRATIONS[-1][0]
+
+
+class ConnectionPool:
+
+    def __init__(self, db_file, cache_size_kb=8192, statement_cache_size=256, busy_timeout=5.0):
+        """
+        Initializes a pool that hands out one long-lived connection per thread for a database file.
+
+        Parameters:
+        - db_file (str): The SQLite database file.
+        - cache_size_kb (int): The page cache size of each connection in KiB.
+        - statement_cache_size (int): The number of prepared statements cached per connection.
+        - busy_timeout (float): Seconds to wait for a lock held by another connection.
+        """
+        self.db_file = db_file
+        self.metrics = QueryMetrics()  # Every statement on the pool's connections is counted here
+        self.cache_size_kb = cache_size_kb
+        self.statement_cache_size = statement_cache_size
+        self.busy_timeout = busy_timeout
+        self.connections_opened = 0
+        self.write_commits = 0  # Bumped after every commit that changed rows, see ActiveRentalIndex
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def _open(self):
+        """
+        Opens a new connection and applies the PRAGMA tuning once.
+
+        Returns:
+        - sqlite3.Connection: The new connection (autocommit mode, transactions are explicit).
+        """
+        connection = sqlite3.connect(self.db_file,
+                                     timeout=self.busy_timeout,
+                                     isolation_level=None,
+                                     cached_statements=self.statement_cache_size,
+                                     check_same_thread=False,
+                                     factory=InstrumentedConnection)
+        connection.metrics = self.metrics
+        connection.after_transaction = []  # Called once the current transaction ends, see DatabaseManager.after_transaction
+
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+        connection.execute(f"PRAGMA cache_size = -{int(self.cache_size_kb)}")
+        connection.execute("PRAGMA temp_store = MEMORY")
+        # INSERT OR REPLACE must fire delete triggers so trigger-maintained tables stay in sync
+        connection.execute("PRAGMA recursive_triggers = ON")
+
+        with self._lock:
+            self._connections.append(connection)
+            self.connections_opened += 1
+        self.metrics.connection_opened()
+
+        return connection
+
+    def acquire(self):
+        """
+        Returns the calling thread's connection, opening it on first use.
+
+        Returns:
+        - sqlite3.Connection: The pooled connection for this thread.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._open()
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def connection(self):
+        """
+        Checks out the calling thread's connection for the duration of a with-block.
+        """
+        yield self.acquire()
+
+    def close_all(self):
+        """
+        Closes every connection opened by this pool.
+        """
+        with self._lock:
+            connections, self._connections = self._connections, []
+
+        for connection in connections:
+            connection.close()
+
+        self._local = threading.local()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_file):
+    """
+    Returns the shared ConnectionPool for a database file, creating it if needed.
+
+    Parameters:
+    - db_file (str): The SQLite database file.
+
+    Returns:
+    - ConnectionPool: The pool shared by every DatabaseManager using this file.
+    """
+    with _pools_lock:
+        pool = _pools.get(db_file)
+        if pool is None:
+            pool = ConnectionPool(db_file)
+            _pools[db_file] = pool
+        return pool
+
+
 class DatabaseManager:
 
-    def __init__(self, gamerental_db_file="GameRental.db"):
+    def __init__(self, gamerental_db_file="GameRental.db", game_ids=None):
         """
         Initializes the DatabaseManager with the specified database file.
+
+        Parameters:
+        - gamerental_db_file (str): The SQLite database file.
+        - game_ids (range): The IDs new copies are numbered from, e.g. a shard's range (see ShardRouter),
+          or None for any ID.
         """
         self.gamerental_db_file = gamerental_db_file
+        self.game_ids = game_ids
+        self.pool = get_pool(gamerental_db_file)
+        self.metrics = self.pool.metrics  # See QueryMetrics for snapshot(), prometheus() and add_hook()
+        self.games_date_formats = GAME_INFO_DATE_FORMATS
+        self.rental_date_formats = RENTAL_HISTORY_DATE_FORMATS
+        self.connection = None
+        self.cursor = None
 
     def connect(self):
         """
-        Connects to the database.
+        Checks out this thread's pooled connection to the database.
+
+        Returns:
+        - sqlite3.Connection: The pooled connection.
         """
-        self.connection = sqlite3.connect(self.gamerental_db_file)
+        self.connection = self.pool.acquire()
         self.cursor = self.connection.cursor()
+        return self.connection
 
     def commit(self):
         """
-        Commits changes to the database if a connection exists.
+        Commits changes to the database if a transaction is open.
         """
-        if self.connection:
+        if self.connection and self.connection.in_transaction:
             self.connection.commit()
 
-    def create_tables(self):
+    @contextmanager
+    def transaction(self, immediate=False):
         """
-        Creates database tables if they do not exist.
-        """
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS Games (
-                ID INTEGER,
-                PLATFORM TEXT,
-                GENRE TEXT,
-                TITLE TEXT,
-                PURCHASEPRICE REAL,
-                PURCHASEDATE DATE
-            )
-        ''')
-
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS Rental (
-                ID INTEGER,
-                RENTALDATE DATE,
-                RETURNDATE DATE,
-                CUSTOMERID INTEGER
-            )
-        ''')
-
-        self.connection.commit()
+        Runs a with-block inside a single transaction, committing on success and rolling back on error.
+        Nested calls join the outer transaction.
 
-    def close(self):
-        """
-        Closes the database connection if it exists.
+        Parameters:
+        - immediate (bool): Take the write lock up front (BEGIN IMMEDIATE).
+
+        Returns:
+        - sqlite3.Cursor: A cursor on the pooled connection.
         """
-        if self.connection:
-            self.connection.close()
+        connection = self.connect()
+
+        if connection.in_transaction:
+            yield connection.cursor()
+            return
 
-    def format_date(self, date_str):
+        changes = connection.total_changes
+        connection.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        try:
+            yield connection.cursor()
+        except BaseException:
+            connection.rollback()
+            self.end_transaction(connection)
+            raise
+        else:
+            connection.commit()
+            if connection.total_changes != changes:
+                self.pool.write_commits += 1
+            self.end_transaction(connection)
+
+    def after_transaction(self, callback):
         """
-        Formats the date string to the desired format.
+        Calls callback once the transaction this thread is in has been committed or rolled back, or right away
+        if it is not in one.
 
         Parameters:
-        - date_str (str): The date string to be formatted.
+        - callback (callable): Takes no arguments.
+        """
+        connection = self.connect()
+        if connection.in_transaction:
+            connection.after_transaction.append(callback)
+        else:
+            callback()
+
+    def end_transaction(self, connection):
+        """
+        Runs the callbacks registered with after_transaction for the transaction that just ended.
+        """
+        callbacks, connection.after_transaction = connection.after_transaction, []
+        for callback in callbacks:
+            callback()
+
+    def data_generation(self):
+        """
+        Returns a value that changes whenever the database is written to, by this thread's connection or any other.
+        Only values taken on the same thread can be compared.
 
         Returns:
-        - str or None: The formatted date string or None if the input is None.
+        - tuple: (connection id, PRAGMA data_version, total changes made by this connection).
         """
-        if date_str is None:
-            return None
+        connection = self.connect()
+        data_version = connection.execute("PRAGMA data_version").fetchone()[0]
+        return (id(connection), data_version, connection.total_changes)
+
+    def popularity_generation(self):
+        """
+        Returns a value that changes whenever the games or rentals the popularity tables count change. Unlike
+        data_generation it does not depend on the connection, so values taken on different threads can be compared.
 
-        formats_to_try = ["%d/%m/%Y", "%m/%d/%Y"]
+        Returns:
+        - tuple: (ActiveRentalVersion VERSION, what Games and Rental were last loaded from).
+        """
+        with self.transaction() as cursor:
+            # Every rent and purchase bumps VERSION, file loads change the manifest
+            version = cursor.execute("SELECT VERSION FROM ActiveRentalVersion").fetchone()[0]
+            manifest = tuple(cursor.execute('''
+                SELECT SOURCE, SIZE, MTIME, HASH FROM IngestManifest WHERE SOURCE IN ('Games', 'Rental') ORDER BY SOURCE
+            ''').fetchall())
+        return (version, manifest)
+
+    def catalog_generation(self):
+        """
+        Returns a value that changes whenever a game is added, removed or renamed, but not when games are rented
+        or returned. Like popularity_generation it can be compared across threads.
+
+        Returns:
+        - int: The CatalogVersion VERSION.
+        """
+        result = self.execute("SELECT VERSION FROM CatalogVersion")
+        return result[0][0] if result else None
+
+    def run_atomic(self, operation, retries=5, backoff=0.02):
+        """
+        Runs operation(cursor) inside a BEGIN IMMEDIATE transaction, so its reads and writes cannot interleave
+        with another connection's writes. If the database stays locked past the busy timeout the whole
+        operation is retried with jittered exponential backoff.
+
+        Parameters:
+        - operation (callable): Takes a cursor and returns the result. It may run more than once.
+        - retries (int): How many times to retry after the database was busy or locked.
+        - backoff (float): The base delay between retries in seconds.
 
-        for date_format in formats_to_try:
+        Returns:
+        - The return value of operation.
+        """
+        for attempt in range(retries + 1):
             try:
-                date_obj = datetime.strptime(date_str, date_format)
-                return date_obj.strftime("%d/%m/%Y")
-            except ValueError:
+                with self.transaction(immediate=True) as cursor:
+                    return operation(cursor)
+            except sqlite3.OperationalError as e:
+                message = str(e).lower()
+                if attempt == retries or ("locked" not in message and "busy" not in message):
+                    raise
+                time.sleep(backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+    def bulk_insert_games(self, cursor, rows):
+        """
+        Inserts many new copies with one executemany, then adds them to the search index and the popularity
+        tables with a few set-based statements instead of firing the insert triggers once per copy.
+        Must run inside a transaction, and every ID must come from a freshly reserved range (no existing games
+        between the lowest and highest ID).
+
+        Parameters:
+        - cursor (sqlite3.Cursor): The cursor of the open transaction.
+        - rows (list): (ID, TITLE, GENRE, PLATFORM, PURCHASEDATE, PURCHASEPRICE) tuples.
+
+        Returns:
+        - int: The number of copies inserted.
+        """
+        if not rows:
+            return 0
+
+        first_id = min(row[0] for row in rows)
+        last_id = max(row[0] for row in rows)
+
+        cursor.execute("INSERT INTO BulkLoad (FIRSTID, LASTID) VALUES (?, ?)", (first_id, last_id))
+        cursor.executemany(
+            "INSERT INTO Games (ID, TITLE, GENRE, PLATFORM, PURCHASEDATE, PURCHASEPRICE) VALUES (?, ?, ?, ?, ?, ?)", rows)
+        cursor.execute("DELETE FROM BulkLoad WHERE FIRSTID = ? AND LASTID = ?", (first_id, last_id))
+        cursor.execute("UPDATE CatalogVersion SET VERSION = VERSION + 1")
+
+        # The same work the insert triggers do, once for the whole range
+        cursor.execute("INSERT INTO GamesSearch (rowid, TITLE) SELECT ID, TITLE FROM Games WHERE ID BETWEEN ? AND ?",
+                       (first_id, last_id))
+        cursor.execute('''
+            INSERT INTO TitlePopularity (TITLE, GENRE, POPULARITY)
+            SELECT G.TITLE, G.GENRE, COUNT(R.ID) FROM Games G LEFT JOIN Rental R ON R.ID = G.ID
+            WHERE G.ID BETWEEN ? AND ? GROUP BY G.TITLE, G.GENRE
+            ON CONFLICT (TITLE, GENRE) DO UPDATE SET POPULARITY = POPULARITY + excluded.POPULARITY
+        ''', (first_id, last_id))
+        cursor.execute('''
+            INSERT INTO GenrePopularity (GENRE, POPULARITY)
+            SELECT G.GENRE, COUNT(R.ID) FROM Games G LEFT JOIN Rental R ON R.ID = G.ID
+            WHERE G.ID BETWEEN ? AND ? GROUP BY G.GENRE
+            ON CONFLICT (GENRE) DO UPDATE SET POPULARITY = POPULARITY + excluded.POPULARITY
+        ''', (first_id, last_id))
+        cursor.execute("UPDATE ActiveRentalVersion SET VERSION = VERSION + 1")
+
+        return len(rows)
+
+    def create_tables(self):
+        """
+        Creates database tables if they do not exist and upgrades them to the current schema version.
+        """
+        self.migrate()
+
+    def migrate(self):
+        """
+        Applies every schema migration newer than the database's PRAGMA user_version, each in its own transaction.
+
+        Returns:
+        - int: The schema version the database is at afterwards.
+        """
+        connection = self.connect()
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+
+        for target_version, description, statements in SCHEMA_MIGRATIONS:
+            if target_version <= version:
                 continue
 
-        # If none of the formats match, assume it's already in the desired format
-        return date_str
+            with self.transaction(immediate=True) as cursor:
+                # Another connection may have applied this migration while we waited for the lock
+                if cursor.execute("PRAGMA user_version").fetchone()[0] < target_version:
+                    for statement in statements:
+                        cursor.execute(statement)
+                    cursor.execute(f"PRAGMA user_version = {int(target_version)}")
 
-    def clear_tables(self):
+            version = target_version
+
+        return version
+
+    def explain_query_plan(self, query, parameters=()):
+        """
+        Returns SQLite's plan for a query, e.g. to check that it is served by an index.
+
+        Parameters:
+        - query (str): The SQL query to explain.
+        - parameters (tuple): The parameters to be used in the query.
+
+        Returns:
+        - list: The detail line of each plan step, such as "SEARCH Rental USING INDEX idx_rental_active (ID=?)".
+        """
+        connection = self.connect()
+        return [row[3] for row in connection.execute("EXPLAIN QUERY PLAN " + query, parameters)]
+
+    def close(self):
         """
-        Clears existing data in both tables.
+        Releases the connection back to the pool. The pooled connection itself stays open for reuse.
         """
-        self.cursor.execute("DELETE FROM Games")
-        self.cursor.execute("DELETE FROM Rental")
-        self.connection.commit()
+        self.cursor = None
+        self.connection = None
 
-    def initialize_databases(self, games_info_file, rental_history_file):
+    def format_date(self, date_str, formats=DEFAULT_DATE_FORMATS):
         """
-        Initializes the databases by creating tables, clearing existing data, and populating them with cleaned data from files.
+        Formats the date string to the ISO-8601 format the database stores.
 
         Parameters:
-        - games_info_file (str): The file containing games information.
-        - rental_history_file (str): The file containing rental history information.
+        - date_str (str): The date string to be formatted.
+        - formats (tuple): The formats the date may be written in, tried in order.
+
+        Returns:
+        - str or None: The formatted date string or None if the input is None or cannot be parsed.
         """
-        self.connect()
-        self.create_tables()
+        return normalize_date(date_str, tuple(formats))
 
-        self.clear_tables()
+    def clear_tables(self):
+        """
+        Clears existing data in both tables, and the ingest manifest so the next load starts from scratch.
+        """
+        with self.transaction() as cursor:
+            cursor.execute("DELETE FROM Rental")
+            cursor.execute("DELETE FROM Games")
+            cursor.execute("DELETE FROM IngestManifest")
 
-        # SPLITTING INTO FIELDS
+    def parse_game_line(self, line):
+        """
+        Splits and cleans one line of the games information file.
 
-        with open(games_info_file, "r") as file:
-            lines = file.readlines()
-            for line in lines[1:]:
-                fields = [field.strip() if field.strip() != '' else None for field in line.split(",")]  # Splitting each field by ","
+        Parameters:
+        - line (str): A line from the games information file.
 
-                if len(fields) == 6:
-                    game_id, platform, genre, title, purchase_price, purchase_date = fields
+        Returns:
+        - tuple or None: (ID, PLATFORM, GENRE, TITLE, PURCHASEPRICE, PURCHASEDATE) or None if the line is malformed.
+        """
+        try:
+            return parse_game_row(line, self.games_date_formats)
+        except ValueError:
+            return None
 
-                    # Formatting the date
-                    purchase_date = self.format_date(purchase_date)  
+    def parse_rental_line(self, line):
+        """
+        Splits and cleans one line of the rental history file.
 
+        Parameters:
+        - line (str): A line from the rental history file.
 
-                    # Handing missing purchase price value (setting to 0 if missing)
-                    try:
-                        purchase_price = float(purchase_price) 
-                    except (ValueError, TypeError):
-                        purchase_price = 0.0
+        Returns:
+        - tuple or None: (ID, RENTALDATE, RETURNDATE, CUSTOMERID) or None if the line is malformed.
+        """
+        try:
+            return parse_rental_row(line, self.rental_date_formats)
+        except ValueError:
+            return None
 
-                    # Normalizing by putting everything in lowercase and removing "'"
-                    platform = platform.lower().replace("'", "")  
-                    genre = genre.lower().replace("'", "")
-                    title = title.lower().replace("'", "")
+    def hash_file(self, file_name, prefix_length=0):
+        """
+        Hashes a file in one streaming pass, also reporting the hash of its first prefix_length bytes.
 
-                    self.cursor.execute('''
-                        INSERT INTO Games (ID, PLATFORM, GENRE, TITLE, PURCHASEPRICE, PURCHASEDATE)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (game_id, platform, genre, title, float(purchase_price), purchase_date))
+        Parameters:
+        - file_name (str): The file to hash.
+        - prefix_length (int): The length of the prefix to hash separately.
 
-        with open(rental_history_file, "r") as file:
-            lines = file.readlines()
-            for line in lines[1:]:
-                fields = [field.strip() if field.strip() != '' else None for field in line.split(",")]
+        Returns:
+        - tuple: (prefix hex digest, whole-file hex digest).
+        """
+        # Imported here, only ingesting needs it (it costs several milliseconds at startup)
+        import hashlib
 
-                if len(fields) == 4:
-                    game_id, rental_date, return_date, customer_id = fields
+        digest = hashlib.blake2b(digest_size=20)
+        prefix_digest = None
+        position = 0
 
-                    #Formatting dates
-                    rental_date = self.format_date(rental_date)
-                    return_date = self.format_date(return_date)
+        with open(file_name, "rb") as file:
+            while True:
+                limit = prefix_length - position if position < prefix_length else 1 << 20
+                block = file.read(min(limit, 1 << 20))
+                if not block:
+                    break
+                digest.update(block)
+                position += len(block)
+                if position == prefix_length:
+                    prefix_digest = digest.copy().hexdigest()
 
-                    self.cursor.execute('''
-                        INSERT INTO Rental (ID, RENTALDATE, RETURNDATE, CUSTOMERID)
-                        VALUES (?, ?, ?, ?)
-                    ''', (game_id, rental_date, return_date, customer_id))
+        if prefix_length == 0:
+            prefix_digest = hashlib.blake2b(digest_size=20).hexdigest()
 
-        self.connection.commit()
-        self.close()
+        return prefix_digest, digest.hexdigest()
 
-    def execute(self, query, parameters=None):
+    def ingest_file(self, table, file_name, insert_query, parse_line, force=False, workers=None, quarantine_file=None):
         """
-        Executes a SQL query with optional parameters.
+        Loads a source file into a table, using the IngestManifest to skip unchanged files
+        and to apply only the appended rows when a file has grown.
+
+        The file is streamed in chunks, parsed in worker processes when it is large (see chunkedImport.parse_file),
+        and written by this thread in one transaction. Malformed lines are skipped and listed, with the reason,
+        in a quarantine file next to the source file.
 
         Parameters:
-        - query (str): The SQL query to be executed.
-        - parameters (tuple): The parameters to be used in the query.
+        - table (str): The table the file populates, also used as the manifest key.
+        - file_name (str): The source file (with a header line).
+        - insert_query (str): The INSERT statement for one parsed row.
+        - parse_line (callable): Turns a line into a row tuple, returning None or raising ValueError for a malformed
+          line. Only a picklable one (e.g. parse_rental_row) can be run in worker processes.
+        - force (bool): Reload the whole file even if the manifest says it is unchanged.
+        - workers (int): The number of parsing processes, by default one per CPU.
+        - quarantine_file (str): Where to list malformed lines, see chunkedImport.Quarantine.
 
         Returns:
-        - list or None: The result of the query as a list or None in case of an error.
+        - tuple: ("unchanged", "appended" or "reloaded", the number of lines quarantined).
         """
-        self.connect()
+        # Imported here, only ingesting needs it
+        from chunkedImport import Quarantine, parse_file
+
+        stat = os.stat(file_name)
+        path = os.path.abspath(file_name)
+
+        manifest = self.execute("SELECT PATH, SIZE, MTIME, HASH FROM IngestManifest WHERE SOURCE = ?", (table,))
+        manifest = manifest[0] if manifest else None
+
+        # Same file, same size and modification time: nothing to do
+        if not force and manifest and manifest[0] == path and manifest[1] == stat.st_size and manifest[2] == stat.st_mtime:
+            return "unchanged", 0
+
+        mode = "reloaded"
+        offset = 0
+        old_size = manifest[1] if manifest and manifest[0] == path else -1
+
+        prefix_hash, file_hash = self.hash_file(file_name, max(old_size, 0))
+
+        # Only keep the old rows if the previous content is an unchanged prefix ending on a full line
+        if not force and 0 <= old_size <= stat.st_size and prefix_hash == manifest[3]:
+            with open(file_name, "rb") as file:
+                file.seek(max(old_size - 1, 0))
+                ends_on_line = old_size == 0 or file.read(1) == b"\n"
+
+            if ends_on_line:
+                mode = "unchanged" if old_size == stat.st_size else "appended"
+                offset = old_size
+
+        start = offset
+        if offset == 0:
+            with open(file_name, "rb") as file:
+                start = len(file.readline())  # Skip the header line
+
+        bulk = table in BULK_LOAD_TABLES and mode != "unchanged"
+        quarantined = 0
+
+        # Sorting for the index builds and the popularity rebuild spills to temporary files rather than memory,
+        # which would grow with the table. It cannot be changed inside a transaction.
+        connection = self.connect()
+        spill = bulk and not connection.in_transaction
+        if spill:
+            connection.execute("PRAGMA temp_store = FILE")
 
         try:
-            if parameters:
-                self.cursor.execute(query, parameters)
-            else:
-                self.cursor.execute(query)
+            with self.transaction() as cursor:
+                if mode != "unchanged":
+                    indexes = []
+                    if bulk:
+                        cursor.execute("INSERT INTO BulkLoad (FIRSTID, LASTID) VALUES (?, ?)", ALL_IDS)
 
-            result = self.cursor.fetchall()
-            self.connection.commit()
-            return result
-        except sqlite3.Error as e:
-            print("Error executing query:", e)
-            return None
+                    if mode == "reloaded":
+                        if bulk:
+                            # Building the indexes once after the load is much cheaper than updating them row by row
+                            indexes = cursor.execute('''
+                                SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL
+                            ''', (table,)).fetchall()
+                            for name, _ in indexes:
+                                cursor.execute(f"DROP INDEX {name}")
+                        cursor.execute(f"DELETE FROM {table}")
+
+                    last_rowid = cursor.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {table}").fetchone()[0]
+
+                    quarantine = Quarantine(file_name, offset, quarantine_file)
+                    try:
+                        for first_line, rows, rejects in parse_file(file_name, start, parse_line, workers):
+                            cursor.executemany(insert_query, rows)
+                            quarantine.add(first_line, rejects)
+                    finally:
+                        quarantined = quarantine.close()
+
+                    for _, sql in indexes:
+                        cursor.execute(sql)
+
+                    if bulk:
+                        cursor.execute("DELETE FROM BulkLoad WHERE FIRSTID = ? AND LASTID = ?", ALL_IDS)
+                        self.finish_bulk_load(cursor, table, mode, last_rowid)
+
+                cursor.execute('''
+                    INSERT OR REPLACE INTO IngestManifest (SOURCE, PATH, SIZE, MTIME, HASH)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (table, path, stat.st_size, stat.st_mtime, file_hash))
+        finally:
+            if spill:
+                connection.execute("PRAGMA temp_store = MEMORY")
+
+        return mode, quarantined
+
+    def finish_bulk_load(self, cursor, table, mode, last_rowid):
+        """
+        Does what the per-row triggers skipped during a file load, with a few set-based statements.
+
+        Parameters:
+        - cursor (sqlite3.Cursor): The cursor of the loading transaction.
+        - table (str): "Games" or "Rental".
+        - mode (str): "reloaded" or "appended".
+        - last_rowid (int): The highest rowid in the table before the load, every row above it is new.
+        """
+        if table == "Rental" and mode == "appended":
+            # Only the new rentals add to the popularity of titles and genres that already have copies
+            cursor.execute('''
+                INSERT INTO TitlePopularity (TITLE, GENRE, POPULARITY)
+                SELECT G.TITLE, G.GENRE, COUNT(*) FROM Rental R JOIN Games G ON G.ID = R.ID
+                WHERE R.rowid > ? GROUP BY G.TITLE, G.GENRE
+                ON CONFLICT (TITLE, GENRE) DO UPDATE SET POPULARITY = POPULARITY + excluded.POPULARITY
+            ''', (last_rowid,))
+            cursor.execute('''
+                INSERT INTO GenrePopularity (GENRE, POPULARITY)
+                SELECT G.GENRE, COUNT(*) FROM Rental R JOIN Games G ON G.ID = R.ID
+                WHERE R.rowid > ? GROUP BY G.GENRE
+                ON CONFLICT (GENRE) DO UPDATE SET POPULARITY = POPULARITY + excluded.POPULARITY
+            ''', (last_rowid,))
+        else:
+            if table == "Games":
+                cursor.execute("INSERT INTO GamesSearch (GamesSearch) VALUES ('rebuild')")
+                cursor.execute("UPDATE CatalogVersion SET VERSION = VERSION + 1")
+            cursor.execute("DELETE FROM TitlePopularity")
+            cursor.execute("DELETE FROM GenrePopularity")
+            for statement in POPULARITY_REBUILD_SQL:
+                cursor.execute(statement)
 
-       
+        cursor.execute("UPDATE ActiveRentalVersion SET VERSION = VERSION + 1")
 
+    def initialize_databases(self, games_info_file, rental_history_file, force=False, workers=None, report=True):
+        """
+        Initializes the databases by creating tables and populating them with cleaned data from files.
 
-            
+        Files that have not changed since the last load are skipped, so rentals made since then are kept.
+        Files that only had lines appended have just those lines inserted; any other change reloads that table.
+        Malformed lines are listed in a ".quarantine.csv" file next to their source file.
 
+        Parameters:
+        - games_info_file (str): The file containing games information.
+        - rental_history_file (str): The file containing rental history information.
+        - force (bool): Clear both tables and reload everything from the files.
+        - workers (int): The number of processes parsing large files, by default one per CPU.
+        - report (bool): Print how many lines of each file were quarantined.
 
+        Returns:
+        - dict: The ingest mode used for each table.
+        """
+        self.create_tables()
 
+        games_query = '''
+            INSERT OR REPLACE INTO Games (ID, PLATFORM, GENRE, TITLE, PURCHASEPRICE, PURCHASEDATE)
+            VALUES (?, ?, ?, ?, ?, ?)
+        '''
+        rental_query = '''
+            INSERT INTO Rental (ID, RENTALDATE, RETURNDATE, CUSTOMERID)
+            VALUES (?, ?, ?, ?)
+        '''
 
+        # Partials of module-level functions, unlike bound methods they can be sent to the worker processes
+        parse_game = functools.partial(parse_game_row, date_formats=tuple(self.games_date_formats))
+        parse_rental = functools.partial(parse_rental_row, date_formats=tuple(self.rental_date_formats))
 
+        modes = {}
+        for table, file_name, query, parse_line in [("Games", games_info_file, games_query, parse_game),
+                                                    ("Rental", rental_history_file, rental_query, parse_rental)]:
+            modes[table], quarantined = self.ingest_file(table, file_name, query, parse_line, force, workers)
+            if quarantined and report:
+                print(f"Quarantined {quarantined} malformed lines of {file_name} in {file_name}.quarantine.csv")
 
+        return modes
 
+    def execute(self, query, parameters=None):
+        """
+        Executes a SQL query with optional parameters on the pooled connection.
+        Outside of a transaction() block each statement commits on its own, and errors are printed.
+        Inside one they are raised, so the transaction is rolled back rather than committed without the statement.
 
+        Parameters:
+        - query (str): The SQL query to be executed.
+        - parameters (tuple): The parameters to be used in the query.
 
-        
+        Returns:
+        - list or None: The result of the query as a list or None in case of an error.
+        """
+        connection = self.connect()
+        changes = connection.total_changes
 
+        try:
+            if parameters:
+                cursor = connection.execute(query, parameters)
+            else:
+                cursor = connection.execute(query)
 
+            rows = cursor.fetchall()
+            if connection.total_changes != changes and not connection.in_transaction:
+                self.pool.write_commits += 1
+            return rows
+        except sqlite3.Error as e:
+            if connection.in_transaction:
+                raise
+            print("Error executing query:", e)
+            return None
 
-        
-  
+    def executemany(self, query, seq_of_parameters):
+        """
+        Executes a SQL statement once for every parameter tuple in a sequence. Errors are handled as in execute.
 
+        Parameters:
+        - query (str): The SQL statement to be executed.
+        - seq_of_parameters (iterable): The parameter tuples.
 
+        Returns:
+        - int or None: The number of rows affected or None in case of an error.
+        """
+        connection = self.connect()
+
+        try:
+            rowcount = connection.executemany(query, seq_of_parameters).rowcount
+            if rowcount and not connection.in_transaction:
+                self.pool.write_commits += 1
+            return rowcount
+        except sqlite3.Error as e:
+            if connection.in_transaction:
+                raise
+            print("Error executing query:", e)
+            return None
@@ -1,90 +1,142 @@
-from database import DatabaseManager
-import subscriptionManager
-import pandas as pd
-from datetime import datetime
+from database import DatabaseManager, normalize_id, normalize_date, DEFAULT_DATE_FORMATS
+from activeRentals import get_active_rental_index
+import csv
+import json
+from collections import namedtuple
+from subscriptionStore import SubscriptionStore
+from datetime import date
+
+# One row of the rental history
+RentalRecord = namedtuple("RentalRecord", ["id", "rental_date", "return_date", "customer_id"])
 
 class GameRent:
 
-    def __init__(self):
+    def __init__(self, db_manager=None, subscription_file=None):
         """
-        Initializes the GameRent object with a DatabaseManager instance.
+        Initializes the GameRent object with a DatabaseManager instance and a SubscriptionStore.
+
+        Parameters:
+        - db_manager (DatabaseManager): The database to use, by default GameRental.db.
+        - subscription_file (str): The subscription file, see SubscriptionStore for the default.
         """
-        self.db_manager = DatabaseManager("GameRental.db")  # Initialize the DatabaseManager
+        self.db_manager = db_manager or DatabaseManager("GameRental.db")  # Initialize the DatabaseManager
+        self.subscriptions = SubscriptionStore(self.db_manager, subscription_file)
+        self.active_rentals = get_active_rental_index(self.db_manager)  # Shared with GameReturn
 
-    def rent_game(self, customer_id, game_id):
+    def rent_game(self, customer_id, game_id, rented_elsewhere=0):
         """
         Rents a game to a customer, updating the rental information in the database.
+        The limit check, availability check and insert run as one atomic transaction, so terminals sharing the
+        database cannot rent out the same copy twice or push a customer over their limit.
 
         Parameters:
         - customer_id (str): The ID of the customer renting the game.
         - game_id (str): The ID of the game to be rented.
+        - rented_elsewhere (int): Games the customer has out in other databases (shards), which count
+          towards their limit too.
 
         Returns:
         - str: A message indicating the result of the rental attempt.
         """
-        self.db_manager.connect()
-        # Load subscription information
-        subscriptions = subscriptionManager.load_subscriptions("/Users/georgebrown/Documents/MASTERS/programming_project/Subscription_Info.txt") #USE OWN PATH HERE
+        customer_id = normalize_id(customer_id)
+        game_id = normalize_id(game_id)
 
         # Check if the customer's subscription is active
-        if subscriptionManager.check_subscription(customer_id, subscriptions):
-            if self.has_reached_rental_limit(customer_id):
-                return "Rental limit reached. Cannot rent more games."
-            else:
-                if self.is_game_available(game_id):
-                    # Mark the game as rented in the database
-                    rent_date = datetime.now().strftime("%d/%m/%Y")
-                    self.db_manager.execute("INSERT INTO Rental (ID, RENTALDATE, RETURNDATE, CUSTOMERID) VALUES (?, ?, ?, ?)",
-                                            (game_id, rent_date, None, customer_id))
-                    
-                    self.db_manager.commit()
-                    self.db_manager.close()
-                    
-                    return "Game rented successfully."
-                
-                else:
-                    self.db_manager.close()
-                    
+        if not self.subscriptions.check_subscription(customer_id):
+            return "Customer subscription is not active."
+
+        rental_limit = self.subscriptions.get_rental_limit(customer_id)
+        rent_date = date.today().isoformat()
+
+        def rent(cursor):
+            # The checks are answered by the active rental index, which is validated inside the transaction
+            with self.active_rentals.lock:
+                self.active_rentals.validate(cursor)
+
+                if self.active_rentals.active_counts.get(customer_id, 0) + rented_elsewhere >= rental_limit:
+                    return "Rental limit reached. Cannot rent more games."
+
+                # The game must exist and not be rented already
+                if not self.active_rentals.game_exists(game_id) or game_id in self.active_rentals.renters:
                     return "Game is not available for rent."
-        else:
 
-            self.db_manager.close()
-            
-            return "Customer subscription is not active."
+                cursor.execute("INSERT INTO Rental (ID, RENTALDATE, RETURNDATE, CUSTOMERID) VALUES (?, ?, NULL, ?)",
+                               (game_id, rent_date, customer_id))
+                self.active_rentals.record(cursor, rented=[(customer_id, game_id)])
+                return "Game rented successfully."
 
-    def is_game_available(self, game_id):
+        return self.db_manager.run_atomic(rent)
+
+    def rent_games(self, pairs, rented_elsewhere=None):
         """
-        Checks if a game is available for rent (not currently rented).
+        Rents many games in one go. Subscriptions come from the subscription cache and rental limits and
+        availability from the active rental index, and every rental is written in a single atomic transaction.
 
         Parameters:
-        - game_id (str): The ID of the game.
+        - pairs (list): (customer_id, game_id) tuples, processed in order.
+        - rented_elsewhere (dict): Games each customer has out in other databases (shards), by normalized
+          customer ID, which count towards their limit too.
 
         Returns:
-        - bool: True if the game is available, False if it is currently rented or does not exist.
+        - list: The result message of each rental, in the same order as pairs (the same messages as rent_game).
         """
-        self.db_manager.connect()
+        pairs = [(normalize_id(customer_id), normalize_id(game_id)) for customer_id, game_id in pairs]
+        customer_ids = {customer_id for customer_id, _ in pairs}
+        rented_elsewhere = rented_elsewhere or {}
+
+        # Subscription checks are answered from the cache
+        limits = self.subscriptions.active_rental_limits(customer_ids)
+
+        rent_date = date.today().isoformat()
+
+        def rent(cursor):
+            results = []
+            new_rentals = []
+            taken = set()  # Copies rented earlier in this batch
+            added = dict(rented_elsewhere)  # Rentals each customer made earlier in this batch or has elsewhere
+
+            with self.active_rentals.lock:
+                self.active_rentals.validate(cursor)
+                renters = self.active_rentals.renters
+                active_counts = self.active_rentals.active_counts
+
+                for customer_id, game_id in pairs:
+                    if customer_id not in limits:
+                        results.append("Customer subscription is not active.")
+                    elif active_counts.get(customer_id, 0) + added.get(customer_id, 0) >= limits[customer_id]:
+                        results.append("Rental limit reached. Cannot rent more games.")
+                    elif not self.active_rentals.game_exists(game_id) or game_id in renters or game_id in taken:
+                        results.append("Game is not available for rent.")
+                    else:
+                        taken.add(game_id)
+                        added[customer_id] = added.get(customer_id, 0) + 1
+                        new_rentals.append((game_id, rent_date, None, customer_id))
+                        results.append("Game rented successfully.")
+
+                cursor.executemany("INSERT INTO Rental (ID, RENTALDATE, RETURNDATE, CUSTOMERID) VALUES (?, ?, ?, ?)", new_rentals)
+                self.active_rentals.record(cursor, rented=[(customer_id, game_id)
+                                                           for game_id, _, _, customer_id in new_rentals])
+
+            return results
+
+        return self.db_manager.run_atomic(rent)
 
-        # Check if the game exists in the database
-        game_exists_query = "SELECT ID FROM Games WHERE ID = ?"
-        game_exists_result = self.db_manager.execute(game_exists_query, (game_id,))
-
-        if not game_exists_result:
-            return False  # Game does not exist in the database
+    def is_game_available(self, game_id):
+        """
+        Checks if a game is available for rent (not currently rented), from the active rental index.
 
-        # Check if the game is available for rent (e.g., not currently rented)
-        rental_query = "SELECT ID FROM Rental WHERE ID = ? AND RETURNDATE IS NULL"
-        rental_result = self.db_manager.execute(rental_query, (game_id,))
-        self.db_manager.close()
+        Parameters:
+        - game_id (str): The ID of the game.
 
-        # If there is a result, the game is currently rented and not available
-        if rental_result:
-            return False
-        else:
-            return True
+        Returns:
+        - bool: True if the game is available, False if it is currently rented or does not exist.
+        """
+        return self.active_rentals.is_game_available(normalize_id(game_id))
 
     def has_reached_rental_limit(self, customer_id):
         """
         Checks if a customer has reached their rental limit based on subscription type.
+        Their open rentals are counted by the active rental index.
 
         Parameters:
         - customer_id (str): The ID of the customer.
@@ -92,49 +144,230 @@ class GameRent:
         Returns:
         - bool: True if the customer has reached the rental limit, False otherwise.
         """
-        # Load subscription information
-        subscriptions = subscriptionManager.load_subscriptions("/Users/georgebrown/Documents/MASTERS/programming_project/Subscription_Info.txt")
+        # Get the rental limit based on the customer's subscription type
+        rental_limit = self.subscriptions.get_rental_limit(customer_id)
 
-        # Check if the customer's subscription is active
-        if customer_id in subscriptions:
-            # Get the customer's subscription type
-            subscription_type = subscriptions[customer_id]["SubscriptionType"]
-
-            # Get the rental limit based on the subscription type
-            rental_limit = subscriptionManager.get_rental_limit(subscription_type)
-
-            # Count the number of games rented by the customer
-            query = "SELECT COUNT(*) FROM Rental WHERE CUSTOMERID = ? AND RETURNDATE IS NULL"
-            result = self.db_manager.execute(query, (customer_id,))
-
-            if result:
-                games_rented = result[0][0]  # The count of rented games
-                return games_rented >= rental_limit  # True if the limit is reached, False otherwise
-            else:
-                return False  # An error occurred while querying the database
+        if rental_limit is not None:
+            return self.active_rentals.active_rental_count(normalize_id(customer_id)) >= rental_limit
         else:
             return False  # Customer does not exist in subscription data or does not have a subscription
 
-    def view_rental_history(self):
+    def view_rental_history(self, customer_id=None, game_id=None, start_date=None, end_date=None, limit=None):
         """
-        Retrieves and returns the rental history as a DataFrame.
+        Retrieves and returns the rental history as a DataFrame, oldest rental first.
+        For long histories use iter_rental_history, iter_rental_history_frames or export_rental_history,
+        which never hold more than one chunk in memory.
+
+        Parameters:
+        - customer_id (str): Only rentals by this customer.
+        - game_id (str): Only rentals of this game.
+        - start_date (str or date): Only rentals made on or after this date.
+        - end_date (str or date): Only rentals made on or before this date.
+        - limit (int): The most rentals to return, or None for all of them.
 
         Returns:
         - pd.DataFrame: Rental history DataFrame with columns: ID, Rental Date, Return Date, Customer ID.
         """
-        self.db_manager.connect()
+        # Imported here so renting and returning never load pandas
+        import pandas as pd
+
+        # Everything is wanted at once, so this reads the same order as the pages but without paging
+        conditions, parameters = self.history_filters(customer_id, game_id, start_date, end_date)
+        limit = -1 if limit is None else int(limit)
 
-        query = "SELECT ID, RENTALDATE, RETURNDATE, CUSTOMERID FROM RENTAL;"
-        rental_history_df = pd.DataFrame(self.db_manager.execute(query), columns=["ID", "Rental Date", "Return Date", "Customer ID"])
-        rental_history_df.set_index("ID", inplace=True)
+        rows = []
+        if start_date is None and end_date is None:
+            rows = self.history_rows(conditions + ["RENTALDATE IS NULL"], parameters, "rowid", limit)
+        if limit < 0 or len(rows) < limit:
+            rows += self.history_rows(conditions + ["RENTALDATE IS NOT NULL"], parameters, "RENTALDATE, rowid",
+                                      limit - len(rows) if limit >= 0 else -1)
 
-        self.db_manager.close()
+        rental_history_df = pd.DataFrame(rows, columns=["rowid", "ID", "Rental Date", "Return Date", "Customer ID"])
+        rental_history_df = rental_history_df.drop(columns="rowid").set_index("ID")
 
         return rental_history_df
 
+    def rental_history_page(self, customer_id=None, game_id=None, start_date=None, end_date=None, limit=1000, after=None):
+        """
+        Fetches one page of the rental history using keyset pagination: each page continues from the last
+        (rental date, rowid) of the previous one, so every page costs the same however deep into the history it is.
+        Rentals are ordered by rental date; any without a date come first.
+
+        Parameters:
+        - customer_id (str): Only rentals by this customer.
+        - game_id (str): Only rentals of this game.
+        - start_date (str or date): Only rentals made on or after this date.
+        - end_date (str or date): Only rentals made on or before this date.
+        - limit (int): The page size.
+        - after (tuple): The key returned with the previous page, or None for the first page.
+
+        Returns:
+        - tuple: (list of RentalRecord, key of the next page or None if this was the last page).
+        """
+        conditions, parameters = self.history_filters(customer_id, game_id, start_date, end_date)
+
+        # Rentals without a date can only match when no date range is given, and are read first
+        if after is None:
+            after = ("undated", None, 0) if start_date is None and end_date is None else ("dated", None, None)
+
+        phase, last_date, last_rowid = after
+        if phase == "undated":
+            rows = self.history_rows(conditions + ["RENTALDATE IS NULL", "rowid > ?"], parameters + [last_rowid],
+                                     "rowid", limit)
+        else:
+            conditions = conditions + ["RENTALDATE IS NOT NULL"]
+            rows = []
+            if last_rowid is not None:
+                # The rest of the last page's date, then the later dates: two exact index seeks, so a page costs
+                # the same however many rentals share a date
+                rows = self.history_rows(conditions + ["RENTALDATE = ?", "rowid > ?"],
+                                         parameters + [last_date, last_rowid], "rowid", limit)
+                conditions = conditions + ["RENTALDATE > ?"]
+                parameters = parameters + [last_date]
+            if len(rows) < limit:
+                rows += self.history_rows(conditions, parameters, "RENTALDATE, rowid", limit - len(rows))
+
+        records = list(map(RentalRecord._make, (row[1:] for row in rows)))
+
+        if len(rows) == limit:
+            return records, (phase, rows[-1][2], rows[-1][0])
+        if phase == "undated":
+            # Carry on with the dated rentals, filling the rest of this page
+            more, next_key = self.rental_history_page(customer_id, game_id, start_date, end_date, limit - len(rows),
+                                                      ("dated", None, None))
+            return records + more, next_key
+        return records, None
+
+    def history_filters(self, customer_id, game_id, start_date, end_date):
+        """
+        Turns the rental history filters into SQL conditions, each of which one of the Rental indexes can serve.
+
+        Returns:
+        - tuple: (list of conditions, list of their parameters).
+        """
+        conditions = []
+        parameters = []
+
+        if customer_id is not None:
+            conditions.append("CUSTOMERID = ?")
+            parameters.append(normalize_id(customer_id))
+        if game_id is not None:
+            conditions.append("ID = ?")
+            parameters.append(normalize_id(game_id))
+        if start_date is not None:
+            conditions.append("RENTALDATE >= ?")
+            parameters.append(self.history_date(start_date))
+        if end_date is not None:
+            conditions.append("RENTALDATE <= ?")
+            parameters.append(self.history_date(end_date))
+
+        return conditions, parameters
+
+    def history_rows(self, conditions, parameters, order, limit):
+        """
+        Runs one rental history query. A limit of -1 means no limit.
+
+        Returns:
+        - list: (rowid, ID, RENTALDATE, RETURNDATE, CUSTOMERID) rows.
+        """
+        query = f"""
+            SELECT rowid, ID, RENTALDATE, RETURNDATE, CUSTOMERID FROM Rental
+            WHERE {" AND ".join(conditions)}
+            ORDER BY {order}
+            LIMIT ?
+        """
+        return self.db_manager.execute(query, parameters + [int(limit)]) or []
+
+    def iter_rental_history(self, customer_id=None, game_id=None, start_date=None, end_date=None, chunk_size=1000):
+        """
+        Streams the rental history in chunks, so memory use is bounded by chunk_size however long the history is.
+
+        Parameters:
+        - customer_id (str): Only rentals by this customer.
+        - game_id (str): Only rentals of this game.
+        - start_date (str or date): Only rentals made on or after this date.
+        - end_date (str or date): Only rentals made on or before this date.
+        - chunk_size (int): The number of rentals in each chunk.
+
+        Returns:
+        - generator: Lists of up to chunk_size RentalRecord tuples, oldest rental first.
+        """
+        after = None
+        while True:
+            records, after = self.rental_history_page(customer_id, game_id, start_date, end_date, chunk_size, after)
+            if records:
+                yield records
+            if after is None:
+                return
+
+    def iter_rental_history_frames(self, customer_id=None, game_id=None, start_date=None, end_date=None, chunk_size=10000):
+        """
+        Streams the rental history as DataFrames of up to chunk_size rows, in the format of view_rental_history.
+
+        Returns:
+        - generator: pd.DataFrame chunks indexed by ID.
+        """
+        import pandas as pd
+
+        for chunk in self.iter_rental_history(customer_id, game_id, start_date, end_date, chunk_size):
+            frame = pd.DataFrame(chunk, columns=["ID", "Rental Date", "Return Date", "Customer ID"])
+            yield frame.set_index("ID")
+
+    def export_rental_history(self, file_name, file_format="csv", customer_id=None, game_id=None, start_date=None,
+                              end_date=None, chunk_size=10000):
+        """
+        Writes the rental history to a CSV or JSON lines file one chunk at a time.
+
+        Parameters:
+        - file_name (str): The file to write.
+        - file_format (str): "csv" or "jsonl".
+        - chunk_size (int): The number of rentals held in memory at once.
+        The filters are the same as for iter_rental_history.
+
+        Returns:
+        - int: The number of rentals written.
+        """
+        if file_format not in ("csv", "jsonl"):
+            raise ValueError(f"Unknown export format: {file_format}")
+
+        written = 0
+        with open(file_name, "w", newline="") as file:
+            if file_format == "csv":
+                writer = csv.writer(file)
+                writer.writerow(["ID", "Rental Date", "Return Date", "Customer ID"])
+
+            for chunk in self.iter_rental_history(customer_id, game_id, start_date, end_date, chunk_size):
+                if file_format == "csv":
+                    writer.writerows(chunk)
+                else:
+                    file.writelines(json.dumps(record._asdict()) + "\n" for record in chunk)
+                written += len(chunk)
+
+        return written
+
+    def history_date(self, value):
+        """
+        Converts a date filter to the ISO format rental dates are stored in.
+
+        Parameters:
+        - value (str or date): A date object, or a string in ISO or dd/mm/YYYY format.
+
+        Returns:
+        - str: The date as YYYY-MM-DD.
+        """
+        if isinstance(value, date):
+            return value.isoformat()
+
+        iso_date = normalize_date(str(value).strip(), DEFAULT_DATE_FORMATS)
+        if iso_date is None:
+            raise ValueError(f"Unrecognised date: {value}")
+        return iso_date
+
 
 # Example usage
 if __name__ == "__main__":
+    import pandas as pd
+
     db_manager = DatabaseManager()
     game_rent_manager = GameRent()
 
@@ -1,17 +1,24 @@
-from database import DatabaseManager
-from datetime import datetime
+from database import DatabaseManager, normalize_id
+from activeRentals import get_active_rental_index
+from datetime import date
 
 class GameReturn:
 
-    def __init__(self):
+    def __init__(self, db_manager=None):
         """
         Initializes the GameReturn object with a DatabaseManager instance.
+
+        Parameters:
+        - db_manager (DatabaseManager): The database to use, by default GameRental.db.
         """
-        self.db_manager = DatabaseManager("GameRental.db")  # Initialize the DatabaseManager
+        self.db_manager = db_manager or DatabaseManager("GameRental.db")  # Initialize the DatabaseManager
+        self.active_rentals = get_active_rental_index(self.db_manager)  # Shared with GameRent
 
     def return_game(self, customer_id, game_id):
         """
         Returns a rented game, updating the return date in the database.
+        The check (against the active rental index) and the update run in one transaction, so a copy cannot be
+        returned twice.
 
         Parameters:
         - customer_id (str): The ID of the customer returning the game.
@@ -20,16 +27,74 @@ class GameReturn:
         Returns:
         - str: A message indicating the result of the return attempt.
         """
-        # Check if the game is currently rented by the customer
-        if self.is_game_rented_by_customer(customer_id, game_id):
-            # Update the return date in the database
-            current_date = datetime.now().strftime("%d/%m/%Y")
-            query = "UPDATE Rental SET RETURNDATE = ? WHERE ID = ? AND CUSTOMERID = ? AND RETURNDATE IS NULL"
-            self.db_manager.execute(query, (current_date, game_id, customer_id))
+        customer_id = normalize_id(customer_id)
+        game_id = normalize_id(game_id)
+        current_date = date.today().isoformat()
+
+        def return_rental(cursor):
+            with self.active_rentals.lock:
+                self.active_rentals.validate(cursor)
+
+                # Only updates the row if the game is currently rented by the customer
+                if game_id not in self.active_rentals.renters or self.active_rentals.renters[game_id] != customer_id:
+                    return False
+
+                cursor.execute("UPDATE Rental SET RETURNDATE = ? WHERE ID = ? AND CUSTOMERID = ? AND RETURNDATE IS NULL",
+                               (current_date, game_id, customer_id))
+                if cursor.rowcount != 1:
+                    self.active_rentals.invalidate()  # The history had the copy rented out twice
+                else:
+                    self.active_rentals.record(cursor, returned=[(customer_id, game_id)])
+                return True
+
+        if self.db_manager.run_atomic(return_rental):
             return "Game returned successfully."
         else:
             return "Game is not rented by this customer."
 
+    def return_games(self, pairs):
+        """
+        Returns many games in one go, e.g. the overnight drop box. The open rentals are looked up in the active
+        rental index and every return is written in a single atomic transaction.
+
+        Parameters:
+        - pairs (list): (customer_id, game_id) tuples.
+
+        Returns:
+        - list: The result message of each return, in the same order as pairs (the same messages as return_game).
+        """
+        pairs = [(normalize_id(customer_id), normalize_id(game_id)) for customer_id, game_id in pairs]
+
+        current_date = date.today().isoformat()
+
+        def return_rentals(cursor):
+            results = []
+            returns = []
+            returned = set()  # Copies returned earlier in this batch
+
+            with self.active_rentals.lock:
+                self.active_rentals.validate(cursor)
+                renters = self.active_rentals.renters
+
+                for customer_id, game_id in pairs:
+                    if game_id in renters and renters[game_id] == customer_id and game_id not in returned:
+                        returned.add(game_id)
+                        returns.append((current_date, game_id, customer_id))
+                        results.append("Game returned successfully.")
+                    else:
+                        results.append("Game is not rented by this customer.")
+
+                cursor.executemany("UPDATE Rental SET RETURNDATE = ? WHERE ID = ? AND CUSTOMERID = ? AND RETURNDATE IS NULL", returns)
+                if cursor.rowcount != len(returns):
+                    self.active_rentals.invalidate()  # The history had a copy rented out twice
+                else:
+                    self.active_rentals.record(cursor, returned=[(customer_id, game_id)
+                                                                 for _, game_id, customer_id in returns])
+
+            return results
+
+        return self.db_manager.run_atomic(return_rentals)
+
     def is_game_rented_by_customer(self, customer_id, game_id):
         """
         Checks if a game is currently rented by the specified customer.
@@ -41,11 +106,9 @@ class GameReturn:
         Returns:
         - bool: True if the game is rented by the customer, False otherwise.
         """
-        self.db_manager.connect()
         # Check if the game is currently rented by the customer
-        query = "SELECT ID FROM Rental WHERE ID = ? AND CUSTOMERID = ? AND RETURNDATE IS NULL"
-        result = self.db_manager.execute(query, (game_id, customer_id))
-        return bool(result)
+        renter = self.active_rentals.renter(normalize_id(game_id))
+        return renter is not None and renter == normalize_id(customer_id)
 
 # Example usage
 if __name__ == "__main__":
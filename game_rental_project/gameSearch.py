@@ -1,57 +1,253 @@
 from database import DatabaseManager
-from gameRent import GameRent
-import pandas as pd
+from collections import namedtuple
+import re
+
+# One search result. A plain tuple underneath, so searching needs neither pandas nor anything else heavy.
+GameRecord = namedtuple("GameRecord", ["id", "platform", "genre", "title", "purchase_price", "purchase_date", "rented"])
 
 class GameSearch:
 
-    def __init__(self):
+    def __init__(self, db_manager=None, initialize=True):
         """
-        Initializes the GameSearch object with a DatabaseManager instance and a GameRent instance.
+        Initializes the GameSearch object with a DatabaseManager instance.
+
+        Parameters:
+        - db_manager (DatabaseManager): The database to search, by default GameRental.db.
+        - initialize (bool): Load Game_Info.txt and Rental_History.txt into the database first.
         """
-        self.db_manager = DatabaseManager()
-        self.game_rent = GameRent()
-        self.db_manager.initialize_databases("Game_Info.txt", "Rental_History.txt")
+        self.db_manager = db_manager or DatabaseManager()
+        self._vocabulary = None
+        if initialize:
+            self.db_manager.initialize_databases("Game_Info.txt", "Rental_History.txt")
 
-    def search_games_by_title(self, title):
+    def search_games_by_title(self, title, limit=None, offset=0, platform=None, genre=None):
         """
         Searches for games by title in the database and displays the results, including rental status.
+        Titles are looked up in the full-text search index and ordered by relevance; an empty title lists every game.
 
         Parameters:
         - title (str): The title of the game to search for.
+        - limit (int): The maximum number of games to return (a page), or None for all of them.
+        - offset (int): The number of matching games to skip before the page starts.
+        - platform (str): Only return games on this platform.
+        - genre (str): Only return games in this genre.
 
         Returns:
-        - None
+        - pd.DataFrame: The matching games indexed by ID, with a "Rented" column. Empty if nothing matched.
         """
-        self.db_manager.connect()
-        formatted_title = self.format_title(title)  # Format the title
-        query = "SELECT * FROM Games WHERE TITLE LIKE ?;"
-        parameters = ('%' + formatted_title + '%',)  # Use the formatted title
+        # Imported here so only displaying results, not searching, needs pandas
+        import pandas as pd
 
-        results = self.db_manager.execute(query, parameters)
+        results = self.find_games(title, platform, genre, limit, offset)
 
-        if results:
+        df = pd.DataFrame(results, columns=["ID", "Platform", "Genre", "Title", "Purchase Price", "Purchase Date", "Rented"])
+        df.set_index("ID", inplace=True)  # Set "ID" as the index
+
+        if not df.empty:
             print("Available Games:")
-            df = pd.DataFrame(results, columns=["ID", "Platform", "Genre", "Title", "Purchase Price", "Purchase Date"])
-            df.set_index("ID", inplace=True)  # Set "ID" as the index
             pd.set_option('display.width', 1000)
             pd.set_option('display.multi_sparse', False)
+            print(df)
+        else:
+            print("No available games with the title:", title)
 
-            rented_games = set()  # Initialize an empty set for rented game IDs
+        return df
 
-            # Check if each game has been rented and update the "Rented" column
-            for i, row in df.iterrows():
-                game_id = i
-                if self.game_rent.is_game_available(game_id):
-                    df.at[i, "Rented"] = "No"  # Game is available for rent
-                else:
-                    df.at[i, "Rented"] = "Yes"  # Game is already rented
-                    rented_games.add(game_id)  # Add the rented game ID to the set
+    def find_games(self, title, platform=None, genre=None, limit=None, offset=0):
+        """
+        Finds games matching a title, trying word/prefix matches first and then correcting misspelt words.
 
-            print(df)
-            self.db_manager.close()
+        Parameters:
+        - title (str): The title (or part of it) to search for.
+        - platform (str): Only return games on this platform.
+        - genre (str): Only return games in this genre.
+        - limit (int): The maximum number of games to return, or None for all of them.
+        - offset (int): The number of matching games to skip.
+
+        Returns:
+        - list: GameRecord (ID, PLATFORM, GENRE, TITLE, PURCHASEPRICE, PURCHASEDATE, RENTED) tuples, most relevant first.
+        """
+        words = re.findall(r"[^\W_]+", self.format_title(title).lower())
+
+        if not words:
+            return [GameRecord._make(row) for row in self.query_games(None, platform, genre, limit, offset)]
+
+        match = self.title_match(words)
+        results = self.query_games(match, platform, genre, limit, offset)
+
+        # Correct misspelt words only if the title matches no game at all, not when a page is past the last match,
+        # so every page of a search uses the same match
+        if not results and (offset == 0 or not self.query_games(match, platform, genre, 1, 0)):
+            results = self.query_games(self.corrected_match(words), platform, genre, limit, offset)
+
+        return [GameRecord._make(row) for row in results]
+
+    def find_ranked_games(self, title, platform=None, genre=None, limit=None, corrected=False):
+        """
+        Finds games matching a title together with their relevance, so the results of several databases
+        (see ShardRouter) can be merged into one order. Unlike find_games it never corrects misspelt words
+        by itself, as that should only happen when no database has a match.
+
+        Parameters:
+        - title (str): The title (or part of it) to search for.
+        - platform (str): Only return games on this platform.
+        - genre (str): Only return games in this genre.
+        - limit (int): The maximum number of games to return, or None for all of them.
+        - corrected (bool): Match the indexed words closest to each (misspelt) word instead.
+
+        Returns:
+        - list: (rank, GameRecord) tuples, best first. Lower ranks are better, without a title every rank is 0.
+        """
+        words = re.findall(r"[^\W_]+", self.format_title(title).lower())
+        if not words:
+            match = None
         else:
-            print("No available games with the title:", title)
-            self.db_manager.close()
+            match = self.corrected_match(words) if corrected else self.title_match(words)
+
+        return [(row[-1], GameRecord._make(row[:-1])) for row in self.query_games(match, platform, genre, limit, 0, True)]
+
+    def title_match(self, words):
+        """
+        Builds the FTS5 match expression for the words of a title: every word must appear, the last one may
+        still be partially typed.
+        """
+        return " ".join(f'"{word}"' for word in words[:-1]) + f' "{words[-1]}"*'
+
+    def corrected_match(self, words):
+        """
+        Builds the FTS5 match expression that lets each word also match the indexed words closest to it.
+        """
+        groups = []
+        for word in words:
+            alternatives = [f'"{word}"*'] + [f'"{match}"' for match in self.similar_words(word)]
+            groups.append("(" + " OR ".join(alternatives) + ")")
+        return " AND ".join(groups)
+
+    def also_rented(self, title, genre=None, top_n=5):
+        """
+        Finds what customers who rented a title also rented, to show next to its search results.
+
+        Parameters:
+        - title (str): The title, e.g. the title of the top search result.
+        - genre (str): Its genre, if the title is sold in more than one.
+        - top_n (int): The number of titles to return.
+
+        Returns:
+        - list: AlsoRented (title, genre, customers) tuples, most customers first. Empty for an unknown title.
+        """
+        # Imported here so searching does not need numpy, only the recommendations do
+        from alsoRented import get_also_rented_index
+
+        title = self.format_title(title).lower()
+        genre = self.format_title(genre).lower() if genre else None
+        return get_also_rented_index(self.db_manager).also_rented(title, genre, top_n)
+
+    def query_games(self, match, platform, genre, limit, offset, ranked=False):
+        """
+        Runs a search against the title index (or the whole Games table), including each game's rental status.
+
+        Parameters:
+        - match (str): The FTS5 match expression, or None for no title filter.
+        - platform (str): Only return games on this platform.
+        - genre (str): Only return games in this genre.
+        - limit (int): The maximum number of games to return, or None for all of them.
+        - offset (int): The number of matching games to skip.
+        - ranked (bool): Add each game's relevance (its FTS5 rank, 0 without a match) as the last column.
+
+        Returns:
+        - list: The result rows, ordered by relevance then ID.
+        """
+        platform = self.format_title(platform).lower() if platform else None
+        genre = self.format_title(genre).lower() if genre else None
+
+        if match:
+            source = "GamesSearch S JOIN Games G ON G.ID = S.rowid"
+            conditions = "GamesSearch MATCH ? AND"
+            order = "S.rank, G.ID"
+            rank = ", S.rank" if ranked else ""
+            parameters = [match]
+        else:
+            source = "Games G"
+            conditions = ""
+            order = "G.ID"
+            rank = ", 0" if ranked else ""
+            parameters = []
+
+        query = f"""
+            SELECT G.ID, G.PLATFORM, G.GENRE, G.TITLE, G.PURCHASEPRICE, G.PURCHASEDATE,
+                   CASE WHEN EXISTS (SELECT 1 FROM Rental R WHERE R.ID = G.ID AND R.RETURNDATE IS NULL)
+                        THEN 'Yes' ELSE 'No' END AS RENTED{rank}
+            FROM {source}
+            WHERE {conditions} (? IS NULL OR REPLACE(G.PLATFORM, ' ', '_') = ?) AND (? IS NULL OR REPLACE(G.GENRE, ' ', '_') = ?)
+            ORDER BY {order}
+            LIMIT ? OFFSET ?
+        """
+        parameters += [platform, platform, genre, genre, -1 if limit is None else int(limit), int(offset)]
+
+        return self.db_manager.execute(query, parameters) or []
+
+    def similar_words(self, word, count=3, threshold=0.4):
+        """
+        Finds the indexed title words that share the most trigrams with a (possibly misspelt) word.
+
+        Parameters:
+        - word (str): The search word.
+        - count (int): The maximum number of words to return.
+        - threshold (float): The minimum share of trigrams the words must have in common.
+
+        Returns:
+        - list: The closest indexed words, best first.
+        """
+        index = self.vocabulary_index()
+        word_trigrams = self.trigrams(word)
+
+        shared = {}
+        for trigram in word_trigrams:
+            for candidate in index.get(trigram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+
+        scored = []
+        for candidate, common in shared.items():
+            similarity = common / (len(word_trigrams) + len(self.trigrams(candidate)) - common)
+            if similarity >= threshold:
+                scored.append((-similarity, candidate))
+
+        scored.sort()
+        return [candidate for _, candidate in scored[:count]]
+
+    def vocabulary_index(self):
+        """
+        Returns an in-memory trigram index of the words in the title index, rebuilding it when games have been
+        bought, loaded, deleted or renamed since (see DatabaseManager.catalog_generation).
+
+        Returns:
+        - dict: Maps each trigram to the set of indexed words containing it.
+        """
+        if self._vocabulary is None:
+            self.db_manager.create_tables()  # An older database may not have the CatalogVersion counter yet
+        key = self.db_manager.catalog_generation()
+
+        if self._vocabulary is None or self._vocabulary[0] != key:
+            index = {}
+            for (term,) in self.db_manager.execute("SELECT term FROM GamesSearchVocab") or []:
+                for trigram in self.trigrams(term):
+                    index.setdefault(trigram, set()).add(term)
+            self._vocabulary = (key, index)
+
+        return self._vocabulary[1]
+
+    def trigrams(self, word):
+        """
+        Splits a word into its set of three-character substrings, padded so short words still have some.
+
+        Parameters:
+        - word (str): The word.
+
+        Returns:
+        - set: The trigrams of the lowercase word.
+        """
+        padded = "$" + word.lower() + "$"
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
 
     def format_title(self, title):
         """
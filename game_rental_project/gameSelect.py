@@ -1,134 +1,377 @@
-import pandas as pd
-from database import DatabaseManager
-import matplotlib.pyplot as plt
-import numpy as np
-from datetime import datetime
+from database import DatabaseManager, POPULARITY_REBUILD_SQL
+import io
+import threading
+from datetime import date
+
+# pandas and NumPy are imported inside the analytics methods, so importing this module (for purchases, or via
+# "from gameSelect import *" in the notebook) does not load them until a report is actually asked for.
 
 class GameSelect:
-    def __init__(self):
+    def __init__(self, db_manager=None):
         """
         Initializes the GameSelect object with a DatabaseManager instance.
-        """
-        self.db_manager = DatabaseManager("GameRental.db")  # Initialize the DatabaseManager
 
-    def select_games_by_popularity(self, show_plot=True):
+        Parameters:
+        - db_manager (DatabaseManager): The database to use, by default GameRental.db.
         """
-        Retrieves a DataFrame of games ordered by popularity.
+        self.db_manager = db_manager or DatabaseManager("GameRental.db")  # Initialize the DatabaseManager
+        self.chart_cache = {}  # Rendered charts keyed by (chart, top_n, popularity generation), oldest first
+        self.chart_cache_size = 16
+        self.chart_cache_lock = threading.Lock()
+        self.snapshot = None  # AnalyticsSnapshot for windowed and decayed popularity, made on first use
+        self.snapshot_generation = None
+        self.snapshot_lock = threading.Lock()  # The service and server call in from several reader threads
+
+    def select_games_by_popularity(self, show_plot=True, top_n=20, window_days=None, half_life_days=None, as_of=None):
+        """
+        Retrieves a DataFrame of games ordered by popularity, read from the TitlePopularity table that
+        triggers keep up to date, so the cost depends on the number of titles rather than the rental history.
+        Recent popularity (a window or a decay) is computed on the columnar snapshot instead.
+
+        Parameters:
+        - show_plot (bool): Also display a bar chart of the most popular games.
+        - top_n (int): The number of games shown in the chart.
+        - window_days (int): Only count rentals from the last this many days.
+        - half_life_days (float): Weigh rentals down by age, halving every this many days.
+        - as_of (date or str): The day the window and decay are counted back from, by default today.
 
         Returns:
         - DataFrame: A DataFrame containing columns "Title", "Genre", and "Popularity".
-                    Returns None if the DataFrame is empty.
         """
-        self.db_manager.connect()
+        if window_days or half_life_days:
+            popularity_df = self.analytics_snapshot().select_games_by_popularity(window_days, half_life_days, as_of)
+            if show_plot and not popularity_df.empty:
+                top = popularity_df.head(top_n)
+                self.show_chart(self.render_bar_chart(top["Title"], top["Popularity"], "Title",
+                                                      self.recent_title("Most popular games", window_days, half_life_days)))
+            return popularity_df
 
         query = """
-            SELECT G.TITLE, G.GENRE, COUNT(R.ID) as Popularity
-            FROM GAMES G
-            LEFT JOIN RENTAL R ON G.ID = R.ID
-            GROUP BY G.TITLE, G.GENRE
-            ORDER BY Popularity DESC
+            SELECT TITLE, GENRE, POPULARITY
+            FROM TitlePopularity
+            ORDER BY POPULARITY DESC
         """
 
-        popularity_df = pd.DataFrame(self.db_manager.execute(query), columns=["Title", "Genre", "Popularity"])
-        
+        import pandas as pd
 
-        self.db_manager.close()
-
-                # Create a bar chart to visualize genre popularity
-        plt.figure(figsize=(10, 6))
-        plt.bar(popularity_df["Title"], popularity_df["Popularity"])
-        plt.xlabel('Title')
-        plt.ylabel('Popularity')
-        plt.title('Most popular games')
-        plt.xticks(rotation=45)
+        popularity_df = pd.DataFrame(self.db_manager.execute(query), columns=["Title", "Genre", "Popularity"])
 
-        if not popularity_df.empty and show_plot:
-            plt.show()
-            plt.clf()
-            plt.close()
-        elif not popularity_df.empty:
-            plt.clf()
-            plt.close()
+        if show_plot and not popularity_df.empty:
+            self.show_chart(self.render_popularity_chart(top_n, popularity_df))
 
         return popularity_df
 
-    def select_popular_genres(self, show_plot=True):
+    def select_popular_genres(self, show_plot=True, top_n=20, window_days=None, half_life_days=None, as_of=None):
         """
-        Retrieves a DataFrame of popular genres and creates a bar chart to visualize genre popularity.
+        Retrieves a DataFrame of popular genres and optionally shows a bar chart of genre popularity.
+        Read from the GenrePopularity table that triggers keep up to date, or with a window or decay
+        computed on the columnar snapshot (see select_games_by_popularity).
+
+        Parameters:
+        - show_plot (bool): Also display a bar chart of the most popular genres.
+        - top_n (int): The number of genres shown in the chart.
+        - window_days (int): Only count rentals from the last this many days.
+        - half_life_days (float): Weigh rentals down by age, halving every this many days.
+        - as_of (date or str): The day the window and decay are counted back from, by default today.
 
         Returns:
         - DataFrame: A DataFrame containing columns "Genre" and "Popularity".
-                    Returns None if the DataFrame is empty.
         """
-        self.db_manager.connect()
+        if window_days or half_life_days:
+            popular_genres_df = self.analytics_snapshot().select_popular_genres(window_days, half_life_days, as_of)
+            if show_plot and not popular_genres_df.empty:
+                top = popular_genres_df.head(top_n)
+                self.show_chart(self.render_bar_chart(top["Genre"], top["Popularity"], "Genre",
+                                                      self.recent_title("Genre Popularity", window_days, half_life_days)))
+            return popular_genres_df
 
         query = """
-           SELECT G.GENRE, COUNT(R.ID) AS Popularity
-           FROM GAMES G
-           LEFT JOIN RENTAL R ON G.ID = R.ID
-           GROUP BY G.GENRE
-           ORDER BY Popularity DESC; 
-
+           SELECT GENRE, POPULARITY
+           FROM GenrePopularity
+           ORDER BY POPULARITY DESC;
         """
 
+        import pandas as pd
+
         popular_genres_df = pd.DataFrame(self.db_manager.execute(query), columns=["Genre", "Popularity"])
-        
-        
 
-        self.db_manager.close()
-        
+        if show_plot and not popular_genres_df.empty:
+            self.show_chart(self.render_genre_chart(top_n, popular_genres_df))
+
+        return popular_genres_df
 
-        # Create a bar chart to visualize genre popularity
-        plt.figure(figsize=(10, 6))
-        plt.bar(popular_genres_df["Genre"], popular_genres_df["Popularity"])
-        plt.xlabel('Genre')
-        plt.ylabel('Popularity')
-        plt.title('Genre Popularity')
-        plt.xticks(rotation=45)
+    def popularity_trends(self, by="title", windows=(7, 30, 90), half_life_days=30, as_of=None):
+        """
+        Reports rolling (last 7/30/90 days), decayed and week-over-week popularity of every title or genre.
 
-        if not popular_genres_df.empty and show_plot:
+        Returns:
+        - DataFrame: See AnalyticsSnapshot.popularity_trends.
+        """
+        return self.analytics_snapshot().popularity_trends(by, windows, half_life_days, as_of)
 
-            plt.show()
-            plt.clf()
-            plt.close()
-        elif not popular_genres_df.empty:
-            plt.clf()
-            plt.close()
+    def analytics_snapshot(self):
+        """
+        Returns the columnar snapshot of the database, refreshed first if the database changed since the last call.
+        The snapshot is kept next to the database file, see AnalyticsSnapshot.
 
-        return popular_genres_df
+        Returns:
+        - AnalyticsSnapshot: The up to date snapshot.
+        """
+        with self.snapshot_lock:
+            if self.snapshot is None:
+                from analyticsSnapshot import get_analytics_snapshot
+                self.snapshot = get_analytics_snapshot(self.db_manager)
 
-    def select_games_for_purchase(self, budget):
-        # Retrieve popularity of games and genres
-        popular_games = self.select_games_by_popularity(show_plot=False)
-        
+            # Compared across the reader threads, so it must not depend on the thread's connection
+            generation = self.db_manager.popularity_generation()
+            if generation != self.snapshot_generation:
+                self.snapshot.refresh()
+                self.snapshot_generation = generation
 
-        if popular_games is None:
-            return "No purchase recommendations found."
+            return self.snapshot
 
-        # Total number of rentals
-        total_rentals = popular_games["Popularity"].sum()
+    def recent_title(self, title, window_days, half_life_days):
+        """
+        Adds the window or decay to a chart title.
+        """
+        if half_life_days:
+            return f"{title} (half-life {half_life_days:g} days)"
+        return f"{title} (last {window_days} days)"
+
+    def rebuild_popularity(self):
+        """
+        Recomputes TitlePopularity and GenrePopularity from the Games and Rental tables, for backfills or
+        after data was changed with the triggers disabled.
+
+        Returns:
+        - int: The number of titles in the rebuilt table.
+        """
+        with self.db_manager.transaction(immediate=True) as cursor:
+            cursor.execute("DELETE FROM TitlePopularity")
+            cursor.execute("DELETE FROM GenrePopularity")
+            for statement in POPULARITY_REBUILD_SQL:
+                cursor.execute(statement)
+            return cursor.execute("SELECT COUNT(*) FROM TitlePopularity").fetchone()[0]
+
+    def check_popularity(self):
+        """
+        Compares the materialized popularity tables with a full recount of the rental history.
+
+        Returns:
+        - list: A description of each title or genre whose stored count is wrong (empty if they all match).
+        """
+        problems = []
+
+        title_query = """
+            SELECT E.TITLE, E.GENRE, E.POPULARITY, M.POPULARITY
+            FROM (SELECT G.TITLE, G.GENRE, COUNT(R.ID) AS POPULARITY
+                  FROM Games G LEFT JOIN Rental R ON R.ID = G.ID GROUP BY G.TITLE, G.GENRE) E
+            LEFT JOIN TitlePopularity M ON M.TITLE IS E.TITLE AND M.GENRE IS E.GENRE
+            WHERE M.POPULARITY IS NOT E.POPULARITY
+            UNION ALL
+            SELECT M.TITLE, M.GENRE, NULL, M.POPULARITY FROM TitlePopularity M
+            WHERE NOT EXISTS (SELECT 1 FROM Games G WHERE G.TITLE IS M.TITLE AND G.GENRE IS M.GENRE)
+        """
+        for title, genre, expected, stored in self.db_manager.execute(title_query) or []:
+            problems.append(f"title {title} ({genre}) has popularity {stored}, expected {expected}")
+
+        genre_query = """
+            SELECT E.GENRE, E.POPULARITY, M.POPULARITY
+            FROM (SELECT G.GENRE, COUNT(R.ID) AS POPULARITY
+                  FROM Games G LEFT JOIN Rental R ON R.ID = G.ID GROUP BY G.GENRE) E
+            LEFT JOIN GenrePopularity M ON M.GENRE IS E.GENRE
+            WHERE M.POPULARITY IS NOT E.POPULARITY
+            UNION ALL
+            SELECT M.GENRE, NULL, M.POPULARITY FROM GenrePopularity M
+            WHERE NOT EXISTS (SELECT 1 FROM Games G WHERE G.GENRE IS M.GENRE)
+        """
+        for genre, expected, stored in self.db_manager.execute(genre_query) or []:
+            problems.append(f"genre {genre} has popularity {stored}, expected {expected}")
 
-        # Calculate the proportion of rentals for each game
-        popular_games["PopularityProportion"] = popular_games["Popularity"] / total_rentals
+        return problems
 
-        popular_games["Budget"] = popular_games["PopularityProportion"] * budget
+    def render_popularity_chart(self, top_n=20, popularity_df=None):
+        """
+        Renders a bar chart of the most popular games as a PNG. Charts are cached until the data changes.
 
-        game_price = self.get_purchase_price(popular_games["Title"])
+        Parameters:
+        - top_n (int): The number of games in the chart.
+        - popularity_df (DataFrame): Already retrieved popularity data, fetched if not given.
 
-        # Apply the get_purchase_price function to each row
-        popular_games["PurchasePrice"] = popular_games.apply(lambda row: self.get_purchase_price(row["Title"]), axis=1)
+        Returns:
+        - bytes or None: The PNG image, or None if there are no games.
+        """
+        return self.render_cached_chart("popularity", top_n, popularity_df, self.select_games_by_popularity,
+                                        "Title", "Most popular games")
 
+    def render_genre_chart(self, top_n=20, popular_genres_df=None):
+        """
+        Renders a bar chart of the most popular genres as a PNG. Charts are cached until the data changes.
 
-            # Calculate the number of copies to buy for each game based on the budget
-        popular_games["CopiesToBuy"] = (popular_games["Budget"] / popular_games["PurchasePrice"]).astype(int)
+        Parameters:
+        - top_n (int): The number of genres in the chart.
+        - popular_genres_df (DataFrame): Already retrieved genre data, fetched if not given.
 
-        
+        Returns:
+        - bytes or None: The PNG image, or None if there are no genres.
+        """
+        return self.render_cached_chart("genres", top_n, popular_genres_df, self.select_popular_genres,
+                                        "Genre", "Genre Popularity")
+
+    def render_cached_chart(self, chart, top_n, data, select, label_column, title):
+        """
+        Returns a cached chart if the database has not changed since it was rendered, otherwise renders it.
+
+        Parameters:
+        - chart (str): The name of the chart, part of the cache key.
+        - top_n (int): The number of bars.
+        - data (DataFrame): The data to plot, or None to fetch it with select.
+        - select (callable): The select method that fetches the data.
+        - label_column (str): The column used for the bar labels.
+        - title (str): The chart title.
+
+        Returns:
+        - bytes or None: The PNG image, or None if there is nothing to plot.
+        """
+        key = (chart, top_n, self.db_manager.popularity_generation())
+
+        with self.chart_cache_lock:
+            if key in self.chart_cache:
+                return self.chart_cache[key]
+
+        # Rendered outside the lock, so one slow chart does not hold up cached ones
+        if data is None:
+            data = select(show_plot=False)
+
+        top = data.head(top_n)
+        image = self.render_bar_chart(top[label_column], top["Popularity"], label_column, title) if not top.empty else None
+
+        with self.chart_cache_lock:
+            # Drop the oldest charts once the cache is full
+            while len(self.chart_cache) >= self.chart_cache_size:
+                self.chart_cache.pop(next(iter(self.chart_cache)))
+            self.chart_cache[key] = image
+
+        return image
+
+    def render_bar_chart(self, labels, values, xlabel, title):
+        """
+        Draws a bar chart off-screen with matplotlib's non-interactive Agg renderer.
+
+        Parameters:
+        - labels (Series): The bar labels.
+        - values (Series): The bar heights.
+        - xlabel (str): The x axis label.
+        - title (str): The chart title.
+
+        Returns:
+        - bytes: The chart as a PNG image.
+        """
+        # Imported here so the plotting stack is only loaded when a chart is actually drawn
+        from matplotlib.figure import Figure
+
+        figure = Figure(figsize=(10, 6))
+        axes = figure.subplots()
+        axes.bar(labels.astype(str), values)
+        axes.set_xlabel(xlabel)
+        axes.set_ylabel('Popularity')
+        axes.set_title(title)
+        axes.tick_params(axis="x", rotation=45)
+        figure.tight_layout()
+
+        buffer = io.BytesIO()
+        figure.savefig(buffer, format="png")
+        return buffer.getvalue()
+
+    def show_chart(self, image):
+        """
+        Displays a rendered chart in the notebook. Does nothing outside IPython.
+
+        Parameters:
+        - image (bytes): The PNG image.
+        """
+        if image is None:
+            return
+
+        try:
+            from IPython.display import Image, display
+        except ImportError:
+            return
+
+        display(Image(data=image))
+
+    def select_games_for_purchase(self, budget, window_days=None, half_life_days=None, as_of=None):
+        """
+        Recommends how many copies of each game to buy, sharing the budget out in proportion to each game's
+        share of all rentals. Popularity comes from the TitlePopularity table and the average purchase price
+        from the covering title index, and the budget split is worked out with NumPy over the whole catalog at once.
+        With a window or decay, recent rentals decide instead and the columnar snapshot does the work.
+
+        Parameters:
+        - budget (float): The amount available to spend.
+        - window_days (int): Only count rentals from the last this many days.
+        - half_life_days (float): Weigh rentals down by age, halving every this many days.
+        - as_of (date or str): The day the window and decay are counted back from, by default today.
+
+        Returns:
+        - DataFrame: Columns "Title", "Genre", "PurchasePrice" and "CopiesToBuy", most popular first.
+                    Empty if there is no rental history to base recommendations on.
+        """
+        if window_days or half_life_days:
+            return self.analytics_snapshot().select_games_for_purchase(budget, window_days, half_life_days, as_of)
+
+        query = """
+            SELECT P.TITLE, P.GENRE, P.POPULARITY, G.PurchasePrice
+            FROM TitlePopularity P
+            JOIN (SELECT TITLE, GENRE, AVG(PURCHASEPRICE) AS PurchasePrice FROM GAMES GROUP BY TITLE, GENRE) G
+              ON G.TITLE IS P.TITLE AND G.GENRE IS P.GENRE
+            ORDER BY P.POPULARITY DESC
+        """
+        import numpy as np
+        import pandas as pd
+
+        rows = self.db_manager.execute(query) or []
+
+        columns = ["Title", "Genre", "PurchasePrice", "CopiesToBuy"]
+        if not rows:
+            return pd.DataFrame(columns=columns)
+
+        titles, genres, popularity, prices = zip(*rows)
+        popularity = np.asarray(popularity, dtype=np.float64)
+        prices = np.nan_to_num(np.asarray(prices, dtype=np.float64))
+
+        # Total number of rentals
+        total_rentals = popularity.sum()
+        if total_rentals <= 0:
+            return pd.DataFrame(columns=columns)
+
+        # Share the budget in proportion to each game's rentals
+        game_budget = popularity / total_rentals * float(budget)
+
+        # Calculate the number of copies to buy, leaving games without a usable price at zero
+        copies = np.zeros(len(prices), dtype=np.int64)
+        priced = prices > 0
+        copies[priced] = np.floor(game_budget[priced] / prices[priced]).astype(np.int64)
+
+        return pd.DataFrame({"Title": titles, "Genre": genres, "PurchasePrice": prices, "CopiesToBuy": copies})
+
+    def title_prices(self):
+        """
+        Adds up the purchase prices of each title's copies, so average prices can be combined across databases
+        (see ShardRouter).
+
+        Returns:
+        - DataFrame: Columns "Title", "Genre", "PriceSum" and "Priced" (the number of copies with a price).
+        """
+        import pandas as pd
+
+        query = """
+            SELECT TITLE, GENRE, SUM(PURCHASEPRICE), COUNT(PURCHASEPRICE)
+            FROM GAMES
+            GROUP BY TITLE, GENRE
+        """
+        return pd.DataFrame(self.db_manager.execute(query) or [], columns=["Title", "Genre", "PriceSum", "Priced"])
 
-        if not popular_games.empty:
-            return popular_games[["Title", "Genre", "PurchasePrice", "CopiesToBuy"]]
-        else:
-            return "No purchase recommendations found."
- 
     def get_purchase_price(self, title):
         """
         Retrieves the purchase price of a game based on its title.
@@ -140,14 +383,12 @@ class GameSelect:
         - float: The purchase price of the game. Returns 0 if not found.
         """
         # Query the database for the purchase price based on title
-        self.db_manager.connect()
         query = """
             SELECT PURCHASEPRICE
             FROM GAMES
             WHERE TITLE = ?
         """
         result = self.db_manager.execute(query, (title,))
-        self.db_manager.close()
 
         if result:
             return result[0][0]
@@ -167,14 +408,6 @@ class GameSelect:
         Returns:
         - str: A message indicating whether the operation was successful or not.
         """
-        # Generate a new game ID
-        new_game_id = self.generate_new_game_id()
-
-        # current date
-
-        purchase_date = datetime.now().strftime("%d/%m/%Y")
-
-
         #convert to int
 
         copies = int(copies)
@@ -182,14 +415,41 @@ class GameSelect:
         #convert to float
         purchase_price = float(purchase_price)
 
-        # Insert the new game into the database for each copy
-        success = self.insert_new_game(new_game_id, title, genre, platform, purchase_date, copies, purchase_price)
+        # Insert every copy, with IDs reserved inside the same transaction
+        success = self.insert_new_game(None, title, genre, platform, date.today().isoformat(), copies, purchase_price)
 
         if success:
             return f"{copies} copies of game '{title}' added to the database ."
         else:
             return "Failed to add the game to the database."
 
+    def add_purchase_order(self, order, purchase_date=None):
+        """
+        Adds a whole purchase order in one transaction. The IDs for all copies are reserved as one contiguous
+        range while the write lock is held, so concurrent purchases can never be given the same IDs.
+
+        Parameters:
+        - order (iterable): (title, genre, platform, copies, purchase_price) tuples, one per title.
+        - purchase_date (str): The purchase date as YYYY-MM-DD, today by default.
+
+        Returns:
+        - list or None: The (first ID, last ID) range given to each line of the order, or None if it failed.
+                        Lines with no copies get (None, None).
+        """
+        purchase_date = purchase_date or date.today().isoformat()
+
+        lines = [(self.clean_name(title), self.clean_name(genre), self.clean_name(platform), int(copies), float(purchase_price))
+                 for title, genre, platform, copies, purchase_price in order]
+
+        def purchase(cursor):
+            first_id = self.reserve_game_ids(cursor, sum(line[3] for line in lines))
+            return self.insert_copies(cursor, first_id, lines, purchase_date)
+
+        try:
+            return self.db_manager.run_atomic(purchase)
+        except Exception as e:
+            print(f"Error adding purchase order: {e}")
+            return None
 
     def generate_new_game_id(self):
 
@@ -197,28 +457,96 @@ class GameSelect:
         Generates a new unique game ID for inserting into the database.
 
         This method queries the database to find the maximum existing game ID, 
-        increments it by 1, and returns the new game ID.
+        increments it by 1, and returns the new game ID. The ID is only a hint: another purchase can take
+        it before it is used, so inserts reserve their IDs with reserve_game_ids instead.
 
         Returns:
         - int: The newly generated game ID.
         """
         # Query the database to find the next available game ID
-        self.db_manager.connect()
         query = "SELECT MAX(ID) FROM GAMES"
         result = self.db_manager.execute(query)
-        self.db_manager.close()
 
         max_id = result[0][0] if result and result[0][0] else 0
         new_game_id = max_id + 1
+        if self.db_manager.game_ids is not None:
+            new_game_id = max(new_game_id, self.db_manager.game_ids.start)
 
         return new_game_id
 
+    def reserve_game_ids(self, cursor, count):
+        """
+        Returns the first of count unused, contiguous game IDs. Must be called inside a BEGIN IMMEDIATE
+        transaction (see DatabaseManager.run_atomic) that also inserts the copies, so the range stays reserved.
+
+        Parameters:
+        - cursor (sqlite3.Cursor): The cursor of the open transaction.
+        - count (int): The number of IDs needed.
+
+        Returns:
+        - int: The first ID of the range.
+        """
+        # ID is the INTEGER PRIMARY KEY, so MAX(ID) is a single index lookup
+        first_id = (cursor.execute("SELECT MAX(ID) FROM GAMES").fetchone()[0] or 0) + 1
+
+        # A shard numbers its copies within its own range, so IDs stay unique across every shard
+        game_ids = self.db_manager.game_ids
+        if game_ids is not None:
+            first_id = max(first_id, game_ids.start)
+            if count > 0 and first_id + count - 1 not in game_ids:
+                raise ValueError(f"{self.db_manager.gamerental_db_file} has no game IDs left for {count} copies")
+
+        return first_id
+
+    def insert_copies(self, cursor, first_id, lines, purchase_date):
+        """
+        Inserts the copies of every line in one bulk insert, numbering them from first_id.
+
+        Parameters:
+        - cursor (sqlite3.Cursor): The cursor of the open transaction.
+        - first_id (int): The ID of the first copy.
+        - lines (list): Cleaned (title, genre, platform, copies, purchase_price) tuples.
+        - purchase_date (str): The purchase date as YYYY-MM-DD.
+
+        Returns:
+        - list: The (first ID, last ID) range of each line, or (None, None) for lines with no copies.
+        """
+        ranges = []
+        rows = []
+        next_id = first_id
+
+        for title, genre, platform, copies, purchase_price in lines:
+            if copies <= 0:
+                ranges.append((None, None))
+                continue
+
+            ranges.append((next_id, next_id + copies - 1))
+            rows.extend((game_id, title, genre, platform, purchase_date, purchase_price)
+                        for game_id in range(next_id, next_id + copies))
+            next_id += copies
+
+        self.db_manager.bulk_insert_games(cursor, rows)
+
+        return ranges
+
+    def clean_name(self, name):
+        """
+        Formats a title, genre or platform the way they are stored in the database.
+
+        Parameters:
+        - name (str): The name as entered.
+
+        Returns:
+        - str: The name in lower case with underscores instead of spaces and no apostrophes.
+        """
+        return name.lower().replace(" ", "_").replace("'", "")
+
     def insert_new_game(self, new_game_id, title, genre, platform, purchase_date, copies, purchase_price):
         """
         Inserts a new game into the database.
 
         Parameters:
-        - new_game_id (int): The ID of the new game.
+        - new_game_id (int): The ID of the first copy, or None to reserve a free range atomically.
         - title (str): The title of the game.
         - genre (str): The genre of the game.
         - copies (int): The number of copies to be added to the database.
@@ -236,35 +564,39 @@ class GameSelect:
         # Convert purchase_price to a float
         purchase_price = float(purchase_price)
 
-        title = title.lower().replace(" ", "_").replace("'", "")
-        genre = genre.lower().replace(" ", "_").replace("'", "")
-        platform = platform.lower().replace(" ", "_").replace("'", "")
+        lines = [(self.clean_name(title), self.clean_name(genre), self.clean_name(platform), copies, purchase_price)]
 
-        # Insert the new game into the database for each copy
-        self.db_manager.connect()
-    
+        def insert(cursor):
+            first_id = new_game_id if new_game_id is not None else self.reserve_game_ids(cursor, copies)
+            self.insert_copies(cursor, first_id, lines, purchase_date)
+
+        # Insert every copy in one transaction, rolled back as a whole on failure
         try:
-            for _ in range(copies):
-                query = "INSERT INTO GAMES (ID, TITLE, GENRE, PLATFORM, PURCHASEDATE, PURCHASEPRICE) VALUES (?, ?, ?, ?, ?, ?)"
-                self.db_manager.execute(query, (new_game_id, title, genre, platform, purchase_date, purchase_price))
-                new_game_id += 1  # Increment the game ID for the next copy
-        
-            self.db_manager.commit()
+            self.db_manager.run_atomic(insert)
             return True
 
         except Exception as e:
             print(f"Error inserting new game: {e}")
-            self.db_manager.rollback()
             return False
 
-        finally:
-            self.db_manager.close()
-
 
 
 if __name__ == "__main__":
+    import sys
+
     game_select = GameSelect()
 
+    # python gameSelect.py rebuild-popularity | check-popularity
+    if sys.argv[1:] == ["rebuild-popularity"]:
+        print(f"Rebuilt popularity for {game_select.rebuild_popularity()} titles.")
+        sys.exit()
+    if sys.argv[1:] == ["check-popularity"]:
+        problems = game_select.check_popularity()
+        for problem in problems:
+            print(problem)
+        print(f"{len(problems)} popularity mismatches.")
+        sys.exit(1 if problems else 0)
+
     #price = game_select.get_purchase_price("game_1")
     #print(price)
     #popularity_df = game_select.select_games_for_purchase(3000)
@@ -0,0 +1,173 @@
+import argparse
+import os
+import random
+from datetime import date, timedelta
+
+import numpy as np
+
+from syntheticCatalog import make_words
+
+PLATFORMS = ["PlayStation", "Xbox", "Nintendo_Switch", "PC"]
+GENRES = ["Action", "Adventure", "RPG", "Shooter", "Sports", "Simulation", "Platformer", "Racing"]
+PRICES = [20, 30, 40, 50, 60, 70]
+
+CHUNK_SIZE = 200000
+
+
+def date_strings(start, days, pattern):
+    """
+    Formats every day from start onwards once, so dates can be looked up by day offset instead of formatted per row.
+    """
+    return np.array([(start + timedelta(days=day)).strftime(pattern) for day in range(days)], dtype=object)
+
+
+def write_lines(file_name, header, columns):
+    """
+    Writes comma separated rows to a file in chunks, so even very large files are never held in memory as one string.
+
+    Parameters:
+    - file_name (str): The file to write.
+    - header (str): The header line.
+    - columns (list): Equally long sequences, one per field.
+    """
+    with open(file_name, "w", newline="") as file:
+        file.write(header + "\n")
+        for start in range(0, len(columns[0]), CHUNK_SIZE):
+            chunk = [column[start:start + CHUNK_SIZE] for column in columns]
+            file.write("".join(",".join(map(str, row)) + "\n" for row in zip(*chunk)))
+
+
+def rental_limit(customer_id):
+    """
+    Returns the rental limit of a generated customer: even IDs are Premium, odd IDs are Basic.
+    """
+    return 7 if customer_id % 2 == 0 else 2
+
+
+def is_active(customer_id):
+    """
+    Returns True if a generated customer has an active subscription (every tenth customer has lapsed).
+    """
+    return customer_id % 10 != 0
+
+
+def generate_dataset(directory, games=10000, rentals=100000, customers=5000, copies_per_title=5, skew=1.1,
+                     open_share=0.01, seed=1):
+    """
+    Writes a synthetic Game_Info.txt, Rental_History.txt and Subscription_Info.txt in the same formats as the
+    sample files. Title popularity follows a Zipf-like curve, so a few titles get most of the rentals.
+
+    Parameters:
+    - directory (str): The directory the files are written to.
+    - games (int): The number of game copies.
+    - rentals (int): The number of rentals in the history.
+    - customers (int): The number of customers, all of whom have a subscription.
+    - copies_per_title (int): The average number of copies of each title.
+    - skew (float): The Zipf exponent of title popularity (0 makes every title equally popular).
+    - open_share (float): The share of rentals that are still out (not returned).
+    - seed (int): The random seed, so the same arguments always give the same files.
+
+    Returns:
+    - dict: The paths of the three files and the number of rows of each kind.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+
+    # Games: copy i has title i % titles, so every title has copies_per_title copies give or take one
+    titles = max(games // copies_per_title, 1)
+    words = make_words(random.Random(seed), max(titles // 4, 50))
+    word_choices = rng.integers(0, len(words), size=(titles, 3))
+    word_counts = rng.integers(1, 4, size=titles)
+    title_names = ["_".join(words[word].capitalize() for word in row[:count]) + f"_{index}"
+                   for index, (row, count) in enumerate(zip(word_choices, word_counts))]
+
+    game_ids = np.arange(1, games + 1)
+    title_of_game = (game_ids - 1) % titles
+    genre_of_title = rng.integers(0, len(GENRES), size=titles)
+    purchase_dates = date_strings(date(2015, 1, 1), 9 * 365, "%m/%d/%Y")  # Game_Info.txt is month first
+    prices = np.array(PRICES, dtype=object)[rng.integers(0, len(PRICES), size=games)]
+    prices[rng.random(games) < 0.01] = ""  # Some missing prices, like the sample data
+
+    games_file = os.path.join(directory, "Game_Info.txt")
+    write_lines(games_file, "ID,Platform,Genre,Title,PurchasePrice,PurchaseDate", [
+        game_ids,
+        np.array(PLATFORMS, dtype=object)[rng.integers(0, len(PLATFORMS), size=games)],
+        np.array(GENRES, dtype=object)[genre_of_title[title_of_game]],
+        np.array(title_names, dtype=object)[title_of_game],
+        prices,
+        purchase_dates[rng.integers(0, len(purchase_dates), size=games)],
+    ])
+
+    # Rentals: pick a title by Zipf weight, then one of its copies uniformly
+    weights = 1.0 / np.arange(1, titles + 1) ** skew
+    popularity_rank = rng.permutation(titles)  # So the popular titles are not simply the lowest IDs
+    rented_titles = popularity_rank[rng.choice(titles, size=rentals, p=weights / weights.sum())]
+    copies_of_title = (games - 1 - rented_titles) // titles + 1
+    rented_games = rented_titles + 1 + (rng.random(rentals) * copies_of_title).astype(np.int64) * titles
+
+    history_days = 3 * 365
+    rental_days = np.sort(rng.integers(0, history_days, size=rentals))
+    return_days = np.minimum(rental_days + rng.integers(1, 31, size=rentals), history_days - 1)
+    rental_dates = date_strings(date.today() - timedelta(days=history_days), history_days, "%d/%m/%Y")
+
+    active_customers = np.array([customer for customer in range(1, customers + 1) if is_active(customer)])
+    rental_customers = rng.choice(active_customers, size=rentals)
+    return_dates = rental_dates[return_days]
+
+    # The most recent rentals are still out: one per copy, and never more than a customer's limit
+    open_rentals = min(int(rentals * open_share), games, rentals)
+    if open_rentals:
+        open_rows = np.arange(rentals - open_rentals, rentals)
+        rented_games[open_rows] = rng.choice(game_ids, size=open_rentals, replace=False)
+        slots = np.concatenate([[customer] * rental_limit(customer) for customer in active_customers])
+        open_customers = rng.permutation(slots)[:open_rentals]
+        rental_customers[open_rows[:len(open_customers)]] = open_customers
+        return_dates = return_dates.copy()
+        return_dates[open_rows[:len(open_customers)]] = ""
+
+    rentals_file = os.path.join(directory, "Rental_History.txt")
+    write_lines(rentals_file, "Game ID,Rental Date,Return Date,Customer ID",
+                [rented_games, rental_dates[rental_days], return_dates, rental_customers])
+
+    # Subscriptions: lapsed customers ended last year, everyone else runs until 2099
+    customer_ids = np.arange(1, customers + 1)
+    subscriptions_file = os.path.join(directory, "Subscription_Info.txt")
+    last_year = date.today().year - 1
+    write_lines(subscriptions_file, "CustomerID,SubscriptionType,StartDate,EndDate", [
+        customer_ids,
+        ["Premium" if rental_limit(customer) == 7 else "Basic" for customer in customer_ids],
+        [f"{last_year - 1}-01-01"] * customers,
+        ["2099-12-31" if is_active(customer) else f"{last_year}-12-31" for customer in customer_ids],
+    ])
+
+    return {
+        "games_file": games_file,
+        "rentals_file": rentals_file,
+        "subscriptions_file": subscriptions_file,
+        "games": games,
+        "titles": titles,
+        "rentals": rentals,
+        "open_rentals": open_rentals,
+        "customers": customers,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic catalog, rental history and subscription file.")
+    parser.add_argument("directory", help="where to write the three files")
+    parser.add_argument("--games", type=int, default=10000, help="number of game copies")
+    parser.add_argument("--rentals", type=int, default=100000, help="number of rentals, 10^3 to 10^7")
+    parser.add_argument("--customers", type=int, default=5000)
+    parser.add_argument("--copies-per-title", type=int, default=5)
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of title popularity")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    summary = generate_dataset(args.directory, args.games, args.rentals, args.customers, args.copies_per_title,
+                               args.skew, seed=args.seed)
+    print(f"Wrote {summary['games']} copies of {summary['titles']} titles, {summary['rentals']} rentals "
+          f"({summary['open_rentals']} still out) and {summary['customers']} subscriptions to {args.directory}")
+
+
+if __name__ == "__main__":
+    main()
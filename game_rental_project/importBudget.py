@@ -0,0 +1,78 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+# What a rent/return/search terminal imports
+CORE_MODULES = ["gameRent", "gameReturn", "gameSearch"]
+
+# Analytics dependencies that must only be loaded when a report is asked for
+HEAVY_MODULES = ["pandas", "numpy", "matplotlib"]
+
+BUDGET_MS = 150
+
+
+def measure_imports(modules=CORE_MODULES, runs=5):
+    """
+    Imports modules in fresh interpreters with python -X importtime and reads off how long it took.
+
+    Parameters:
+    - modules (list): The modules to import, in order.
+    - runs (int): How many fresh interpreters to time.
+
+    Returns:
+    - tuple: (median import time in milliseconds, sorted list of every module that was loaded).
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    timings = []
+    loaded = set()
+
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + ", ".join(modules)],
+                                cwd=directory, capture_output=True, text=True, check=True)
+
+        total_us = 0
+        for line in result.stderr.splitlines():
+            # import time: self [us] | cumulative | imported package
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            _, cumulative, name = line.split("|")
+            if not cumulative.strip().isdigit():
+                continue  # The header line
+            loaded.add(name.strip())
+            if name.strip() in modules and not name.startswith("  "):
+                total_us += int(cumulative)
+
+        timings.append(total_us / 1000)
+
+    return statistics.median(timings), sorted(loaded)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that the rent/return/search modules import quickly "
+                                                 "and without the analytics stack.")
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS, help="the most the imports may take")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    milliseconds, loaded = measure_imports(CORE_MODULES, args.runs)
+    heavy = [module for module in HEAVY_MODULES if module in loaded]
+
+    print(f"Importing {', '.join(CORE_MODULES)} takes {milliseconds:.1f} ms (budget {args.budget_ms:.0f} ms)")
+
+    failed = False
+    if milliseconds > args.budget_ms:
+        print("FAILED: over the import time budget")
+        failed = True
+    if heavy:
+        print(f"FAILED: {', '.join(heavy)} imported by the core modules")
+        failed = True
+
+    if failed:
+        raise SystemExit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import argparse
+import http.client
+import json
+import random
+import statistics
+import threading
+import time
+
+# How often each operation is picked, a checkout terminal mostly searches
+OPERATION_WEIGHTS = {"search": 6, "rent": 2, "return": 2, "popularity": 1}
+
+
+def percentile(timings, share):
+    """
+    Returns the value below which the given share of the timings fall (nearest rank).
+    """
+    ordered = sorted(timings)
+    return ordered[min(int(len(ordered) * share), len(ordered) - 1)]
+
+
+class Terminal:
+
+    def __init__(self, host, port, customers, games, titles, seed):
+        """
+        Initializes a simulated checkout terminal with one kept-alive connection to the server.
+
+        Parameters:
+        - host (str): The server host.
+        - port (int): The server port.
+        - customers (int): Customers are picked from 1 to this.
+        - games (int): Games are picked from 1 to this.
+        - titles (list): Titles to search for.
+        - seed (int): The random seed of this terminal.
+        """
+        self.connection = http.client.HTTPConnection(host, port)
+        self.customers = customers
+        self.games = games
+        self.titles = titles
+        self.random = random.Random(seed)
+        self.rented = []  # Games this terminal rented and has not returned yet
+        self.timings = {}
+        self.errors = 0
+
+    def request(self, method, path, params=None):
+        """
+        Sends one request and reads its JSON response.
+
+        Returns:
+        - The decoded response.
+        """
+        body = json.dumps(params).encode() if params is not None else None
+        headers = {"Content-Type": "application/json"} if body else {}
+        self.connection.request(method, path, body=body, headers=headers)
+        response = self.connection.getresponse()
+        payload = json.loads(response.read())
+        if response.status != 200:
+            self.errors += 1
+        return payload
+
+    def next_request(self):
+        """
+        Picks the next operation.
+
+        Returns:
+        - tuple: (operation name, method, path, params).
+        """
+        operation = self.random.choices(list(OPERATION_WEIGHTS), list(OPERATION_WEIGHTS.values()))[0]
+
+        if operation == "return" and not self.rented:
+            operation = "rent"
+
+        if operation == "search":
+            title = self.random.choice(self.titles).replace("_", " ").split()[0]
+            return operation, "GET", f"/search?title={title}&limit=20", None
+        if operation == "rent":
+            customer_id, game_id = self.random.randint(1, self.customers), self.random.randint(1, self.games)
+            self.rented.append((customer_id, game_id))
+            return operation, "POST", "/rent", {"customer_id": customer_id, "game_id": game_id}
+        if operation == "return":
+            customer_id, game_id = self.rented.pop(self.random.randrange(len(self.rented)))
+            return operation, "POST", "/return", {"customer_id": customer_id, "game_id": game_id}
+        return operation, "GET", "/popularity/genres", None
+
+    def run(self, deadline, batch_size):
+        """
+        Sends requests until the deadline, one at a time or batch_size at a time through /batch.
+        """
+        while time.perf_counter() < deadline:
+            requests = [self.next_request() for _ in range(batch_size)]
+
+            start = time.perf_counter()
+            if batch_size == 1:
+                self.request(*requests[0][1:])
+            else:
+                results = self.request("POST", "/batch", {"requests": [
+                    {"method": method, "path": path.split("?")[0], "params": params or query_params(path)}
+                    for _, method, path, params in requests]})
+                self.errors += sum(1 for result in results if result["status"] != 200)
+            seconds = time.perf_counter() - start
+
+            name = requests[0][0] if batch_size == 1 else "batch"
+            self.timings.setdefault(name, []).append(seconds)
+
+        self.connection.close()
+
+
+def query_params(path):
+    """
+    Turns the query string of a path into a params dict, for requests sent inside a batch.
+    """
+    query = path.split("?", 1)[1] if "?" in path else ""
+    return dict(pair.split("=", 1) for pair in query.split("&") if pair)
+
+
+def run_load(host, port, terminals=8, duration=10.0, customers=5000, games=10000, batch_size=1, seed=1):
+    """
+    Runs simulated terminals against a server in parallel and reports throughput and latency.
+
+    Parameters:
+    - host (str): The server host.
+    - port (int): The server port.
+    - terminals (int): The number of terminals, each on its own thread and connection.
+    - duration (float): How long to send requests for, in seconds.
+    - customers (int): Customers are picked from 1 to this.
+    - games (int): Games are picked from 1 to this.
+    - batch_size (int): Operations sent per HTTP request (1 sends them one by one).
+    - seed (int): The random seed.
+
+    Returns:
+    - dict: Requests, operations and errors, requests per second, and p50/p99 latency overall and per operation.
+    """
+    probe = Terminal(host, port, customers, games, [], seed)
+    titles = [row["Title"] for row in probe.request("GET", "/popularity/titles?top_n=100")] or ["a"]
+    probe.connection.close()
+
+    clients = [Terminal(host, port, customers, games, titles, seed + number) for number in range(terminals)]
+    deadline = time.perf_counter() + duration
+    threads = [threading.Thread(target=client.run, args=(deadline, batch_size)) for client in clients]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    timings = {}
+    for client in clients:
+        for name, values in client.timings.items():
+            timings.setdefault(name, []).extend(values)
+    everything = [value for values in timings.values() for value in values]
+
+    def summary(values):
+        return {
+            "requests": len(values),
+            "p50_ms": round(statistics.median(values) * 1000, 3),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+        }
+
+    return {
+        "terminals": terminals,
+        "batch_size": batch_size,
+        "seconds": round(elapsed, 3),
+        "requests": len(everything),
+        "operations": len(everything) * batch_size,
+        "errors": sum(client.errors for client in clients),
+        "requests_per_second": round(len(everything) / elapsed, 1),
+        "operations_per_second": round(len(everything) * batch_size / elapsed, 1),
+        "overall": summary(everything) if everything else None,
+        "by_operation": {name: summary(values) for name, values in sorted(timings.items())},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a running rentalServer.py with simulated terminals.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--terminals", type=int, default=8, help="concurrent terminals")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run for")
+    parser.add_argument("--customers", type=int, default=5000, help="customer IDs are picked from 1 to this")
+    parser.add_argument("--games", type=int, default=10000, help="game IDs are picked from 1 to this")
+    parser.add_argument("--batch-size", type=int, default=1, help="operations per request, sent through /batch")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    report = run_load(args.host, args.port, args.terminals, args.duration, args.customers, args.games,
+                      args.batch_size, args.seed)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
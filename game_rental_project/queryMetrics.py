@@ -0,0 +1,347 @@
+import collections
+import functools
+import re
+import sqlite3
+import threading
+import time
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+# Only these statements have a query plan worth logging
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "WITH")
+
+SLOW_QUERY_LOGGER = "gameRental.slowQueries"
+
+# Compiled by re on first use, not at import
+_STRINGS = r"'(?:[^']|'')*'"
+_NUMBERS = r"\b\d+(?:\.\d+)?\b"
+_SPACES = r"\s+"
+_PLACEHOLDER_LISTS = r"\(\s*\?(?:\s*,\s*\?)+\s*\)"
+
+
+@functools.lru_cache(maxsize=4096)
+def query_shape(sql):
+    """
+    Reduces a statement to its shape, so the same query with different literals is counted together.
+
+    Parameters:
+    - sql (str): The SQL statement.
+
+    Returns:
+    - str: The statement on one line with literals replaced by ? and placeholder lists collapsed to (?).
+    """
+    shape = re.sub(_STRINGS, "?", sql)
+    shape = re.sub(_NUMBERS, "?", shape)
+    shape = re.sub(_SPACES, " ", shape).strip().rstrip(";").strip()
+    return re.sub(_PLACEHOLDER_LISTS, "(?)", shape)
+
+
+class QueryStats:
+
+    def __init__(self):
+        """
+        Initializes the counters kept for one query shape.
+        """
+        self.count = 0
+        self.errors = 0
+        self.rows = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)  # The last bucket is everything slower
+
+    def as_dict(self):
+        """
+        Returns the counters as plain values.
+
+        Returns:
+        - dict: The count, errors, rows, total and maximum latency and the (non-cumulative) histogram.
+        """
+        labels = [str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"]
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "rows": self.rows,
+            "total_seconds": self.total_seconds,
+            "max_seconds": self.max_seconds,
+            "histogram": dict(zip(labels, self.buckets)),
+        }
+
+
+class QueryMetrics:
+
+    def __init__(self, slow_query_seconds=0.1, slow_query_history=100):
+        """
+        Initializes the metrics shared by every connection of a pool.
+
+        Parameters:
+        - slow_query_seconds (float): Statements slower than this are logged with their query plan. None turns it off.
+        - slow_query_history (int): How many slow queries the snapshot keeps.
+        """
+        self.enabled = True
+        self.slow_query_seconds = slow_query_seconds
+        self.slow_queries = collections.deque(maxlen=slow_query_history)
+        self.hooks = []
+        self.queries = {}
+        self.statements = 0
+        self.connections_opened = 0
+        self.connections_closed = 0
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook):
+        """
+        Registers a callable that is called after every statement as hook(shape, sql, seconds, error).
+        error is the exception raised by the statement, or None.
+
+        Parameters:
+        - hook (callable): The hook to call.
+        """
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        """
+        Unregisters a hook added with add_hook.
+        """
+        self.hooks.remove(hook)
+
+    def connection_opened(self):
+        """
+        Counts a newly opened connection.
+        """
+        with self._lock:
+            self.connections_opened += 1
+
+    def connection_closed(self):
+        """
+        Counts a closed connection.
+        """
+        with self._lock:
+            self.connections_closed += 1
+
+    def record(self, connection, sql, parameters, seconds, error=None):
+        """
+        Records one executed statement, logging it if it was slow.
+
+        Parameters:
+        - connection (sqlite3.Connection): The connection it ran on, used to explain slow queries.
+        - sql (str): The SQL statement.
+        - parameters (tuple): Its parameters, or None if they are not known.
+        - seconds (float): How long executing it took.
+        - error (Exception): The error it raised, if any.
+
+        Returns:
+        - str: The shape the statement was counted under.
+        """
+        shape = query_shape(sql)
+        bucket = 0
+        while bucket < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[bucket]:
+            bucket += 1
+
+        with self._lock:
+            stats = self.queries.get(shape)
+            if stats is None:
+                stats = self.queries[shape] = QueryStats()
+            stats.count += 1
+            stats.total_seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.buckets[bucket] += 1
+            if error is not None:
+                stats.errors += 1
+            self.statements += 1
+
+        if self.slow_query_seconds is not None and seconds >= self.slow_query_seconds:
+            self.log_slow_query(connection, sql, parameters, seconds)
+
+        for hook in self.hooks:
+            hook(shape, sql, seconds, error)
+
+        return shape
+
+    def record_rows(self, shape, rows):
+        """
+        Adds rows fetched from a statement to its shape's counters.
+        """
+        with self._lock:
+            stats = self.queries.get(shape)
+            if stats is not None:  # None if reset() ran since the statement was executed
+                stats.rows += rows
+
+    def log_slow_query(self, connection, sql, parameters, seconds):
+        """
+        Logs a slow statement together with its EXPLAIN QUERY PLAN, and keeps it for the snapshot.
+        """
+        plan = []
+        if parameters is not None and query_shape(sql).upper().startswith(EXPLAINABLE):
+            try:
+                # A plain cursor, so explaining is not itself recorded
+                plan = [row[3] for row in sqlite3.Cursor(connection).execute("EXPLAIN QUERY PLAN " + sql, parameters)]
+            except sqlite3.Error:
+                pass
+
+        entry = {"sql": query_shape(sql), "seconds": seconds, "plan": plan, "time": time.time()}
+        self.slow_queries.append(entry)
+
+        # Imported on the first slow query rather than at startup
+        import logging
+        logging.getLogger(SLOW_QUERY_LOGGER).warning("Slow query (%.1f ms): %s\n  plan: %s", seconds * 1000,
+                                                     entry["sql"], "; ".join(plan) or "not available")
+
+    def statement_count(self):
+        """
+        Returns how many statements have run so far, e.g. to count the queries one call fires.
+        """
+        return self.statements
+
+    def reset(self):
+        """
+        Clears every counter and the slow query history. Connection counts are kept.
+        """
+        with self._lock:
+            self.queries = {}
+            self.statements = 0
+            self.slow_queries.clear()
+
+    def snapshot(self):
+        """
+        Returns a copy of all metrics.
+
+        Returns:
+        - dict: Statement and connection counts, per-shape counters and the recent slow queries.
+        """
+        with self._lock:
+            return {
+                "statements": self.statements,
+                "connections_opened": self.connections_opened,
+                "connections_open": self.connections_opened - self.connections_closed,
+                "queries": {shape: stats.as_dict() for shape, stats in self.queries.items()},
+                "slow_queries": list(self.slow_queries),
+            }
+
+    def prometheus(self):
+        """
+        Returns all metrics in the Prometheus text exposition format.
+
+        Returns:
+        - str: The metrics, one sample per line.
+        """
+        snapshot = self.snapshot()
+
+        def label(shape):
+            return shape.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+        lines = [
+            "# HELP gamerental_connections_opened_total SQLite connections opened by the pool.",
+            "# TYPE gamerental_connections_opened_total counter",
+            f"gamerental_connections_opened_total {snapshot['connections_opened']}",
+            "# HELP gamerental_connections_open SQLite connections currently open.",
+            "# TYPE gamerental_connections_open gauge",
+            f"gamerental_connections_open {snapshot['connections_open']}",
+            "# HELP gamerental_query_seconds Time taken to execute each query shape.",
+            "# TYPE gamerental_query_seconds histogram",
+        ]
+
+        for shape, stats in snapshot["queries"].items():
+            cumulative = 0
+            for bound, count in stats["histogram"].items():
+                cumulative += count
+                lines.append(f'gamerental_query_seconds_bucket{{query="{label(shape)}",le="{bound}"}} {cumulative}')
+            lines.append(f'gamerental_query_seconds_sum{{query="{label(shape)}"}} {stats["total_seconds"]}')
+            lines.append(f'gamerental_query_seconds_count{{query="{label(shape)}"}} {stats["count"]}')
+
+        for name, key, description in (("rows", "rows", "Rows fetched from each query shape."),
+                                       ("errors", "errors", "Statements of each query shape that failed.")):
+            lines.append(f"# HELP gamerental_query_{name}_total {description}")
+            lines.append(f"# TYPE gamerental_query_{name}_total counter")
+            for shape, stats in snapshot["queries"].items():
+                lines.append(f'gamerental_query_{name}_total{{query="{label(shape)}"}} {stats[key]}')
+
+        return "\n".join(lines) + "\n"
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    A cursor that reports every statement and the rows fetched from it to the connection's QueryMetrics.
+    """
+
+    shape = None
+
+    def execute(self, sql, parameters=()):
+        metrics = self.connection.metrics
+        if metrics is None or not metrics.enabled:  # None once the connection is closed, sqlite reports that
+            return super().execute(sql, parameters)
+
+        self.shape = None
+        start = time.perf_counter()
+        try:
+            result = super().execute(sql, parameters)
+        except sqlite3.Error as e:
+            metrics.record(self.connection, sql, parameters, time.perf_counter() - start, e)
+            raise
+        self.shape = metrics.record(self.connection, sql, parameters, time.perf_counter() - start)
+        return result
+
+    def executemany(self, sql, seq_of_parameters):
+        metrics = self.connection.metrics
+        if metrics is None or not metrics.enabled:  # None once the connection is closed, sqlite reports that
+            return super().executemany(sql, seq_of_parameters)
+
+        # The first parameter set is enough to explain the statement if it turns out to be slow
+        first = seq_of_parameters[0] if isinstance(seq_of_parameters, (list, tuple)) and seq_of_parameters else None
+
+        self.shape = None
+        start = time.perf_counter()
+        try:
+            result = super().executemany(sql, seq_of_parameters)
+        except sqlite3.Error as e:
+            metrics.record(self.connection, sql, first, time.perf_counter() - start, e)
+            raise
+        self.shape = metrics.record(self.connection, sql, first, time.perf_counter() - start)
+        return result
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None and self.shape is not None:
+            self.connection.metrics.record_rows(self.shape, 1)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        if self.shape is not None:
+            self.connection.metrics.record_rows(self.shape, len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        if self.shape is not None:
+            self.connection.metrics.record_rows(self.shape, len(rows))
+        return rows
+
+    def __next__(self):
+        row = super().__next__()
+        if self.shape is not None:
+            self.connection.metrics.record_rows(self.shape, 1)
+        return row
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """
+    A connection whose cursors, and its execute shortcuts, report to a QueryMetrics.
+    Pass it as factory= to sqlite3.connect and set its metrics attribute.
+    """
+
+    metrics = None
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def close(self):
+        if self.metrics is not None:
+            self.metrics.connection_closed()
+            self.metrics = None
+        super().close()
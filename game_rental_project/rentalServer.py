@@ -0,0 +1,436 @@
+import argparse
+import itertools
+import json
+import logging
+import queue
+import signal
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from database import DatabaseManager
+from gameRent import GameRent
+from gameReturn import GameReturn
+from gameSearch import GameSearch
+from gameSelect import GameSelect
+from shardRouter import ShardRouter, load_shard_map
+
+# Requests that fail with anything but a bad parameter are logged here with their traceback
+SERVER_LOGGER = "gameRental.server"
+
+
+def json_value(value):
+    """
+    Converts values json cannot encode by itself, such as NumPy numbers in a DataFrame, for json.dumps(default=...).
+    """
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
+
+
+def recent_params(params):
+    """
+    Reads the optional ?window_days= and ?half_life_days= of the popularity and recommendation requests.
+
+    Returns:
+    - tuple: (window_days, half_life_days), each None if not given.
+    """
+    window_days = params.get("window_days")
+    half_life_days = params.get("half_life_days")
+    return (int(window_days) if window_days else None, float(half_life_days) if half_life_days else None)
+
+
+class WriteQueue:
+
+    def __init__(self, game_rent, game_return, max_batch=256, max_wait=0.002):
+        """
+        Initializes a queue that every rent and return goes through, written by one thread. Requests that
+        arrive close together are group-committed: written with rent_games/return_games in one transaction,
+        so many terminals share one commit (and one fsync) instead of fighting over the write lock.
+
+        Parameters:
+        - game_rent (GameRent): Used for the rentals (or a Shard, for the rentals of one shard).
+        - game_return (GameReturn): Used for the returns (or the same Shard).
+        - max_batch (int): The most requests written in one transaction.
+        - max_wait (float): How long to wait for more requests once one has arrived, in seconds.
+        """
+        self.game_rent = game_rent
+        self.game_return = game_return
+        self.db_manager = game_rent.db_manager
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batches = 0
+        self.writes = 0
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="gamerental-write-queue", daemon=True)
+        self.thread.start()
+
+    def submit(self, kind, customer_id, game_id):
+        """
+        Queues a rent or return.
+
+        Parameters:
+        - kind (str): "rent" or "return".
+        - customer_id (str): The customer.
+        - game_id (str): The game.
+
+        Returns:
+        - Future: Resolves to the same message rent_game or return_game would return.
+        """
+        future = Future()
+        self.requests.put((kind, customer_id, game_id, future))
+        return future
+
+    def run(self):
+        """
+        Takes the next batch off the queue and writes it, until close() is called.
+        """
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+
+            batch = [request]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                try:
+                    request = self.requests.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if request is None:
+                    self.requests.put(None)  # Finish this batch first
+                    break
+                batch.append(request)
+
+            self.commit(batch)
+
+    def commit(self, batch):
+        """
+        Writes a batch in one transaction and resolves its futures.
+        """
+        try:
+            # rent_games and return_games join the surrounding transaction
+            results = self.db_manager.run_atomic(lambda cursor: self.apply(batch))
+        except Exception:
+            # One bad request must not fail the whole batch, so fall back to one transaction each
+            results = []
+            for request in batch:
+                try:
+                    results.append(self.apply([request])[0])
+                except Exception as e:
+                    results.append(e)
+
+        self.batches += 1
+        self.writes += len(batch)
+
+        for (_, _, _, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def apply(self, batch):
+        """
+        Applies a batch in arrival order, each run of rents or returns with one set-based call.
+
+        Returns:
+        - list: The result message of each request.
+        """
+        results = []
+        for kind, requests in itertools.groupby(batch, key=lambda request: request[0]):
+            pairs = [(customer_id, game_id) for _, customer_id, game_id, _ in requests]
+            if kind == "rent":
+                results += self.game_rent.rent_games(pairs)
+            else:
+                results += self.game_return.return_games(pairs)
+        return results
+
+    def close(self):
+        """
+        Writes whatever is still queued and stops the writer thread.
+        """
+        self.requests.put(None)
+        self.thread.join()
+
+
+class RentalRequestHandler(BaseHTTPRequestHandler):
+    """
+    Answers one terminal's connection. HTTP/1.1, so the connection is kept open between requests.
+    """
+
+    protocol_version = "HTTP/1.1"
+    timeout = 5  # Idle connections are closed after this many seconds
+    disable_nagle_algorithm = True  # Otherwise the body waits ~40 ms for the client to acknowledge the headers
+
+    def do_GET(self):
+        self.respond(*self.server.handle_api("GET", self.path, None))
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self.respond(*self.server.handle_api("POST", self.path, self.rfile.read(length)))
+
+    def respond(self, status, payload):
+        """
+        Sends a JSON response, or a plain text one if payload is a string.
+        """
+        if isinstance(payload, str):
+            body = payload.encode()
+            content_type = "text/plain; version=0.0.4"
+        else:
+            body = json.dumps(payload, default=json_value).encode()
+            content_type = "application/json"
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Logging every request to stderr would cost more than most requests
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class RentalServer(ThreadingHTTPServer):
+
+    request_queue_size = 128  # Every terminal may reconnect at once after a restart
+
+    def __init__(self, address, db_file="GameRental.db", subscription_file=None, workers=8, max_batch=256,
+                 max_wait=0.002, verbose=False, shards=None):
+        """
+        Initializes a local HTTP/JSON server for the checkout terminals, so they share one process (and one
+        write queue) instead of each opening the database file themselves. Each kept-alive connection has a
+        lightweight thread that only parses and answers requests; the database work runs on a fixed pool of
+        worker threads, each with its own pooled connection, so a busy store cannot open unbounded connections.
+
+        Parameters:
+        - address (tuple): The (host, port) to listen on.
+        - db_file (str): The database file.
+        - subscription_file (str): The subscription file, see SubscriptionStore for the default.
+        - workers (int): The number of worker threads, i.e. requests worked on at once.
+        - max_batch (int): The most rents and returns group-committed together.
+        - max_wait (float): How long the write queue waits to fill a batch, in seconds.
+        - verbose (bool): Log every request.
+        - shards (list): Serve several database files through a ShardRouter instead of db_file, as
+          (database file, platforms) pairs (see load_shard_map).
+        """
+        super().__init__(address, RentalRequestHandler)
+        self.verbose = verbose
+        if shards:
+            # The router answers for all four classes, and each shard gets its own write queue so the
+            # shards commit independently
+            self.router = ShardRouter(shards, subscription_file)
+            self.db_manager = self.router.default_shard.db_manager
+            self.game_search = self.game_rent = self.game_return = self.game_select = self.router
+            self.write_queues = [WriteQueue(shard, shard, max_batch, max_wait) for shard in self.router.shards]
+        else:
+            self.router = None
+            self.db_manager = DatabaseManager(db_file)
+            self.game_search = GameSearch(self.db_manager, initialize=False)
+            self.game_rent = GameRent(self.db_manager, subscription_file)
+            self.game_return = GameReturn(self.db_manager)
+            self.game_select = GameSelect(self.db_manager)
+            self.write_queues = [WriteQueue(self.game_rent, self.game_return, max_batch, max_wait)]
+        self.workers = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gamerental-worker")
+
+        self.routes = {
+            ("GET", "/search"): self.search,
+            ("GET", "/also-rented"): self.also_rented,
+            ("POST", "/rent"): self.rent,
+            ("POST", "/return"): self.return_game,
+            ("GET", "/popularity/titles"): self.title_popularity,
+            ("GET", "/popularity/genres"): self.genre_popularity,
+            ("GET", "/popularity/trends"): self.trends,
+            ("GET", "/recommendations"): self.recommendations,
+            ("GET", "/history"): self.history,
+            ("POST", "/batch"): self.batch,
+            ("GET", "/metrics"): self.metrics,
+        }
+        if self.router:
+            # Who rented what together is only known within one database
+            del self.routes[("GET", "/also-rented")]
+
+    def server_close(self):
+        super().server_close()
+        self.workers.shutdown(wait=True)
+        for write_queue in self.write_queues:
+            write_queue.close()
+        if self.router:
+            self.router.close()
+
+    def handle_api(self, method, path, body):
+        """
+        Runs one request.
+
+        Parameters:
+        - method (str): "GET" or "POST".
+        - path (str): The path and query string.
+        - body (bytes): The JSON body of a POST, or None.
+
+        Returns:
+        - tuple: (HTTP status, JSON-serialisable payload or metrics text).
+        """
+        url = urlsplit(path)
+        operation = self.routes.get((method, url.path))
+        if operation is None:
+            return 404, {"error": f"No such operation: {method} {url.path}"}
+
+        try:
+            params = dict(parse_qsl(url.query))
+            if body:
+                params.update(json.loads(body))
+            # Queued writes are waited for here, so they do not hold a worker
+            return 200, self.resolve(self.workers.submit(operation, params).result())
+        except Exception as e:
+            return self.error_response(e)
+
+    def error_response(self, error):
+        """
+        Turns an exception raised by a request into its HTTP status and JSON error body.
+
+        Parameters:
+        - error (Exception): The exception.
+
+        Returns:
+        - tuple: (HTTP status, JSON-serialisable payload).
+        """
+        if isinstance(error, KeyError):
+            return 400, {"error": f"Missing parameter: {error.args[0]}"}
+        if isinstance(error, (ValueError, TypeError)):
+            return 400, {"error": str(error)}
+
+        # Anything else (e.g. a database error from a queued write) is the server's fault, not the request's,
+        # and the terminal still gets a response so its keep-alive connection stays usable
+        logging.getLogger(SERVER_LOGGER).error("Request failed", exc_info=error)
+        return 500, {"error": f"Internal error: {type(error).__name__}"}
+
+    def resolve(self, result):
+        """
+        Waits for a queued write, if the result is one.
+        """
+        if isinstance(result, Future):
+            return {"message": result.result()}
+        return result
+
+    def search(self, params):
+        games = self.game_search.find_games(params.get("title", ""), params.get("platform"), params.get("genre"),
+                                            int(params.get("limit", 50)), int(params.get("offset", 0)))
+        return [game._asdict() for game in games]
+
+    def also_rented(self, params):
+        recommendations = self.game_search.also_rented(params["title"], params.get("genre"),
+                                                       int(params.get("top_n", 5)))
+        return [recommendation._asdict() for recommendation in recommendations]
+
+    def write_queue(self, game_id):
+        """
+        Returns the write queue for a game: its shard's, or the only one.
+        """
+        if self.router:
+            return self.write_queues[self.router.shard_for_game(game_id).number]
+        return self.write_queues[0]
+
+    def rent(self, params):
+        return self.write_queue(params["game_id"]).submit("rent", params["customer_id"], params["game_id"])
+
+    def return_game(self, params):
+        return self.write_queue(params["game_id"]).submit("return", params["customer_id"], params["game_id"])
+
+    def title_popularity(self, params):
+        popularity = self.game_select.select_games_by_popularity(False, 20, *recent_params(params))
+        return popularity.head(int(params.get("top_n", 20))).to_dict("records")
+
+    def genre_popularity(self, params):
+        popularity = self.game_select.select_popular_genres(False, 20, *recent_params(params))
+        return popularity.head(int(params.get("top_n", 20))).to_dict("records")
+
+    def trends(self, params):
+        trends = self.game_select.popularity_trends(params.get("by", "title"))
+        return trends.head(int(params.get("top_n", 20))).to_dict("records")
+
+    def recommendations(self, params):
+        return self.game_select.select_games_for_purchase(float(params["budget"]),
+                                                          *recent_params(params)).to_dict("records")
+
+    def history(self, params):
+        # The key of the next page is passed back as JSON, e.g. ?after=["dated","2024-01-31",1234]
+        after = params.get("after")
+        if isinstance(after, str):
+            after = json.loads(after)
+        records, next_key = self.game_rent.rental_history_page(params.get("customer_id"), params.get("game_id"),
+                                                               params.get("start_date"), params.get("end_date"),
+                                                               int(params.get("limit", 1000)),
+                                                               tuple(after) if after else None)
+        return {"rentals": [record._asdict() for record in records], "next": next_key}
+
+    def batch(self, params):
+        """
+        Runs several requests in one round trip, e.g. a basket of rentals. Their rents and returns are all
+        queued before any is waited for, so they are committed together.
+        """
+        queued = []
+        for request in params["requests"]:
+            operation = self.routes.get((request.get("method", "GET"), request.get("path")))
+            if operation is None or operation == self.batch:
+                queued.append((404, {"error": f"No such operation: {request.get('path')}"}))
+                continue
+            try:
+                queued.append((200, operation(request.get("params", {}))))
+            except Exception as e:
+                queued.append(self.error_response(e))
+
+        results = []
+        for status, result in queued:
+            # A queued write that failed only raises here
+            try:
+                results.append({"status": status, "result": self.resolve(result)})
+            except Exception as e:
+                status, payload = self.error_response(e)
+                results.append({"status": status, "result": payload})
+
+        return results
+
+    def metrics(self, params):
+        # Each shard has its own connection pool and metrics, ?shard=n picks one (the default shard otherwise)
+        if self.router and params.get("shard") is not None:
+            number = int(params["shard"])
+            if not 0 <= number < len(self.router.shards):
+                raise ValueError(f"No such shard: {number}")
+            return self.router.shards[number].db_manager.metrics.prometheus()
+        return self.db_manager.metrics.prometheus()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve renting, returning, searching and the analytics "
+                                                 "over HTTP/JSON to the store's terminals.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--db", default="GameRental.db", help="the database file")
+    parser.add_argument("--shards", help="a shard map file (see shardRouter.py), served instead of --db")
+    parser.add_argument("--subscriptions", help="the subscription file")
+    parser.add_argument("--workers", type=int, default=8, help="requests worked on at once")
+    parser.add_argument("--max-batch", type=int, default=256, help="most rents/returns committed together")
+    parser.add_argument("--max-wait-ms", type=float, default=2.0, help="how long to wait to fill a batch")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+
+    server = RentalServer((args.host, args.port), args.db, args.subscriptions, args.workers, args.max_batch,
+                          args.max_wait_ms / 1000, args.verbose, load_shard_map(args.shards) if args.shards else None)
+    print(f"Serving {args.shards or args.db} on http://{args.host}:{server.server_address[1]}")
+
+    # Stopping as a service also writes out the queued rents and returns (shutdown() must not run on this thread)
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+import asyncio
+import functools
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from database import DatabaseManager
+from gameRent import GameRent
+from gameReturn import GameReturn
+from gameSearch import GameSearch
+from gameSelect import GameSelect
+
+# SQLite virtual machine instructions between checks for a cancelled search
+PROGRESS_STEPS = 1000
+
+
+class SearchJob:
+
+    def __init__(self):
+        """
+        Tracks one search so a newer search can cancel it, even while its query is running.
+        """
+        self.cancelled = False
+        self.future = None
+
+    def run(self, db_manager, function):
+        """
+        Runs the search on the calling reader thread, unless it was cancelled before it started.
+
+        Parameters:
+        - db_manager (DatabaseManager): The database whose pooled connection the search runs on.
+        - function (callable): The search itself.
+
+        Returns:
+        - The search results, or None if it was cancelled.
+        """
+        if self.cancelled:
+            return None
+
+        # SQLite calls this every PROGRESS_STEPS instructions and aborts the statement once it returns True,
+        # unlike interrupt() this also catches a cancel that lands between two statements
+        connection = db_manager.pool.acquire()
+        connection.set_progress_handler(lambda: self.cancelled, PROGRESS_STEPS)
+        try:
+            # In a read transaction the aborted statement raises rather than being printed and skipped
+            with db_manager.transaction():
+                return function()
+        except sqlite3.OperationalError:
+            if self.cancelled:
+                return None
+            raise
+        finally:
+            connection.set_progress_handler(None, 0)
+
+    def cancel(self):
+        """
+        Cancels the search: its awaiting coroutine gets CancelledError and its running query is aborted.
+        Must be called from the event loop thread.
+        """
+        self.cancelled = True
+        if self.future is not None:
+            self.future.cancel()
+
+
+class RentalService:
+
+    def __init__(self, db_file="GameRental.db", subscription_file=None, readers=4):
+        """
+        Initializes an asyncio front end to the rental system, so a GUI event loop never waits on the database.
+        Writes (rent, return, purchases, loading) run one at a time on a dedicated writer thread, and reads
+        (searches and analytics) on a small pool of reader threads, each with its own pooled connection.
+
+        Parameters:
+        - db_file (str): The database file.
+        - subscription_file (str): The subscription file, see SubscriptionStore for the default.
+        - readers (int): The number of reader threads.
+        """
+        self.db_manager = DatabaseManager(db_file)
+        self.game_search = GameSearch(self.db_manager, initialize=False)
+        self.game_rent = GameRent(self.db_manager, subscription_file)
+        self.game_return = GameReturn(self.db_manager)
+        self.game_select = GameSelect(self.db_manager)
+
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gamerental-writer")
+        self.readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="gamerental-reader")
+        self.search_job = None
+
+    async def read(self, function, *args, **kwargs):
+        """
+        Runs a read-only call on a reader thread.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.readers, functools.partial(function, *args, **kwargs))
+
+    async def write(self, function, *args, **kwargs):
+        """
+        Runs a call that changes the database on the writer thread, after any writes queued before it.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.writer, functools.partial(function, *args, **kwargs))
+
+    async def search(self, title, platform=None, genre=None, limit=50, offset=0):
+        """
+        Searches for games by title. Starting a new search cancels the previous one if it is still running,
+        so type-ahead searches never queue up behind each other.
+
+        Parameters:
+        - title (str): The title (or part of it) to search for.
+        - platform (str): Only return games on this platform.
+        - genre (str): Only return games in this genre.
+        - limit (int): The maximum number of games to return, or None for all of them.
+        - offset (int): The number of matching games to skip.
+
+        Returns:
+        - list: GameRecord tuples, most relevant first. Raises asyncio.CancelledError if a newer search replaced it.
+        """
+        job = SearchJob()
+        previous, self.search_job = self.search_job, job
+        if previous is not None:
+            previous.cancel()
+
+        search = functools.partial(self.game_search.find_games, title, platform, genre, limit, offset)
+        job.future = asyncio.get_running_loop().run_in_executor(self.readers, job.run, self.db_manager, search)
+
+        try:
+            results = await job.future
+        except asyncio.CancelledError:
+            job.cancel()
+            raise
+        finally:
+            if self.search_job is job:
+                self.search_job = None
+
+        if job.cancelled:
+            raise asyncio.CancelledError()
+        return results
+
+    async def rent(self, customer_id, game_id):
+        """
+        Rents a game to a customer.
+
+        Returns:
+        - str: The message from GameRent.rent_game.
+        """
+        return await self.write(self.game_rent.rent_game, customer_id, game_id)
+
+    async def return_game(self, customer_id, game_id):
+        """
+        Returns a rented game.
+
+        Returns:
+        - str: The message from GameReturn.return_game.
+        """
+        return await self.write(self.game_return.return_game, customer_id, game_id)
+
+    async def add_purchase(self, title, genre, platform, copies, purchase_price):
+        """
+        Adds purchased copies of a game.
+
+        Returns:
+        - str: The message from GameSelect.add_purchased_games.
+        """
+        return await self.write(self.game_select.add_purchased_games, title, genre, platform, copies, purchase_price)
+
+    async def initialize(self, games_info_file="Game_Info.txt", rental_history_file="Rental_History.txt"):
+        """
+        Loads the games and rental history files into the database. Malformed lines are listed in the
+        quarantine files next to them without printing anything.
+
+        Returns:
+        - dict: The ingest mode used for each table.
+        """
+        return await self.write(self.db_manager.initialize_databases, games_info_file, rental_history_file,
+                                report=False)
+
+    async def popularity(self, kind="titles", top_n=20, chart=True, window_days=None, half_life_days=None):
+        """
+        Fetches title or genre popularity, and renders its chart off the event loop.
+
+        Parameters:
+        - kind (str): "titles" or "genres".
+        - top_n (int): The number of bars in the chart.
+        - chart (bool): Also render the chart.
+        - window_days (int): Only count rentals from the last this many days.
+        - half_life_days (float): Weigh rentals down by age, halving every this many days.
+
+        Returns:
+        - tuple: (DataFrame, PNG bytes or None).
+        """
+        if kind not in ("titles", "genres"):
+            raise ValueError(f"Unknown popularity kind: {kind}")
+
+        def fetch():
+            recent = window_days or half_life_days
+            if kind == "titles":
+                data = self.game_select.select_games_by_popularity(False, top_n, window_days, half_life_days)
+                label, title, render = "Title", "Most popular games", self.game_select.render_popularity_chart
+            else:
+                data = self.game_select.select_popular_genres(False, top_n, window_days, half_life_days)
+                label, title, render = "Genre", "Genre Popularity", self.game_select.render_genre_chart
+
+            if not chart or data.empty:
+                return data, None
+            if not recent:
+                return data, render(top_n, data)
+            # Windowed charts are not cached, the cache only knows when the data changed, not which window it shows
+            top = data.head(top_n)
+            return data, self.game_select.render_bar_chart(top[label], top["Popularity"], label,
+                                                           self.game_select.recent_title(title, window_days,
+                                                                                         half_life_days))
+
+        return await self.read(fetch)
+
+    async def purchase_recommendations(self, budget, window_days=None, half_life_days=None):
+        """
+        Recommends how many copies of each game to buy with a budget, by all-time or recent popularity.
+
+        Returns:
+        - DataFrame: See GameSelect.select_games_for_purchase.
+        """
+        return await self.read(self.game_select.select_games_for_purchase, budget, window_days, half_life_days)
+
+    async def popularity_trends(self, by="title", windows=(7, 30, 90), half_life_days=30):
+        """
+        Fetches rolling, decayed and week-over-week popularity of every title or genre.
+
+        Returns:
+        - DataFrame: See GameSelect.popularity_trends.
+        """
+        return await self.read(self.game_select.popularity_trends, by, windows, half_life_days)
+
+    async def also_rented(self, title, genre=None, top_n=5):
+        """
+        Fetches what customers who rented a title also rented.
+
+        Returns:
+        - list: See GameSearch.also_rented.
+        """
+        return await self.read(self.game_search.also_rented, title, genre, top_n)
+
+    async def rental_history(self, customer_id=None, game_id=None, start_date=None, end_date=None, limit=1000):
+        """
+        Fetches the rental history, oldest first, at most limit rentals.
+
+        Returns:
+        - DataFrame: See GameRent.view_rental_history.
+        """
+        return await self.read(self.game_rent.view_rental_history, customer_id, game_id, start_date, end_date, limit)
+
+    def close(self):
+        """
+        Waits for queued work to finish and stops the writer and reader threads.
+        """
+        if self.search_job is not None:
+            self.search_job.cancel()
+        self.writer.shutdown(wait=True)
+        self.readers.shutdown(wait=True)
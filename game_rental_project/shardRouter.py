@@ -0,0 +1,460 @@
+import heapq
+import itertools
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from database import DatabaseManager, normalize_id
+from gameRent import GameRent
+from gameReturn import GameReturn
+from gameSearch import GameSearch
+from gameSelect import GameSelect
+
+# Shard n numbers its copies from n * SHARD_ID_SPAN + 1, so game IDs stay unique across the shards and the ID
+# alone says which shard owns a copy. Shard 0 keeps the IDs of a database that was not sharded before.
+SHARD_ID_SPAN = 10 ** 9
+
+
+def load_shard_map(file_name):
+    """
+    Reads a shard map file: a JSON list of [database file, platforms] pairs, e.g.
+    [["GameRental.db", null], ["GameRental_xbox.db", ["xbox", "xbox_360"]]]. A shard's position in the list
+    decides its range of game IDs, so the default shard (platforms null) must come first and new shards must only
+    ever be added at the end.
+
+    Parameters:
+    - file_name (str): The shard map file.
+
+    Returns:
+    - list: (database file, list of platforms or None) tuples.
+    """
+    with open(file_name) as f:
+        return [(db_file, platforms) for db_file, platforms in json.load(f)]
+
+
+class Shard:
+
+    def __init__(self, router, number, db_file, platforms, subscription_file=None):
+        """
+        Initializes one shard: a database file with its own connection pool, write lock and active rental
+        index, and the classes that work on it.
+
+        Parameters:
+        - router (ShardRouter): The router the shard belongs to.
+        - number (int): The shard's position in the shard map, which decides its range of game IDs.
+        - db_file (str): The database file.
+        - platforms (list): The platforms whose copies are bought into this shard, or None for every platform
+          no other shard takes.
+        - subscription_file (str): The subscription file, see SubscriptionStore for the default.
+        """
+        self.router = router
+        self.number = number
+        self.platforms = platforms
+        self.game_ids = range(number * SHARD_ID_SPAN + 1, (number + 1) * SHARD_ID_SPAN + 1)
+        self.db_manager = DatabaseManager(db_file, self.game_ids)
+        self.db_manager.create_tables()
+        self.game_search = GameSearch(self.db_manager, initialize=False)
+        self.game_rent = GameRent(self.db_manager, subscription_file)
+        self.game_return = GameReturn(self.db_manager)
+        self.game_select = GameSelect(self.db_manager)
+        self.in_flight = {}  # Rentals being written to this shard, by customer (see ShardRouter.rent_on_shard)
+
+    def rent_games(self, pairs):
+        """
+        Rents games owned by this shard, counting the customers' rentals in the other shards towards their limits.
+        """
+        return self.router.rent_on_shard(self, pairs)
+
+    def return_games(self, pairs):
+        """
+        Returns games owned by this shard.
+        """
+        return self.game_return.return_games(pairs)
+
+
+class ShardRouter:
+
+    def __init__(self, shards=(("GameRental.db", None),), subscription_file=None, workers=4):
+        """
+        Initializes a router over several database files (shards), each holding the games of some platforms
+        (or stores) with their rentals. Every shard has its own write lock, so rents, returns and purchases
+        at different shards never wait for each other. Purchases go to the shard of the game's platform, rents
+        and returns to the shard that owns the game ID, and searches, popularity and history are asked of
+        every shard at once on a thread pool and merged into the same results one database would give.
+
+        It has the search, rent, return and analytics methods of GameSearch, GameRent, GameReturn and
+        GameSelect (those the server uses), so it can stand in for them.
+
+        Parameters:
+        - shards (list): (database file, platforms) pairs, see load_shard_map. Exactly one shard must have
+          platforms None, and it must be the first: it takes every platform the others do not name, and owns
+          IDs 1 to SHARD_ID_SPAN, so it keeps the games of a database that was not sharded before.
+        - subscription_file (str): The subscription file, see SubscriptionStore for the default.
+        - workers (int): The number of threads the shards are queried on.
+        """
+        self.shards = [Shard(self, number, db_file, platforms, subscription_file)
+                       for number, (db_file, platforms) in enumerate(shards)]
+
+        defaults = [shard for shard in self.shards if shard.platforms is None]
+        if len(defaults) != 1:
+            raise ValueError("Exactly one shard must take the platforms no other shard names (platforms None)")
+        # Game IDs from before sharding fall in shard 0's range, so rents and returns of them go to shard 0
+        if defaults[0].number != 0:
+            raise ValueError("The shard with platforms None must be the first in the shard map")
+        self.default_shard = defaults[0]
+
+        self.platform_shards = {}
+        for shard in self.shards:
+            for platform in shard.platforms or ():
+                platform = shard.game_select.clean_name(platform)
+                if platform in self.platform_shards:
+                    raise ValueError(f"Platform {platform} is in more than one shard")
+                self.platform_shards[platform] = shard
+
+        self.workers = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gamerental-shard")
+        self.limit_lock = threading.Lock()  # Guards every shard's in_flight
+
+    def close(self):
+        """
+        Stops the shard query threads.
+        """
+        self.workers.shutdown(wait=True)
+
+    def shard_for_game(self, game_id):
+        """
+        Returns the shard that owns a game ID. IDs outside every shard's range go to the default shard,
+        which answers for them as for any game it does not have.
+        """
+        game_id = normalize_id(game_id)
+        if isinstance(game_id, int) and game_id > 0 and (game_id - 1) // SHARD_ID_SPAN < len(self.shards):
+            return self.shards[(game_id - 1) // SHARD_ID_SPAN]
+        return self.default_shard
+
+    def shard_for_platform(self, platform):
+        """
+        Returns the shard that new copies of a platform are bought into.
+        """
+        return self.platform_shards.get(self.default_shard.game_select.clean_name(platform), self.default_shard)
+
+    def shards_for_platform(self, platform):
+        """
+        Returns the shards that can hold copies of a platform: its own and the default shard, which keeps
+        whatever was bought before the platform got a shard. Every shard if platform is None.
+        """
+        if platform is None:
+            return self.shards
+        shard = self.shard_for_platform(platform)
+        return [shard] if shard is self.default_shard else sorted({shard, self.default_shard},
+                                                                  key=lambda shard: shard.number)
+
+    def fan_out(self, function, shards=None):
+        """
+        Calls function(shard) for each shard at once, on the router's threads.
+
+        Returns:
+        - list: The result for each shard, in shard order.
+        """
+        shards = self.shards if shards is None else shards
+        if len(shards) == 1:
+            return [function(shards[0])]
+        return list(self.workers.map(function, shards))
+
+    def route_writes(self, pairs, write):
+        """
+        Splits (customer_id, game_id) pairs by the shard owning each game and writes each shard's part at once.
+
+        Parameters:
+        - pairs (list): (customer_id, game_id) tuples.
+        - write (callable): write(shard, pairs of that shard) returning a result per pair.
+
+        Returns:
+        - list: The result of each pair, in the same order as pairs.
+        """
+        groups = {}
+        for position, (_, game_id) in enumerate(pairs):
+            groups.setdefault(self.shard_for_game(game_id), []).append(position)
+
+        shards = list(groups)
+        outcomes = self.fan_out(lambda shard: write(shard, [pairs[position] for position in groups[shard]]), shards)
+
+        results = [None] * len(pairs)
+        for shard, shard_results in zip(shards, outcomes):
+            for position, result in zip(groups[shard], shard_results):
+                results[position] = result
+        return results
+
+    def rent_on_shard(self, shard, pairs):
+        """
+        Rents games on one shard. A customer's limit covers their rentals at every shard, so the rentals the
+        customers have out at the other shards, and those being given to them right now anywhere, are counted in.
+
+        Each rental is registered in its shard's in_flight before anything is counted, and only leaves it once
+        its transaction has committed (so it is in its shard's active rental index), and the counting reads
+        in_flight before the indexes. So a rental always counts every rental for the same customer that was
+        registered before it, and a limit cannot be overrun (at the limit, rentals for the same customer at the
+        same moment may all be turned away). This holds within one process, e.g. one server in front of every shard.
+
+        Parameters:
+        - shard (Shard): The shard owning every game in pairs.
+        - pairs (list): (customer_id, game_id) tuples.
+
+        Returns:
+        - list: The result message of each rental, the same messages as GameRent.rent_games.
+        """
+        customer_ids = [normalize_id(customer_id) for customer_id, _ in pairs]
+
+        with self.limit_lock:
+            for customer_id in customer_ids:
+                shard.in_flight[customer_id] = shard.in_flight.get(customer_id, 0) + 1
+
+        def release():
+            with self.limit_lock:
+                for customer_id in customer_ids:
+                    left = shard.in_flight[customer_id] - 1
+                    if left:
+                        shard.in_flight[customer_id] = left
+                    else:
+                        del shard.in_flight[customer_id]
+
+        try:
+            # Less this call's own, which rent_games counts as it goes
+            rented_elsewhere = {}
+            for customer_id in customer_ids:
+                rented_elsewhere[customer_id] = rented_elsewhere.get(customer_id, 0) - 1
+            with self.limit_lock:
+                for other in self.shards:
+                    for customer_id in rented_elsewhere:
+                        rented_elsewhere[customer_id] += other.in_flight.get(customer_id, 0)
+            for other in self.shards:
+                if other is not shard:
+                    for customer_id in rented_elsewhere:
+                        rented_elsewhere[customer_id] += other.game_rent.active_rentals.active_rental_count(customer_id)
+
+            return shard.game_rent.rent_games(pairs, rented_elsewhere)
+        finally:
+            # Inside a write queue's transaction that is only once the whole batch has committed
+            shard.db_manager.after_transaction(release)
+
+    def rent_game(self, customer_id, game_id):
+        """
+        Rents a game on the shard that owns it, see GameRent.rent_game.
+        """
+        return self.shard_for_game(game_id).rent_games([(customer_id, game_id)])[0]
+
+    def rent_games(self, pairs):
+        """
+        Rents many games, each shard's at once, see GameRent.rent_games.
+        """
+        return self.route_writes(pairs, lambda shard, shard_pairs: shard.rent_games(shard_pairs))
+
+    def return_game(self, customer_id, game_id):
+        """
+        Returns a game to the shard that owns it, see GameReturn.return_game.
+        """
+        return self.shard_for_game(game_id).game_return.return_game(customer_id, game_id)
+
+    def return_games(self, pairs):
+        """
+        Returns many games, each shard's at once, see GameReturn.return_games.
+        """
+        return self.route_writes(pairs, lambda shard, shard_pairs: shard.return_games(shard_pairs))
+
+    def add_purchased_games(self, title, genre, platform, copies, purchase_price):
+        """
+        Adds purchased copies to the shard of their platform, see GameSelect.add_purchased_games.
+        """
+        return self.shard_for_platform(platform).game_select.add_purchased_games(title, genre, platform, copies,
+                                                                                 purchase_price)
+
+    def add_purchase_order(self, order, purchase_date=None):
+        """
+        Adds a purchase order, each shard's lines in one transaction on that shard (see
+        GameSelect.add_purchase_order). The shards are written at once and independently, so if one fails
+        the lines of the others are still added.
+
+        Returns:
+        - list or None: The (first ID, last ID) range of each line, or None if any shard failed.
+        """
+        order = list(order)
+        groups = {}
+        for position, line in enumerate(order):
+            groups.setdefault(self.shard_for_platform(line[2]), []).append(position)
+
+        shards = list(groups)
+        outcomes = self.fan_out(lambda shard: shard.game_select.add_purchase_order(
+            [order[position] for position in groups[shard]], purchase_date), shards)
+        if any(outcome is None for outcome in outcomes):
+            return None
+
+        ranges = [None] * len(order)
+        for shard, shard_ranges in zip(shards, outcomes):
+            for position, line_range in zip(groups[shard], shard_ranges):
+                ranges[position] = line_range
+        return ranges
+
+    def find_games(self, title, platform=None, genre=None, limit=None, offset=0):
+        """
+        Searches every shard that can hold the platform and merges their results by relevance (then ID),
+        see GameSearch.find_games. Misspelt words are only corrected if no shard had a match. Relevance
+        is each shard's FTS5 rank, which weighs words by how rare they are in that shard.
+
+        Returns:
+        - list: GameRecord tuples, most relevant first.
+        """
+        shards = self.shards_for_platform(platform)
+        count = None if limit is None else offset + limit
+
+        results = self.fan_out(lambda shard: shard.game_search.find_ranked_games(title, platform, genre, count),
+                               shards)
+        # Every shard's results start at the first match, so none means the title matches nothing on any page
+        if not any(results):
+            results = self.fan_out(lambda shard: shard.game_search.find_ranked_games(title, platform, genre, count,
+                                                                                     corrected=True), shards)
+
+        merged = heapq.merge(*results, key=lambda result: (result[0], result[1].id))
+        return [record for _, record in itertools.islice(merged, offset, count)]
+
+    def select_games_by_popularity(self, show_plot=True, top_n=20, window_days=None, half_life_days=None,
+                                   as_of=None):
+        """
+        Title popularity across every shard, see GameSelect.select_games_by_popularity.
+        """
+        popularity_df = self.merge_popularity(self.fan_out(
+            lambda shard: shard.game_select.select_games_by_popularity(False, top_n, window_days, half_life_days,
+                                                                       as_of)), ["Title", "Genre"])
+        self.show_popularity_chart(show_plot, top_n, popularity_df, "Title", "Most popular games",
+                                   window_days, half_life_days)
+        return popularity_df
+
+    def select_popular_genres(self, show_plot=True, top_n=20, window_days=None, half_life_days=None, as_of=None):
+        """
+        Genre popularity across every shard, see GameSelect.select_popular_genres.
+        """
+        popular_genres_df = self.merge_popularity(self.fan_out(
+            lambda shard: shard.game_select.select_popular_genres(False, top_n, window_days, half_life_days,
+                                                                  as_of)), ["Genre"])
+        self.show_popularity_chart(show_plot, top_n, popular_genres_df, "Genre", "Genre Popularity",
+                                   window_days, half_life_days)
+        return popular_genres_df
+
+    def merge_popularity(self, frames, keys):
+        """
+        Merges the popularity of each shard. The same title is usually stocked at several shards, so the
+        overall top titles cannot be found from each shard's top few alone. Every shard's popularity has one
+        row per title (or genre), so they are added up in full and ranked by the totals.
+
+        Parameters:
+        - frames (list): Each shard's DataFrame with the keys and "Popularity".
+        - keys (list): The columns identifying a row, e.g. ["Title", "Genre"].
+
+        Returns:
+        - DataFrame: The keys and the total "Popularity", most popular first.
+        """
+        import pandas as pd
+
+        totals = pd.concat(frames, ignore_index=True).groupby(keys, sort=False, dropna=False)["Popularity"].sum()
+        return totals.sort_values(ascending=False, kind="stable").reset_index()
+
+    def show_popularity_chart(self, show_plot, top_n, data, label, title, window_days, half_life_days):
+        """
+        Shows a bar chart of the most popular rows, if asked for.
+        """
+        if not show_plot or data.empty:
+            return
+        game_select = self.default_shard.game_select
+        top = data.head(top_n)
+        game_select.show_chart(game_select.render_bar_chart(top[label], top["Popularity"], label,
+                                                            game_select.recent_title(title, window_days,
+                                                                                     half_life_days)))
+
+    def popularity_trends(self, by="title", windows=(7, 30, 90), half_life_days=30, as_of=None):
+        """
+        Rolling, decayed and week-over-week popularity across every shard, see GameSelect.popularity_trends.
+        """
+        import pandas as pd
+
+        frames = self.fan_out(lambda shard: shard.game_select.popularity_trends(by, windows, half_life_days, as_of))
+        keys = ["Title", "Genre"] if by == "title" else ["Genre"]
+
+        trends = pd.concat(frames, ignore_index=True).groupby(keys, sort=False, dropna=False).sum().reset_index()
+        trends["WeekOverWeek"] = trends["ThisWeek"] - trends["LastWeek"]
+        return trends.sort_values("Decayed", ascending=False, kind="stable").reset_index(drop=True)
+
+    def select_games_for_purchase(self, budget, window_days=None, half_life_days=None, as_of=None):
+        """
+        Recommends how many copies of each game to buy from the popularity and average price across every
+        shard, see GameSelect.select_games_for_purchase.
+        """
+        import numpy as np
+        import pandas as pd
+
+        columns = ["Title", "Genre", "PurchasePrice", "CopiesToBuy"]
+        popularity = self.select_games_by_popularity(False, 20, window_days, half_life_days, as_of)
+        total_rentals = popularity["Popularity"].sum() if not popularity.empty else 0
+        if total_rentals <= 0:
+            return pd.DataFrame(columns=columns)
+
+        prices = pd.concat(self.fan_out(lambda shard: shard.game_select.title_prices()), ignore_index=True)
+        prices = prices.groupby(["Title", "Genre"], dropna=False)[["PriceSum", "Priced"]].sum()
+        popularity = popularity.join(prices, on=["Title", "Genre"])
+
+        price_sums = np.nan_to_num(popularity["PriceSum"].to_numpy(dtype=np.float64))
+        priced = np.nan_to_num(popularity["Priced"].to_numpy(dtype=np.float64))
+        average = np.divide(price_sums, priced, out=np.zeros(len(priced)), where=priced > 0)
+
+        copies = np.zeros(len(average), dtype=np.int64)
+        has_price = average > 0
+        shares = popularity["Popularity"].to_numpy(dtype=np.float64) / total_rentals * float(budget)
+        copies[has_price] = np.floor(shares[has_price] / average[has_price]).astype(np.int64)
+
+        return pd.DataFrame({"Title": popularity["Title"], "Genre": popularity["Genre"], "PurchasePrice": average,
+                             "CopiesToBuy": copies})
+
+    def rental_history_page(self, customer_id=None, game_id=None, start_date=None, end_date=None, limit=1000,
+                            after=None):
+        """
+        Fetches one page of the rental history of every shard, see GameRent.rental_history_page. Each shard's
+        next page is fetched at once and they are merged by rental date (undated rentals first), ties in
+        shard order. The key of the next page holds each shard's own key ("end" once it has no more).
+
+        Returns:
+        - tuple: (list of RentalRecord, key of the next page or None if this was the last page).
+        """
+        if after is not None:
+            keys = list(after)
+        elif game_id is not None:
+            owner = self.shard_for_game(game_id)
+            keys = [None if shard is owner else "end" for shard in self.shards]
+        else:
+            keys = [None] * len(self.shards)
+
+        def page(shard, size):
+            key = keys[shard.number]
+            return shard.game_rent.rental_history_page(customer_id, game_id, start_date, end_date, size,
+                                                       tuple(key) if key is not None else None)
+
+        shards = [shard for shard in self.shards if keys[shard.number] != "end"]
+        pages = self.fan_out(lambda shard: page(shard, limit), shards)
+
+        streams = [[(shard.number, record) for record in records] for shard, (records, _) in zip(shards, pages)]
+        merged = list(itertools.islice(heapq.merge(*streams, key=lambda item: (item[1].rental_date is not None,
+                                                                              item[1].rental_date or "",
+                                                                              item[0])), limit))
+
+        taken = {}
+        for number, _ in merged:
+            taken[number] = taken.get(number, 0) + 1
+
+        next_keys = list(keys)
+        for shard, (records, next_key) in zip(shards, pages):
+            count = taken.get(shard.number, 0)
+            if count == len(records):
+                next_keys[shard.number] = next_key if next_key is not None else "end"
+            elif count > 0:
+                # Part of the shard's page was used: the key after exactly that many of its rentals
+                next_keys[shard.number] = page(shard, count)[1]
+
+        records = [record for _, record in merged]
+        if all(key == "end" for key in next_keys):
+            return records, None
+        return records, next_keys
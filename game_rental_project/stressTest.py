@@ -0,0 +1,160 @@
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import time
+
+from database import DatabaseManager
+from gameRent import GameRent
+from gameReturn import GameReturn
+from syntheticCatalog import build_catalog
+
+
+def write_subscriptions(file_name, customers):
+    """
+    Writes a subscription file where every customer is active, alternating Basic and Premium.
+    """
+    with open(file_name, "w") as file:
+        file.write("CustomerID,SubscriptionType,StartDate,EndDate\n")
+        for customer_id in range(1, customers + 1):
+            subscription_type = "Basic" if customer_id % 2 else "Premium"
+            file.write(f"{customer_id},{subscription_type},2000-01-01,2999-12-31\n")
+
+
+def run_terminal(db_file, subscription_file, customers, games, attempts, seed):
+    """
+    Acts like one checkout terminal: rents random copies to random customers and sometimes returns them.
+
+    Returns:
+    - tuple: (successful rentals, successful returns, seconds spent).
+    """
+    rng = random.Random(seed)
+    db_manager = DatabaseManager(db_file)
+    game_rent = GameRent(db_manager, subscription_file)
+    game_return = GameReturn(db_manager)
+
+    rented = []
+    rentals = returns = 0
+    start = time.perf_counter()
+
+    for _ in range(attempts):
+        if rented and rng.random() < 0.3:
+            customer_id, game_id = rented.pop(rng.randrange(len(rented)))
+            if game_return.return_game(customer_id, game_id) == "Game returned successfully.":
+                returns += 1
+        else:
+            customer_id, game_id = rng.randint(1, customers), rng.randint(1, games)
+            if game_rent.rent_game(customer_id, game_id) == "Game rented successfully.":
+                rentals += 1
+                rented.append((customer_id, game_id))
+
+    return rentals, returns, time.perf_counter() - start
+
+
+def check_invariants(db_manager, game_rent):
+    """
+    Checks that no copy is rented twice at once and that no customer is over their rental limit.
+
+    Returns:
+    - list: A description of each violation found (empty if there are none).
+    """
+    problems = []
+
+    for game_id, count in db_manager.execute(
+            "SELECT ID, COUNT(*) FROM Rental WHERE RETURNDATE IS NULL GROUP BY ID HAVING COUNT(*) > 1"):
+        problems.append(f"game {game_id} is rented {count} times")
+
+    for customer_id, count in db_manager.execute(
+            "SELECT CUSTOMERID, COUNT(*) FROM Rental WHERE RETURNDATE IS NULL GROUP BY CUSTOMERID"):
+        limit = game_rent.subscriptions.get_rental_limit(customer_id)
+        if limit is None or count > limit:
+            problems.append(f"customer {customer_id} has {count} games rented (limit {limit})")
+
+    return problems
+
+
+def run_stress(directory, terminals, attempts, customers, games, processes=False):
+    """
+    Builds a catalog in directory and rents and returns from many terminals against it at once.
+
+    Parameters:
+    - directory (str): Where the database and subscription file are made.
+    - terminals (int): The number of concurrent terminals.
+    - attempts (int): The operations per terminal.
+    - customers (int): The number of customers, all subscribed.
+    - games (int): The number of copies in the catalog (fewer means more contention).
+    - processes (bool): Run the terminals as processes instead of threads.
+
+    Returns:
+    - tuple: (list of (rentals, returns, seconds) per terminal, wall time in seconds, list of invariant violations).
+    """
+    db_file = os.path.join(directory, "stress.db")
+    subscription_file = os.path.join(directory, "Subscription_Info.txt")
+    write_subscriptions(subscription_file, customers)
+
+    db_manager = DatabaseManager(db_file)
+    build_catalog(db_manager, games, copies_per_title=5)
+    game_rent = GameRent(db_manager, subscription_file)
+    game_rent.subscriptions.refresh()
+
+    jobs = [(db_file, subscription_file, customers, games, attempts, seed) for seed in range(terminals)]
+
+    start = time.perf_counter()
+    if processes:
+        with multiprocessing.get_context("spawn").Pool(terminals) as pool:
+            totals = pool.starmap(run_terminal, jobs)
+    else:
+        totals = [None] * terminals
+
+        def worker(index):
+            totals[index] = run_terminal(*jobs[index])
+
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(terminals)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    wall_time = time.perf_counter() - start
+
+    problems = check_invariants(db_manager, game_rent)
+    db_manager.pool.close_all()
+
+    return totals, wall_time, problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rent and return concurrently from many terminals against one database.")
+    parser.add_argument("--terminals", type=int, default=8, help="number of concurrent terminals")
+    parser.add_argument("--processes", action="store_true", help="run terminals as processes instead of threads")
+    parser.add_argument("--attempts", type=int, default=2000, help="operations per terminal")
+    parser.add_argument("--customers", type=int, default=50)
+    parser.add_argument("--games", type=int, default=100, help="copies in the catalog (fewer means more contention)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        totals, wall_time, problems = run_stress(directory, args.terminals, args.attempts, args.customers,
+                                                 args.games, args.processes)
+
+    # Throughput is measured over the slowest terminal, so process start-up is not counted
+    elapsed = max(total[2] for total in totals)
+    rentals = sum(total[0] for total in totals)
+    returns = sum(total[1] for total in totals)
+    operations = args.terminals * args.attempts
+    mode = "processes" if args.processes else "threads"
+
+    print(f"{args.terminals} {mode}: {operations} operations in {elapsed:.2f}s ({operations / elapsed:.0f} ops/s, "
+          f"{wall_time:.2f}s wall time)")
+    print(f"{rentals} rentals and {returns} returns succeeded")
+
+    for problem in problems:
+        print("VIOLATION:", problem)
+
+    if problems:
+        raise SystemExit(1)
+    print("No double rentals and no customer over their limit.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import os
+from datetime import datetime
+
+import subscriptionManager
+from database import DatabaseManager
+
+
+class SubscriptionStore:
+
+    def __init__(self, db_manager=None, subscription_file=None):
+        """
+        Initializes the SubscriptionStore, which imports the subscription file into the Subscriptions table
+        and answers lookups from an in-memory copy that is only refreshed when the file changes.
+
+        Parameters:
+        - db_manager (DatabaseManager): The database holding the Subscriptions table.
+        - subscription_file (str): The subscription file. Defaults to the SUBSCRIPTION_FILE environment
+          variable, or Subscription_Info.txt in the working directory.
+        """
+        self.db_manager = db_manager or DatabaseManager()
+        self.subscription_file = subscription_file or os.environ.get("SUBSCRIPTION_FILE", "Subscription_Info.txt")
+        self.file_signature = None
+        self.cache = None
+
+    def parse_subscription_line(self, line):
+        """
+        Splits and checks one line of the subscription file.
+
+        Parameters:
+        - line (str): A line from the subscription file.
+
+        Returns:
+        - tuple or None: (CUSTOMERID, SUBSCRIPTIONTYPE, STARTDATE, ENDDATE) or None if the line is malformed.
+        """
+        fields = [field.strip() for field in line.split(",")]
+
+        if len(fields) != 4 or not fields[0]:
+            return None
+
+        customer_id, subscription_type, start_date, end_date = fields
+
+        try:
+            datetime.strptime(start_date, "%Y-%m-%d")
+            datetime.strptime(end_date, "%Y-%m-%d")
+        except ValueError:
+            return None
+
+        return (customer_id, subscription_type, start_date, end_date)
+
+    def refresh(self):
+        """
+        Re-imports the subscription file and reloads the cache if the file has changed since it was last read.
+        If the file does not exist, the subscriptions already in the database are used.
+
+        Returns:
+        - dict: Subscriptions keyed by customer ID, in the format used by subscriptionManager.
+        """
+        try:
+            stat = os.stat(self.subscription_file)
+            signature = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            signature = None
+
+        if self.cache is not None and signature == self.file_signature:
+            return self.cache
+
+        self.db_manager.create_tables()
+
+        if signature is not None:
+            self.db_manager.ingest_file("Subscriptions", self.subscription_file, '''
+                INSERT OR REPLACE INTO Subscriptions (CUSTOMERID, SUBSCRIPTIONTYPE, STARTDATE, ENDDATE)
+                VALUES (?, ?, ?, ?)
+            ''', self.parse_subscription_line)
+
+        rows = self.db_manager.execute("SELECT CUSTOMERID, SUBSCRIPTIONTYPE, STARTDATE, ENDDATE FROM Subscriptions") or []
+
+        self.cache = {
+            customer_id: {
+                "SubscriptionType": subscription_type,
+                "StartDate": datetime.strptime(start_date, "%Y-%m-%d"),
+                "EndDate": datetime.strptime(end_date, "%Y-%m-%d"),
+            }
+            for customer_id, subscription_type, start_date, end_date in rows
+        }
+        self.file_signature = signature
+
+        return self.cache
+
+    def check_subscription(self, customer_id):
+        """
+        Checks if a customer's subscription is active today.
+
+        Parameters:
+        - customer_id (str): The ID of the customer.
+
+        Returns:
+        - bool: True if the customer has an active subscription, False otherwise.
+        """
+        return subscriptionManager.check_subscription(str(customer_id).strip(), self.refresh())
+
+    def get_rental_limit(self, customer_id):
+        """
+        Returns how many games a customer may have rented at once.
+
+        Parameters:
+        - customer_id (str): The ID of the customer.
+
+        Returns:
+        - int or None: The rental limit of the customer's subscription type, or None if they have no subscription.
+        """
+        subscription = self.refresh().get(str(customer_id).strip())
+
+        if subscription is None:
+            return None
+
+        return subscriptionManager.get_rental_limit(subscription["SubscriptionType"])
+
+    def active_rental_limits(self, customer_ids):
+        """
+        Looks up many customers at once, refreshing the cache only once for the whole batch.
+
+        Parameters:
+        - customer_ids (iterable): The IDs of the customers.
+
+        Returns:
+        - dict: The rental limit of each customer with an active subscription, keyed by the ID as given.
+        """
+        subscriptions = self.refresh()
+        limits = {}
+
+        for customer_id in customer_ids:
+            key = str(customer_id).strip()
+            if subscriptionManager.check_subscription(key, subscriptions):
+                limits[customer_id] = subscriptionManager.get_rental_limit(subscriptions[key]["SubscriptionType"])
+
+        return limits
@@ -0,0 +1,46 @@
+import random
+
+# Made-up catalogs for the benchmarks and the stress test
+
+SYLLABLES = ["ka", "zo", "mi", "ra", "tor", "vel", "shi", "dan", "lo", "gar", "ne", "fu", "ji", "rex", "sto",
+             "ma", "qu", "bel", "or", "in", "ta", "ri", "cro", "pha", "dus", "len", "ux", "wy", "ae", "hol"]
+
+
+def make_words(rng, count):
+    """
+    Makes pronounceable pseudo-words so word frequencies look like a real catalog rather than a tiny fixed list.
+    """
+    words = set()
+    while len(words) < count:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))))
+    return sorted(words)
+
+
+def build_catalog(db_manager, rows, copies_per_title=50, seed=1):
+    """
+    Fills the Games table with a synthetic catalog.
+
+    Parameters:
+    - db_manager (DatabaseManager): The database to fill.
+    - rows (int): The number of game copies to insert.
+    - copies_per_title (int): How many copies share each title.
+    - seed (int): The random seed, so runs are comparable.
+
+    Returns:
+    - list: The distinct titles that were generated.
+    """
+    rng = random.Random(seed)
+    words = make_words(rng, 5000)
+    titles = ["_".join(rng.sample(words, rng.randint(2, 4))) for _ in range(max(rows // copies_per_title, 1))]
+
+    platforms = ["xbox", "playstation", "nintendo_switch", "pc"]
+    genres = ["action", "adventure", "rpg", "shooter", "sports", "simulation"]
+
+    db_manager.create_tables()
+    with db_manager.transaction() as cursor:
+        cursor.executemany(
+            "INSERT INTO Games (ID, PLATFORM, GENRE, TITLE, PURCHASEPRICE, PURCHASEDATE) VALUES (?, ?, ?, ?, ?, ?)",
+            ((game_id, platforms[game_id % 4], genres[game_id % 6], titles[game_id % len(titles)], 40.0, "2023-01-01")
+             for game_id in range(1, rows + 1)))
+
+    return titles
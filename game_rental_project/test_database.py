@@ -0,0 +1,30 @@
+import sqlite3
+
+import pytest
+
+from database import DatabaseManager
+
+
+@pytest.fixture
+def db_manager(tmp_path):
+    """
+    A new database in a temporary directory, migrated to the latest schema.
+    """
+    db_manager = DatabaseManager(str(tmp_path / "GameRental.db"))
+    db_manager.create_tables()
+    return db_manager
+
+
+def test_failed_statement_rolls_back_its_transaction(db_manager):
+    with pytest.raises(sqlite3.OperationalError):
+        with db_manager.transaction() as cursor:
+            cursor.execute("INSERT INTO Rental (ID, RENTALDATE, CUSTOMERID) VALUES (1, '2024-01-01', '1234')")
+            db_manager.execute("SELECT * FROM NoSuchTable")
+
+    assert db_manager.execute("SELECT COUNT(*) FROM Rental") == [(0,)]
+
+
+def test_failed_statement_outside_a_transaction_returns_none(db_manager, capsys):
+    assert db_manager.execute("SELECT * FROM NoSuchTable") is None
+    assert db_manager.executemany("INSERT INTO NoSuchTable VALUES (?)", [(1,)]) is None
+    assert "no such table" in capsys.readouterr().out
@@ -0,0 +1,28 @@
+import threading
+
+from analyticsSnapshot import AnalyticsSnapshot
+from database import DatabaseManager
+from gameSelect import GameSelect
+
+
+def test_analytics_snapshot_is_refreshed_once_across_threads(tmp_path, monkeypatch):
+    db_manager = DatabaseManager(str(tmp_path / "GameRental.db"))
+    db_manager.create_tables()
+    db_manager.execute("INSERT INTO Games (ID, TITLE, GENRE, PLATFORM, PURCHASEDATE, PURCHASEPRICE) "
+                       "VALUES (1, 'zelda', 'adventure', 'switch', '2023-01-01', 50.0)")
+    db_manager.execute("INSERT INTO Rental (ID, RENTALDATE, RETURNDATE, CUSTOMERID) "
+                       "VALUES (1, '2023-02-01', '2023-02-08', '1234')")
+
+    refreshes = []
+    refresh = AnalyticsSnapshot.refresh
+    monkeypatch.setattr(AnalyticsSnapshot, "refresh",
+                        lambda snapshot, full=False: refreshes.append(full) or refresh(snapshot, full))
+
+    game_select = GameSelect(db_manager)
+    # Each thread reads through its own pooled connection, as the service's and server's reader threads do
+    for _ in range(2):
+        thread = threading.Thread(target=game_select.analytics_snapshot)
+        thread.start()
+        thread.join()
+
+    assert len(refreshes) == 1
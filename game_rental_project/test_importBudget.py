@@ -0,0 +1,8 @@
+from importBudget import BUDGET_MS, CORE_MODULES, HEAVY_MODULES, measure_imports
+
+
+def test_core_modules_import_within_budget_without_analytics_stack():
+    milliseconds, loaded = measure_imports(CORE_MODULES, runs=3)
+
+    assert milliseconds <= BUDGET_MS, f"importing {', '.join(CORE_MODULES)} took {milliseconds:.1f} ms"
+    assert [module for module in HEAVY_MODULES if module in loaded] == []
@@ -0,0 +1,17 @@
+import sqlite3
+
+import pytest
+
+from queryMetrics import InstrumentedConnection, QueryMetrics
+
+
+def test_closed_connection_raises_sqlite_error(tmp_path):
+    connection = sqlite3.connect(str(tmp_path / "metrics.db"), factory=InstrumentedConnection)
+    connection.metrics = QueryMetrics()
+    cursor = connection.cursor()
+    connection.close()
+
+    with pytest.raises(sqlite3.ProgrammingError):
+        connection.execute("SELECT 1")
+    with pytest.raises(sqlite3.ProgrammingError):
+        cursor.execute("SELECT 1")
@@ -0,0 +1,46 @@
+import pytest
+
+from database import DatabaseManager, POPULARITY_REBUILD_SQL
+
+
+@pytest.fixture
+def db_manager(tmp_path):
+    """
+    A new database in a temporary directory, migrated to the latest schema.
+    """
+    db_manager = DatabaseManager(str(tmp_path / "GameRental.db"))
+    db_manager.create_tables()
+    return db_manager
+
+
+def uses_index(plan, table, index):
+    """
+    Checks that a plan looks up table through index rather than scanning it. The plan names the table as the
+    query spells it, so it is compared case-insensitively.
+    """
+    return any(step.startswith(("SEARCH", "SCAN")) and f" {table.lower()} " in f"{step.lower()} "
+               and f"INDEX {index}" in step for step in plan)
+
+
+def test_availability_check_uses_active_rental_index(db_manager):
+    plan = db_manager.explain_query_plan("SELECT 1 FROM Rental WHERE ID = ? AND RETURNDATE IS NULL", (5,))
+    assert uses_index(plan, "Rental", "idx_rental_active"), plan
+
+
+def test_rental_limit_check_uses_customer_index(db_manager):
+    plan = db_manager.explain_query_plan("SELECT COUNT(*) FROM Rental WHERE CUSTOMERID = ? AND RETURNDATE IS NULL",
+                                         ("1234",))
+    assert uses_index(plan, "Rental", "idx_rental_customer"), plan
+
+
+@pytest.mark.parametrize("query", POPULARITY_REBUILD_SQL)
+def test_popularity_join_looks_up_rentals_by_index(db_manager, query):
+    plan = db_manager.explain_query_plan(query)
+    # Games is read once in full, but each game's rentals must be found through an index on Rental.ID
+    assert any(step.startswith("SEARCH R ") and "INDEX" in step for step in plan), plan
+    assert not any(step.startswith("SCAN R") for step in plan), plan
+
+
+def test_title_lookup_uses_title_index(db_manager):
+    plan = db_manager.explain_query_plan("SELECT PURCHASEPRICE FROM GAMES WHERE TITLE = ?", ("zelda",))
+    assert uses_index(plan, "Games", "idx_games_title"), plan
@@ -0,0 +1,13 @@
+import pytest
+
+from stressTest import run_stress
+
+
+@pytest.mark.parametrize("processes", [False, True])
+def test_concurrent_terminals_never_double_rent_or_exceed_limits(tmp_path, processes):
+    # Few copies and customers, so terminals keep racing for the same copies and the same Basic limits
+    totals, wall_time, problems = run_stress(str(tmp_path), terminals=4, attempts=300, customers=10, games=20,
+                                             processes=processes)
+
+    assert problems == []
+    assert sum(total[0] for total in totals) > 0